@@ -1,14 +1,24 @@
 from __future__ import annotations
 
+import json
+from datetime import datetime, timezone
+from functools import partial
+from importlib.metadata import PackageNotFoundError, version
+
 from dask.distributed import Client, as_completed
 from loguru import logger
 from pydantic import BaseModel
 
-from cosmap.analysis import dependencies, task
+from cosmap.analysis import dependencies, task, utils
+from cosmap.analysis.convergence import ConvergenceMonitor
 from cosmap.analysis.sampler import Sampler
 from cosmap.analysis.setup import handle_setup
-from cosmap.dataset import get_dataset
-from cosmap.output import get_output_handler
+from cosmap.dataset import get_capabilities, get_dataset
+from cosmap.dataset.filters import build_filters
+from cosmap.dataset.realizations import get_realizations
+from cosmap.dataset.slices import redshift_filters
+from cosmap.output import fusedOutputHandler, get_output_handler, in_background
+from cosmap.output.schema import column_dtype, parse_schema
 from cosmap.plugins import register_plugins
 
 
@@ -16,6 +26,104 @@ class CosmapAnalysisException(Exception):
     pass
 
 
+def get_run_info(parameters: BaseModel, realizations: list = None) -> dict:
+    """
+    Information about the run that is handed to the output writers, so they can
+    lay out their files up front and record how the output was made.
+    """
+    sampling_parameters = parameters.sampling_parameters
+    dataset_parameters = parameters.dataset_parameters
+    n_outputs = len(task.get_sweep_points(parameters.sweep))
+    try:
+        cosmap_version = version("cosmap")
+    except PackageNotFoundError:
+        cosmap_version = "unknown"
+    metadata = {
+        "cosmap_version": cosmap_version,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "n_samples": sampling_parameters.n_samples,
+        "sample_type": sampling_parameters.sample_type,
+        "sample_shape": sampling_parameters.sample_shape,
+        "sample_dimensions": str(sampling_parameters.sample_dimensions),
+        "dataset_wrapper": dataset_parameters.dataset_wrapper,
+        "dataset": str(
+            dataset_parameters.dataset_name or dataset_parameters.dataset_path
+        ),
+    }
+    if parameters.sweep:
+        metadata.update({"sweep": json.dumps(parameters.sweep)})
+    if realizations is not None:
+        metadata.update({"n_realizations": len(realizations)})
+    schema = get_output_schema(parameters, realizations)
+    if isinstance(schema, dict):
+        metadata.update(
+            {"schema": json.dumps({k: s.to_dict() for k, s in schema.items()})}
+        )
+    elif schema is not None:
+        metadata.update({"schema": json.dumps(schema.to_dict())})
+    return {
+        "expected_rows": sampling_parameters.n_samples
+        * n_outputs
+        * len(realizations or [None]),
+        "metadata": metadata,
+        "schema": schema,
+    }
+
+
+def get_output_schema(parameters: BaseModel, realizations: list = None):
+    """
+    Get the schema declared by the output transformation with "output-schema", or
+    None if it doesn't declare one. Analyses with several output files get one
+    schema per output. The columns cosmap adds to every output (the realization
+    name, and the swept parameters) are added to the schema if they aren't
+    declared. With several apertures, the declared columns are repeated for each
+    aperture, as they are in the outputs.
+    """
+    transformations = parameters.analysis_parameters.transformations["Main"]
+    declared = next(
+        (
+            t.get("output-schema")
+            for t in transformations.values()
+            if t.get("is-output")
+        ),
+        None,
+    )
+    if declared is None:
+        return None
+    extra_columns = {}
+    if realizations is not None:
+        extra_columns.update({"realization": "str"})
+    for name, values in parameters.sweep.items():
+        column = name.split(".")[-1]
+        extra_columns.update({column: column_dtype(column, values)})
+
+    apertures = task.get_apertures(parameters.sampling_parameters.sample_dimensions)
+
+    def build_schema(columns: dict):
+        schema = parse_schema(columns)
+        if apertures is not None:
+            schema = schema.for_apertures(apertures[1])
+        return schema.with_columns(extra_columns)
+
+    output_paths = parameters.output_parameters.output_paths
+    if not isinstance(output_paths, dict):
+        return build_schema(declared)
+    if missing := set(output_paths) - set(declared):
+        raise CosmapAnalysisException(
+            f"The output schema must be given for every output, but is missing"
+            f" {sorted(missing)}"
+        )
+    return {name: build_schema(declared[name]) for name in output_paths}
+
+
+def same_value(a, b) -> bool:
+    try:
+        return bool(a == b)
+    except (TypeError, ValueError):
+        # Array-like values (e.g. quantities) compare element by element
+        return repr(a) == repr(b)
+
+
 class CosmapAnalysis:
     """
     The Analysis class is the central class of Cosmap. It defines
@@ -32,40 +140,113 @@ class CosmapAnalysis:
 
     """
 
-    def __init__(self, analysis_paramters: BaseModel, **kwargs):
+    def __init__(self, analysis_paramters: BaseModel, setup: bool = True, **kwargs):
         self.parameters = analysis_paramters
-        self.setup()
+        if setup:
+            self.setup()
 
     def setup(self, *args, **kwargs):
         self.verify_analysis()
+        self.load_plugins()
+        samples = self.build_samples()
+        self.run_setup_block()
+        self.dataset_plugin = self.build_dataset()
+        self.realizations = self.find_realizations()
+        needed_columns = self.find_needed_data()
+        capabilities = get_capabilities(self.dataset_plugin)
+
+        self.output_handler = in_background(
+            get_output_handler(
+                self.parameters.output_parameters,
+                get_run_info(self.parameters, self.realizations),
+            ),
+            self.parameters.output_parameters,
+        )
+        self.client = Client(
+            **task.get_worker_layout(self.parameters.threads, capabilities)
+        )
+        self.client.register_worker_plugin(self.dataset_plugin)
 
+        self.tasks = task.get_tasks(
+            self.client,
+            self.parameters,
+            self.main_graph,
+            self.needed_datatypes,
+            samples,
+            needed_columns=needed_columns,
+            dataset_capabilities=capabilities,
+            realizations=self.realizations,
+        )
+
+    def load_plugins(self):
         if hasattr(self.parameters.analysis_parameters, "plugins"):
             register_plugins(self.parameters.analysis_definition.plugins)
+
+    def build_samples(self):
         self.sampler = Sampler(
-            self.parameters.sampling_parameters, self.parameters.analysis_parameters
+            self.parameters.sampling_parameters,
+            self.parameters.analysis_parameters,
+            box_size=self.parameters.dataset_parameters.box_size,
         )
-        self.dataset_plugin = get_dataset(self.parameters.dataset_parameters)
         self.sampler.initialize_sampler()
 
         samples = self.sampler.generate_samples(
             n_samples=self.parameters.sampling_parameters.n_samples
         )
-        if "Setup" in self.parameters.analysis_parameters.transformations:
-            new_params = handle_setup(
-                self.parameters, self.parameters.analysis_parameters.transformations
+        # Some samplers (like targets) may produce fewer samples than asked for
+        self.parameters.sampling_parameters.n_samples = len(samples)
+        return samples
+
+    def run_setup_block(self):
+        if "Setup" not in self.parameters.analysis_parameters.transformations:
+            return
+        new_params = handle_setup(
+            self.parameters, self.parameters.analysis_parameters.transformations
+        )
+        new_param_input = {}
+        new_analysis_parameters = {}
+        for name, block in new_params.items():
+            if name.split(".")[0] == "Main":
+                new_param_input.update({".".join(name.split(".")[1:]): block})
+            else:
+                new_analysis_parameters.update({name: block})
+        if new_analysis_parameters:
+            new_param_input.update({"analysis_parameters": new_analysis_parameters})
+
+        self.parameters = self.update_parameters(self.parameters, new_param_input)
+
+    def build_dataset(self):
+        # Filters may reference parameters created by the setup block, so the
+        # dataset can only be configured once the setup has run.
+        row_filters = build_filters(
+            self.parameters.dataset_parameters.filters, self.parameters
+        )
+        sampling_parameters = self.parameters.sampling_parameters
+        if (bins := sampling_parameters.redshift_bins) is not None:
+            for dtype in sampling_parameters.slice_dtypes:
+                row_filters.setdefault(dtype, []).extend(
+                    redshift_filters(bins, sampling_parameters.redshift_column)
+                )
+        return get_dataset(self.parameters.dataset_parameters, row_filters=row_filters)
+
+    def find_realizations(self):
+        """
+        Get the names of the dataset's realizations, or None if the dataset is
+        not split into realizations.
+        """
+        realizations = get_realizations(self.dataset_plugin)
+        if self.parameters.dataset_parameters.realizations and realizations is None:
+            raise CosmapAnalysisException(
+                f"The {self.parameters.dataset_parameters.dataset_wrapper} dataset"
+                " wrapper does not support multiple realizations!"
             )
-            new_param_input = {}
-            new_analysis_parameters = {}
-            for name, block in new_params.items():
-                if name.split(".")[0] == "Main":
-                    new_param_input.update({".".join(name.split(".")[1:]): block})
-                else:
-                    new_analysis_parameters.update({name: block})
-            if new_analysis_parameters:
-                new_param_input.update({"analysis_parameters": new_analysis_parameters})
-
-            self.parameters = self.update_parameters(self.parameters, new_param_input)
+        return realizations
 
+    def find_needed_data(self) -> dict:
+        """
+        Find the data types needed by the transformations, and return the columns
+        they need from each.
+        """
         transformations = self.parameters.analysis_parameters.transformations["Main"]
 
         self.needed_datatypes = [
@@ -75,20 +256,7 @@ class CosmapAnalysis:
             [item for sublist in self.needed_datatypes for item in sublist]
         )
         self.parameters.sampling_parameters.dtypes = self.needed_datatypes
-
-        self.output_handler = get_output_handler(self.parameters.output_parameters)
-        self.client = Client(
-            n_workers=self.parameters.threads - 1, threads_per_worker=1
-        )
-        self.client.register_worker_plugin(self.dataset_plugin)
-
-        self.tasks = task.get_tasks(
-            self.client,
-            self.parameters,
-            self.main_graph,
-            self.needed_datatypes,
-            samples,
-        )
+        return utils.get_needed_columns(transformations)
 
     def verify_analysis(self):
         """
@@ -149,14 +317,223 @@ class CosmapAnalysis:
 
     def run(self, *args, **kwargs):
         n_completed = 0
-        for future in as_completed(futures=self.tasks):
-            result = future.result()
-            n_completed += len(result)
-            self.output_handler.take_outputs(result)
+        n_outputs = self.outputs_per_sample()
+        n_samples = self.parameters.sampling_parameters.n_samples * len(
+            self.realizations or [None]
+        )
+        monitor = None
+        if (convergence := self.parameters.convergence) is not None:
+            monitor = ConvergenceMonitor(convergence)
+        self.stop_reason = None
+        try:
+            for future in as_completed(futures=self.tasks):
+                result = future.result()
+                n_completed += len(result) // n_outputs
+                self.output_handler.take_outputs(result)
+                logger.info(f"Completed {n_completed} of {n_samples} samples")
+                self.output_handler.write_output()
+                if monitor is None:
+                    continue
+                monitor.update(result, n_outputs)
+                if monitor.converged:
+                    self.stop_reason = monitor.summary()
+                    break
+            else:
+                self.stop_reason = "All samples completed"
+        finally:
+            # Cancel first, so the workers don't keep running chunks while the last
+            # outputs are written
+            outstanding = [f for f in self.tasks if not f.done()]
+            if outstanding:
+                self.client.cancel(outstanding)
+            self.output_handler.add_metadata(
+                {
+                    "stop_reason": self.stop_reason or "Interrupted",
+                    "n_completed_samples": n_completed,
+                }
+            )
+            # Some writers only produce a valid file once they are closed
+            self.output_handler.close()
+
+        if monitor is not None and monitor.converged:
+            logger.info(
+                f"Stopping early after {n_completed} samples, cancelled"
+                f" {len(outstanding)} outstanding chunks. {self.stop_reason}"
+            )
+        else:
+            logger.info("All samples completed!")
+        self.report_cache_statistics()
+
+    def outputs_per_sample(self) -> int:
+        # Each sample produces one output per sweep point
+        return len(task.get_sweep_points(self.parameters.sweep))
+
+    def report_cache_statistics(self):
+        """
+        Log the combined hit rate of each cache layer across all workers.
+        """
+        totals = {}
+        for statistics in self.client.run(task.get_cache_statistics).values():
+            for name, counts in statistics.items():
+                total = totals.setdefault(name, {"hits": 0, "misses": 0})
+                total["hits"] += counts["hits"]
+                total["misses"] += counts["misses"]
+        for name, total in totals.items():
+            lookups = total["hits"] + total["misses"]
+            rate = total["hits"] / lookups if lookups else 0.0
             logger.info(
-                f"Completed {n_completed} of "
-                f"{self.parameters.sampling_parameters.n_samples} samples"
+                f"{name.capitalize()} cache: {total['hits']} hits,"
+                f" {total['misses']} misses ({rate:.1%} hit rate)"
+            )
+
+
+class CosmapFusedAnalysis(CosmapAnalysis):
+    """
+    Runs several analyses (or variants of the same analysis) over a single stream
+    of samples. The analyses share the sampler, the dataset and the cluster, so each
+    sample's data is only fetched once and then handed to every analysis's Main
+    block. Each analysis keeps its own Setup block, parameters and output handler.
+
+    The sampling and dataset parameters are shared, so every analysis must give the
+    same values for them. If an analysis rejects a sample, only that analysis loses
+    its output for the sample.
+    """
+
+    def __init__(self, analysis_parameters: dict, **kwargs):
+        if not analysis_parameters:
+            raise CosmapAnalysisException("No analyses were given to run!")
+        self.members = {
+            name: CosmapAnalysis(parameters, setup=False)
+            for name, parameters in analysis_parameters.items()
+        }
+        output_paths = [
+            m.parameters.output_parameters.base_output_path
+            for m in self.members.values()
+            if m.parameters.output_parameters.output_paths is None
+        ]
+        if len(set(output_paths)) < len(output_paths):
+            raise CosmapAnalysisException(
+                "Analyses that are run together must write to different output paths!"
+            )
+        for block in ("sampling_parameters", "dataset_parameters"):
+            self.check_shared_parameters(
+                {
+                    name: getattr(m.parameters, block).model_dump()
+                    for name, m in self.members.items()
+                },
+                block,
+            )
+        self.parameters = next(iter(self.members.values())).parameters
+        self.setup()
+
+    def setup(self, *args, **kwargs):
+        self.verify_analysis()
+        for member in self.members.values():
+            member.load_plugins()
+        samples = self.build_samples()
+        for member in self.members.values():
+            member.parameters.sampling_parameters.n_samples = len(samples)
+            member.run_setup_block()
+        self.parameters = next(iter(self.members.values())).parameters
+        self.dataset_plugin = self.build_dataset()
+        self.realizations = self.find_realizations()
+
+        transformations = {}
+        for name, member in self.members.items():
+            member.find_needed_data()
+            member_transformations = (
+                member.parameters.analysis_parameters.transformations
+            )
+            transformations.update(
+                {
+                    f"{name}.{t}": block
+                    for t, block in member_transformations["Main"].items()
+                }
             )
-            self.output_handler.write_output()
+        self.needed_datatypes = set.union(
+            *[m.needed_datatypes for m in self.members.values()]
+        )
+        self.parameters.sampling_parameters.dtypes = self.needed_datatypes
+        needed_columns = utils.get_needed_columns(transformations)
+        capabilities = get_capabilities(self.dataset_plugin)
+
+        self.output_handler = in_background(
+            fusedOutputHandler(
+                {
+                    name: get_output_handler(
+                        m.parameters.output_parameters,
+                        get_run_info(m.parameters, self.realizations),
+                    )
+                    for name, m in self.members.items()
+                }
+            ),
+            self.parameters.output_parameters,
+        )
+        self.client = Client(
+            **task.get_worker_layout(self.parameters.threads, capabilities)
+        )
+        self.client.register_worker_plugin(self.dataset_plugin)
+
+        pipeline_function = partial(
+            task.fused_pipeline,
+            pipelines={
+                name: task.build_pipeline(m.parameters, m.main_graph)
+                for name, m in self.members.items()
+            },
+        )
+        self.tasks = task.get_tasks(
+            self.client,
+            self.parameters,
+            self.main_graph,
+            self.needed_datatypes,
+            samples,
+            needed_columns=needed_columns,
+            dataset_capabilities=capabilities,
+            pipeline_function=pipeline_function,
+            realizations=self.realizations,
+        )
+
+    def build_dataset(self):
+        # Filters can reference parameters from each analysis' setup block, so they
+        # can only be compared once those have run
+        self.check_shared_parameters(
+            {
+                name: {
+                    dtype: [repr(f) for f in filters]
+                    for dtype, filters in build_filters(
+                        m.parameters.dataset_parameters.filters, m.parameters
+                    ).items()
+                }
+                for name, m in self.members.items()
+            },
+            "dataset filters",
+        )
+        return super().build_dataset()
+
+    def check_shared_parameters(self, values: dict, block: str):
+        """
+        Check that every analysis gives the same values (keyed by analysis name) for
+        a set of shared parameters.
+        """
+        first_name, first = next(iter(values.items()))
+        for name, member_values in values.items():
+            different = [
+                key
+                for key in first.keys() | member_values.keys()
+                if not same_value(first.get(key), member_values.get(key))
+            ]
+            if different:
+                raise CosmapAnalysisException(
+                    f"Analyses that are run together must share their {block}, but"
+                    f" {first_name} and {name} have different values for"
+                    f" {sorted(different)}"
+                )
+
+    def verify_analysis(self):
+        for member in self.members.values():
+            member.verify_analysis()
+        self.main_graph = next(iter(self.members.values())).main_graph
 
-        logger.info("All samples completed!")
+    def outputs_per_sample(self) -> int:
+        # Sweep outputs are grouped by analysis, so there is one output per sample
+        return 1
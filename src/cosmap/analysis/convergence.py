@@ -0,0 +1,255 @@
+import numpy as np
+from loguru import logger
+from pydantic import BaseModel
+from scipy.stats import norm
+
+"""
+Convergence tracking for early stopping. As chunks complete, we keep running
+estimates of the statistics of a few output columns, and the run can stop as soon
+as every one of them is known to the requested relative precision.
+
+Means are tracked with a batched form of Welford's algorithm, and their precision
+is the standard error of the mean. Quantiles are tracked from a bounded, sorted
+window of values around them, and their precision is half the width of the
+distribution-free (order statistic) confidence interval. In both cases the
+precision is divided by the absolute value of the estimate, so a target of 0.01
+means "known to within about 1%".
+
+Outputs that hold several rows (several output files, parameter sweeps or several
+analyses run together) are tracked per row, and every one of them has to converge.
+"""
+
+
+class RunningMean:
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.__m2 = 0.0
+
+    def update(self, values: np.ndarray):
+        # Combine the running moments with those of the new batch
+        n = len(values)
+        if not n:
+            return
+        batch_mean = values.mean()
+        batch_m2 = ((values - batch_mean) ** 2).sum()
+        delta = batch_mean - self.mean
+        total = self.n + n
+        self.mean += delta * n / total
+        self.__m2 += batch_m2 + delta**2 * self.n * n / total
+        self.n = total
+
+    @property
+    def estimate(self) -> float:
+        return self.mean
+
+    @property
+    def error(self) -> float:
+        if self.n < 2:
+            return np.inf
+        return np.sqrt(self.__m2 / (self.n - 1) / self.n)
+
+
+class RunningQuantile:
+    """
+    Tracks a quantile, and the order statistics around it that are needed for its
+    confidence interval, without keeping every value. Values are kept sorted, and
+    new batches are merged in. Once more than max_values are kept, values whose
+    rank is far outside the confidence interval are dropped, and only counted. The
+    interval narrows (relative to the number of values) as more values come in, so
+    with independent samples the dropped values are never needed again.
+    """
+
+    def __init__(self, quantile: float, confidence: float, max_values: int = 100000):
+        self.quantile = quantile
+        self.max_values = max_values
+        self.n = 0
+        self.__z = norm.ppf(0.5 + confidence / 2)
+        self.__values = np.zeros(0)
+        # Values below the low cut (or above the high cut) have been dropped
+        self.__below = 0
+        self.__low_cut = -np.inf
+        self.__high_cut = np.inf
+
+    def update(self, values: np.ndarray):
+        values = np.asarray(values, dtype=np.float64)
+        self.n += len(values)
+        below = values < self.__low_cut
+        self.__below += int(np.count_nonzero(below))
+        values = np.sort(values[~below & (values <= self.__high_cut)])
+        self.__values = np.insert(
+            self.__values, np.searchsorted(self.__values, values), values
+        )
+        if len(self.__values) > self.max_values:
+            self.__trim()
+
+    @property
+    def stored(self) -> int:
+        """
+        The number of values currently kept.
+        """
+        return len(self.__values)
+
+    @property
+    def estimate(self) -> float:
+        if not self.n:
+            return np.nan
+        # The same interpolation as np.quantile
+        position = (self.n - 1) * self.quantile
+        low = int(np.floor(position))
+        values = self.__at_ranks(low, min(low + 1, self.n - 1))
+        if values is None:
+            return np.nan
+        return values[0] + (position - low) * (values[1] - values[0])
+
+    @property
+    def error(self) -> float:
+        if self.n < 2:
+            return np.inf
+        low, high = self.__interval_ranks()
+        if low < 0 or high >= self.n:
+            return np.inf
+        values = self.__at_ranks(low, high)
+        if values is None:
+            return np.inf
+        return (values[1] - values[0]) / 2
+
+    def __interval_ranks(self) -> tuple:
+        n, q = self.n, self.quantile
+        spread = self.__z * np.sqrt(n * q * (1 - q))
+        return int(np.floor(n * q - spread)), int(np.ceil(n * q + spread))
+
+    def __at_ranks(self, *ranks):
+        """
+        Get the values with the given ranks, or None if any have been dropped.
+        """
+        indices = np.asarray(ranks) - self.__below
+        if indices.min() < 0 or indices.max() >= len(self.__values):
+            return None
+        return self.__values[indices]
+
+    def __trim(self):
+        low, high = self.__interval_ranks()
+        margin = max(high - low, self.max_values // 4)
+        start = max(0, low - margin - self.__below)
+        stop = min(len(self.__values), high + margin + 1 - self.__below)
+        if start > 0:
+            self.__low_cut = self.__values[start]
+            self.__below += start
+        if stop < len(self.__values):
+            self.__high_cut = self.__values[stop - 1]
+        self.__values = self.__values[start:stop].copy()
+
+
+class ConvergenceMonitor:
+    """
+    Tracks the statistics of the columns named in the convergence parameters,
+    across every output that contains them.
+    """
+
+    def __init__(self, parameters: BaseModel):
+        self.parameters = parameters
+        self.statistics = {}
+        self.__checked_columns = False
+
+    def update(self, outputs: list, outputs_per_sample: int = 1):
+        """
+        Add a batch of outputs. If each sample produces several outputs (for
+        parameter sweeps), they are tracked separately.
+        """
+        values = {}
+        for i, output in enumerate(outputs):
+            prefix = f"{i % outputs_per_sample}." if outputs_per_sample > 1 else ""
+            for name, value in flatten_output(output, prefix):
+                if name.split(".")[-1] in self.parameters.columns:
+                    values.setdefault(name, []).append(value)
+        if outputs and not self.__checked_columns:
+            self.__check_columns(values)
+        for name, column_values in values.items():
+            column_values = np.asarray(column_values, dtype=np.float64)
+            column_values = column_values[np.isfinite(column_values)]
+            if name not in self.statistics:
+                self.statistics[name] = {
+                    kind: get_statistic(kind, self.parameters.confidence)
+                    for kind in self.parameters.statistics
+                }
+            for statistic in self.statistics[name].values():
+                statistic.update(column_values)
+
+    def precision(self) -> dict:
+        """
+        Get the current relative precision of every tracked statistic, keyed by
+        "<output name>:<statistic>".
+        """
+        output = {}
+        for name, statistics in self.statistics.items():
+            for kind, statistic in statistics.items():
+                estimate = statistic.estimate
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    relative = statistic.error / abs(estimate)
+                output.update(
+                    {f"{name}:{kind}": float(np.nan_to_num(relative, nan=np.inf))}
+                )
+        return output
+
+    def __check_columns(self, values: dict):
+        """
+        Warn about tracked columns that aren't in the outputs, since they can never
+        converge.
+        """
+        self.__checked_columns = True
+        found = {name.split(".")[-1] for name in values}
+        if missing := [c for c in self.parameters.columns if c not in found]:
+            logger.warning(
+                f"The convergence columns {missing} are not in the outputs, so the"
+                " run will not stop early. Multiple apertures add the aperture label"
+                " to each column name (e.g. count_45arcsec)"
+            )
+
+    @property
+    def converged(self) -> bool:
+        statistics = [s for stats in self.statistics.values() for s in stats.values()]
+        if not statistics:
+            return False
+        if min(s.n for s in statistics) < self.parameters.min_samples:
+            return False
+        precision = self.precision()
+        return max(precision.values()) <= self.parameters.precision
+
+    def summary(self) -> str:
+        precision = self.precision()
+        worst = max(precision, key=precision.get)
+        return (
+            f"Reached a relative precision of {precision[worst]:.3g} or better"
+            f" (target {self.parameters.precision:g}) for"
+            f" {len(precision)} statistics. The least precise was {worst}"
+        )
+
+
+def get_statistic(kind, confidence: float):
+    """
+    Statistics are either "mean", "median" or a quantile between 0 and 1.
+    """
+    if kind == "mean":
+        return RunningMean()
+    elif kind == "median":
+        return RunningQuantile(0.5, confidence)
+    return RunningQuantile(float(kind), confidence)
+
+
+def flatten_output(output, prefix: str = ""):
+    """
+    Yield (name, value) for every scalar value in an output. Names of values in
+    nested outputs are joined with "."
+    """
+    if isinstance(output, list):
+        for i, item in enumerate(output):
+            yield from flatten_output(item, f"{prefix}{i}.")
+        return
+    if not isinstance(output, dict):
+        return
+    for key, value in output.items():
+        if isinstance(value, (dict, list)):
+            yield from flatten_output(value, f"{prefix}{key}.")
+        elif np.ndim(value) == 0 and np.issubdtype(np.asarray(value).dtype, np.number):
+            yield f"{prefix}{key}", value
@@ -13,6 +13,10 @@ def generate_tasks(
     needed_dtypes: list,
     samples: list,
     chunk_size: int = 1000,
+    needed_columns: dict = {},
+    dataset_capabilities=None,
+    pipeline_function=None,
+    realizations=None,
 ):
     """
     Generates tasks for the scheduler to execute. This function is called by the
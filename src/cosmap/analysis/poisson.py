@@ -0,0 +1,165 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from cosmap.dataset.neighbors import chord_length
+
+"""
+Minimum-separation (Poisson-disk) sampling on the sphere. Random samples that land
+close together mostly see the same objects, so their outputs are strongly
+correlated. A Poisson-disk sampler places samples uniformly but never closer than a
+given separation, so every sample adds independent information.
+
+Points are placed in two phases, both working on unit vectors and in batches, so
+every neighbor check is a vectorized KD-tree query:
+
+1. Dart throwing. Batches of candidates are drawn uniformly over the region, and
+   kept if they are far enough from every accepted point and from each other. This
+   is cheap while the region is mostly empty, and stops as soon as enough samples
+   have been placed.
+2. Once most darts miss, the remaining gaps are filled with Bridson's algorithm.
+   New candidates are proposed in an annulus around accepted points, and points
+   that no longer produce any valid candidates are retired. This continues until
+   enough samples have been placed, or the region is full.
+
+The cost grows with the number of samples asked for, rather than with the area of
+the region.
+"""
+
+# Switch from dart throwing to gap filling once fewer darts than this land
+MIN_DART_ACCEPTANCE = 0.1
+MIN_BATCH_SIZE = 1024
+# Points proposing new candidates at once, which bounds the memory used
+MAX_ACTIVE = 65536
+
+
+def poisson_disk_samples(
+    phi_range,
+    costheta_range,
+    min_separation: float,
+    rng: np.random.Generator,
+    n_samples: int = None,
+    n_candidates: int = 30,
+) -> np.ndarray:
+    """
+    Place points in a region of (phi, cos theta) that are at least
+    `min_separation` degrees apart, until there are n_samples of them or no more
+    will fit (if n_samples is None, the region is filled). Phi is in radians.
+    Returns an (n, 2) array of RA/Dec in degrees, in the order they were placed.
+    """
+    phi_low, phi_high = min(phi_range), max(phi_range)
+    z_low, z_high = min(costheta_range), max(costheta_range)
+    radius = np.radians(min_separation)
+    min_chord = chord_length(min_separation)
+    points = AcceptedPoints(min_chord)
+
+    def remaining():
+        return np.inf if n_samples is None else n_samples - len(points)
+
+    def in_region(vectors):
+        phi = np.arctan2(vectors[:, 1], vectors[:, 0]) % (2 * np.pi)
+        z = vectors[:, 2]
+        return (phi >= phi_low) & (phi <= phi_high) & (z >= z_low) & (z <= z_high)
+
+    while remaining() > 0:
+        batch_size = max(MIN_BATCH_SIZE, len(points))
+        phi = rng.uniform(phi_low, phi_high, batch_size)
+        z = rng.uniform(z_low, z_high, batch_size)
+        r = np.sqrt(1 - z**2)
+        darts = np.column_stack([r * np.cos(phi), r * np.sin(phi), z])
+        accepted = points.add(darts, remaining())
+        if len(accepted) < MIN_DART_ACCEPTANCE * batch_size:
+            break
+
+    active = rng.permutation(len(points))
+    while remaining() > 0 and len(active):
+        batch, active = active[:MAX_ACTIVE], active[MAX_ACTIVE:]
+        candidates = annulus_candidates(
+            points.vectors[batch], radius, n_candidates, rng
+        ).reshape(-1, 3)
+        sources = np.repeat(batch, n_candidates)
+        inside = in_region(candidates)
+        accepted = points.add(candidates[inside], remaining())
+        # Points that didn't produce any new points have no room left around them
+        productive = np.unique(sources[inside][accepted])
+        new = np.arange(len(points) - len(accepted), len(points))
+        active = np.concatenate([active, productive, new])
+
+    vectors = points.vectors
+    return np.column_stack(
+        [
+            np.degrees(np.arctan2(vectors[:, 1], vectors[:, 0])) % 360.0,
+            np.degrees(np.arcsin(np.clip(vectors[:, 2], -1.0, 1.0))),
+        ]
+    )
+
+
+class AcceptedPoints:
+    """
+    The points placed so far, with KD-trees for checking new candidates against
+    them. Rebuilding a single tree after every batch would be quadratic, so the
+    points are split into blocks whose sizes are powers of two, each with its own
+    tree. New points become a block, which is merged with the existing blocks until
+    it is the smallest. Every point is only rebuilt into a tree about log(n) times.
+    """
+
+    def __init__(self, min_chord: float):
+        self.min_chord = min_chord
+        self.__vectors = np.zeros((0, 3))
+        self.__blocks = []
+
+    def __len__(self):
+        return len(self.__vectors)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self.__vectors
+
+    def add(self, candidates: np.ndarray, limit=np.inf) -> np.ndarray:
+        """
+        Accept every candidate that is far enough from the accepted points and from
+        the candidates before it, up to a limit. Returns the indices of the
+        accepted candidates.
+        """
+        indices = np.arange(len(candidates))
+        for _, tree in self.__blocks:
+            distances, _ = tree.query(
+                candidates[indices], distance_upper_bound=self.min_chord, workers=-1
+            )
+            indices = indices[distances >= self.min_chord]
+        if len(indices) > 1:
+            # Of each pair that is too close, drop the later candidate. This may
+            # drop a few more than strictly needed, which only costs a few draws.
+            pairs = cKDTree(candidates[indices]).query_pairs(
+                self.min_chord, output_type="ndarray"
+            )
+            conflicts = np.zeros(len(indices), dtype=bool)
+            conflicts[pairs.max(axis=1)] = True
+            indices = indices[~conflicts]
+        if len(indices) > limit:
+            indices = indices[: int(limit)]
+        if len(indices):
+            self.__insert(candidates[indices])
+        return indices
+
+    def __insert(self, vectors: np.ndarray):
+        self.__vectors = np.concatenate([self.__vectors, vectors])
+        block = vectors
+        while self.__blocks and len(self.__blocks[-1][0]) <= len(block):
+            block = np.concatenate([self.__blocks.pop()[0], block])
+        self.__blocks.append((block, cKDTree(block)))
+
+
+def annulus_candidates(points, radius: float, n: int, rng: np.random.Generator):
+    """
+    Propose n unit vectors between radius and 2 * radius (in radians) from each of
+    an (m, 3) array of points, in random directions. Returns an (m, n, 3) array.
+    """
+    points = np.atleast_2d(points)[:, None, :]
+    helper = np.where(np.abs(points[..., :1]) < 0.9, np.eye(3)[0], np.eye(3)[1])
+    east = np.cross(helper, points)
+    east /= np.linalg.norm(east, axis=-1, keepdims=True)
+    north = np.cross(points, east)
+    distance = rng.uniform(radius, 2 * radius, size=(len(points), n, 1))
+    bearing = rng.uniform(0, 2 * np.pi, size=(len(points), n, 1))
+    direction = np.cos(bearing) * east + np.sin(bearing) * north
+    return np.cos(distance) * points + np.sin(distance) * direction
@@ -3,9 +3,12 @@ from typing import final
 
 import astropy.units as u
 import numpy as np
-from astropy.coordinates import SkyCoord
+from loguru import logger
 from pydantic import BaseModel
 
+from cosmap.analysis.poisson import poisson_disk_samples
+from cosmap.analysis.targets import draw_targets, select_targets
+from cosmap.dataset.batch import as_center_array
 from cosmap.plugins import register, register_plugins, request
 
 
@@ -13,11 +16,30 @@ class CosmapSamplerException(Exception):
     pass
 
 
-def Sampler(sampler_parameters: BaseModel, analysis_parameters: BaseModel):
+# Sample shapes in comoving Cartesian coordinates, for periodic simulation boxes
+CARTESIAN_SHAPES = ("Sphere", "Cube")
+
+
+def Sampler(
+    sampler_parameters: BaseModel,
+    analysis_parameters: BaseModel,
+    box_size: float = None,
+):
     sample_type = sampler_parameters.sample_type
     if sample_type == "Random":
-        register_plugins(RandomSampler)
-    return CosmapSampler(sampler_parameters, analysis_parameters)
+        if sampler_parameters.sample_shape in CARTESIAN_SHAPES:
+            register_plugins(CartesianRandomSampler)
+        else:
+            register_plugins(RandomSampler)
+    elif sample_type == "Targets":
+        register_plugins(TargetSampler)
+    elif sample_type == "PoissonDisk":
+        if sampler_parameters.sample_shape in CARTESIAN_SHAPES:
+            raise CosmapSamplerException(
+                "Poisson-disk sampling is only supported for sky samples"
+            )
+        register_plugins(PoissonDiskSampler)
+    return CosmapSampler(sampler_parameters, analysis_parameters, box_size)
 
 
 def get_frame_width(sample_shape: str, sample_dimensions):
@@ -40,10 +62,27 @@ class CosmapSampler:
     all the hooks necessary to run.
     """
 
-    def __init__(self, sampler_parameters, analysis_parameters):
+    def __init__(self, sampler_parameters, analysis_parameters, box_size=None):
         self.sampler_parameters = sampler_parameters
         self.analysis_parameters = analysis_parameters
-        self.build_frame()
+        self.box_size = box_size
+        if self.cartesian and box_size is None:
+            raise CosmapSamplerException(
+                f"Sample shape {sampler_parameters.sample_shape} is only supported"
+                " for simulation boxes. Set dataset_parameters.box_size"
+            )
+        # Targets are placed wherever the catalog puts them, so they don't need a
+        # frame to be drawn from
+        if not self.cartesian and sampler_parameters.sample_type != "Targets":
+            self.build_frame()
+
+    @property
+    def cartesian(self) -> bool:
+        """
+        Samples in a periodic box are drawn in comoving Cartesian coordinates,
+        and can be placed anywhere in the box.
+        """
+        return self.sampler_parameters.sample_shape in CARTESIAN_SHAPES
 
     def build_frame(self):
         """
@@ -106,11 +145,12 @@ class CosmapSampler:
     @staticmethod
     def samples_to_radec(phis, thetas):
         """
-        Convert values drawn from the sample to ra, dec coordinates
+        Convert values drawn from the sample to ra, dec coordinates. Returns an
+        (n, 2) float64 array in degrees.
         """
-        ras = np.degrees(phis) * u.degree
-        decs = (90 - np.degrees(np.arccos(thetas))) * u.degree
-        return np.array([ras, decs])
+        ras = np.degrees(phis)
+        decs = 90 - np.degrees(np.arccos(thetas))
+        return np.column_stack([ras, decs])
 
     def initialize_sampler(self):
         """
@@ -125,8 +165,17 @@ class CosmapSampler:
         )
 
     def generate_samples(self, n_samples: int):
+        """
+        Sample centers are passed around as an (n, 2) array of RA/Dec in degrees.
+        Plugins may also return a SkyCoord, which will be converted. Samples in
+        a box are an (n, 3) array of positions, wrapped into the box.
+        """
         func = request("generate_samples")
-        return func(sampler=self, n_samples=n_samples)
+        samples = func(sampler=self, n_samples=n_samples)
+        if self.cartesian:
+            positions = np.asarray(samples, dtype=np.float64).reshape(-1, 3)
+            return positions % self.box_size
+        return as_center_array(samples)
 
 
 class RandomSampler:
@@ -135,10 +184,70 @@ class RandomSampler:
         vals = sampler._sampler.uniform(
             sampler._low_sampler_range, sampler._high_sampler_range, size=(n_samples, 2)
         )
-        coords = sampler.samples_to_radec(vals[:, 0], vals[:, 1])
-        coords = SkyCoord(coords[0], coords[1], unit="deg")
-        return coords
+        return sampler.samples_to_radec(vals[:, 0], vals[:, 1])
 
     @register
     def initialize_sampler(sampler):
         sampler._sampler = np.random.default_rng()
+
+
+class PoissonDiskSampler:
+    """
+    Places n_samples samples in the region that are at least min_separation apart
+    (see `cosmap.analysis.poisson`). By default the samples are just far enough
+    apart that they don't overlap.
+    """
+
+    @register
+    def generate_samples(sampler, n_samples):
+        samples = poisson_disk_samples(
+            (sampler._low_sampler_range[0], sampler._high_sampler_range[0]),
+            (sampler._low_sampler_range[1], sampler._high_sampler_range[1]),
+            sampler._min_separation,
+            sampler._sampler,
+            n_samples=n_samples,
+        )
+        if n_samples > len(samples):
+            logger.warning(
+                f"Only {len(samples)} samples fit in the region with a minimum"
+                f" separation of {sampler._min_separation:.4g} deg. Asked for"
+                f" {n_samples}"
+            )
+        return samples
+
+    @register
+    def initialize_sampler(sampler, sampling_parameters):
+        min_separation = sampling_parameters.min_separation
+        if min_separation is None:
+            min_separation = 2 * get_frame_width(
+                sampling_parameters.sample_shape, sampling_parameters.sample_dimensions
+            )
+        sampler._min_separation = min_separation.to_value(u.deg)
+        sampler._sampler = np.random.default_rng()
+
+
+class CartesianRandomSampler:
+    @register
+    def generate_samples(sampler, n_samples):
+        return sampler._sampler.uniform(0, sampler.box_size, size=(n_samples, 3))
+
+    @register
+    def initialize_sampler(sampler):
+        sampler._sampler = np.random.default_rng()
+
+
+class TargetSampler:
+    """
+    Centers samples on objects from a target catalog, see `cosmap.analysis.targets`.
+    """
+
+    @register
+    def generate_samples(sampler, n_samples):
+        return draw_targets(sampler._targets, n_samples, sampler._sampler)
+
+    @register
+    def initialize_sampler(sampler, sampling_parameters, analysis_parameters):
+        sampler._targets = select_targets(
+            sampling_parameters.targets, analysis_parameters, sampler.cartesian
+        )
+        sampler._sampler = np.random.default_rng(sampling_parameters.targets.seed)
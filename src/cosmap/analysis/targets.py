@@ -0,0 +1,125 @@
+import os
+import shutil
+from pathlib import Path
+from types import SimpleNamespace
+from uuid import uuid4
+
+import numpy as np
+from astropy.table import Table
+from loguru import logger
+from pydantic import BaseModel
+
+from cosmap.dataset.cache import cache_key, read_tile, write_tile
+from cosmap.dataset.filters import apply_filters, build_filters
+from cosmap.dataset.geometry import to_degrees
+
+"""
+Samples centered on objects from a target catalog (halos, clusters, lens
+candidates...), rather than drawn at random. The catalog is read once, cut with the
+target filters in a single vectorized pass, and only the coordinates (and weights)
+of the targets that pass are kept.
+
+If a cache path is given, the selection is stored there, keyed by the catalog file
+and everything that affects the selection. Later runs with the same selection read
+it back directly instead of scanning the catalog again.
+"""
+
+
+def select_targets(
+    target_parameters: BaseModel,
+    analysis_parameters: BaseModel,
+    cartesian: bool = False,
+) -> dict:
+    """
+    Get the targets that pass the filters. Returns a dictionary with the target
+    "coordinates", as an (n, 2) array of RA/Dec in degrees or an (n, 3) array
+    of positions, and their "weights" (or None).
+    """
+    path = Path(target_parameters.path)
+    filters = build_filters(
+        {"targets": target_parameters.filters},
+        SimpleNamespace(analysis_parameters=analysis_parameters),
+    )["targets"]
+    columns = list(target_parameters.coordinate_columns)
+    if len(columns) != (3 if cartesian else 2):
+        raise ValueError(
+            f"Expected {3 if cartesian else 2} target coordinate columns,"
+            f" got {len(columns)}"
+        )
+    weight_column = target_parameters.weight_column
+
+    cache_path = None
+    if target_parameters.cache_path is not None:
+        stat = path.stat()
+        key = cache_key(
+            path=path.resolve(),
+            size=stat.st_size,
+            mtime=stat.st_mtime_ns,
+            filters=filters,
+            columns=columns,
+            weights=weight_column,
+        )
+        cache_path = Path(target_parameters.cache_path) / key
+        if (targets := read_targets(cache_path)) is not None:
+            logger.info(f"Read {len(targets['coordinates'])} cached targets")
+            return targets
+
+    catalog = Table.read(path, format=target_parameters.format)
+    n_rows = len(catalog)
+    catalog = apply_filters(catalog, filters)
+    to_array = (lambda c: np.asarray(c, dtype=np.float64)) if cartesian else to_degrees
+    targets = {
+        "coordinates": np.column_stack([to_array(catalog[c]) for c in columns]),
+        "weights": None,
+    }
+    if weight_column is not None:
+        weights = np.asarray(catalog[weight_column], dtype=np.float64)
+        if np.any(weights < 0) or not np.all(np.isfinite(weights)):
+            raise ValueError(f"Weights in column {weight_column} must be non-negative")
+        targets.update({"weights": weights})
+    logger.info(f"Selected {len(catalog)} of {n_rows} targets from {path}")
+    if cache_path is not None:
+        write_targets(cache_path, targets)
+    return targets
+
+
+def draw_targets(targets: dict, n_samples: int, rng: np.random.Generator):
+    """
+    Draw a random subset of n_samples targets, without replacement, weighted by
+    the target weights if there are any. If there aren't that many targets, every
+    target is used.
+    """
+    coordinates, weights = targets["coordinates"], targets["weights"]
+    if n_samples >= len(coordinates):
+        if n_samples > len(coordinates):
+            logger.warning(
+                f"Asked for {n_samples} samples, but only {len(coordinates)} targets"
+                " passed the selection. Using every target"
+            )
+        return coordinates
+    p = None if weights is None else weights / weights.sum()
+    indices = rng.choice(len(coordinates), n_samples, replace=False, p=p)
+    return coordinates[np.sort(indices)]
+
+
+def read_targets(path: Path):
+    try:
+        data = read_tile(path)
+    except (FileNotFoundError, ValueError):
+        return None
+    return {
+        "coordinates": np.asarray(data["coordinates"]),
+        "weights": None if "weights" not in data else np.asarray(data["weights"]),
+    }
+
+
+def write_targets(path: Path, targets: dict):
+    data = {k: v for k, v in targets.items() if v is not None}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.parent / f".{path.name}.{uuid4().hex}"
+    write_tile(tmp_path, data)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # Another run cached the same selection first
+        shutil.rmtree(tmp_path, ignore_errors=True)
@@ -1,16 +1,37 @@
 import math
+from copy import deepcopy
 from functools import partial
+from itertools import product
 from types import ModuleType
+from typing import Callable
 
+import astropy.units as u
 import networkx as nx
 import numpy as np
-from astropy.coordinates import SkyCoord
 from dask.distributed import get_worker
 from loguru import logger
 from pydantic import BaseModel
 
 from cosmap import analysis
 from cosmap.analysis import utils
+from cosmap.analysis.sampler import CARTESIAN_SHAPES
+from cosmap.dataset import DatasetCapability, as_batch_dataset
+from cosmap.dataset.apertures import (
+    prefix,
+    sort_chunk_by_separation,
+    sort_sample_by_separation,
+)
+from cosmap.dataset.batch import BatchQueryAdapter, as_center_array, as_radius_array
+from cosmap.dataset.derived import (
+    derive_chunk,
+    derive_sample,
+    region_center,
+    split_dtypes,
+)
+from cosmap.dataset.masks import get_mask_raster
+from cosmap.dataset.region import SampleRegion
+from cosmap.dataset.slices import sort_chunk_by_redshift, sort_sample_by_redshift
+from cosmap.dataset.tiles import TileScheme
 from cosmap.plugins import register, request
 
 
@@ -22,6 +43,10 @@ def get_tasks(
     samples: list,
     chunk_size: int = 1000,
     plugins={},
+    needed_columns: dict = {},
+    dataset_capabilities: DatasetCapability = DatasetCapability.NONE,
+    pipeline_function=None,
+    realizations: list = None,
 ):
     """
     This is the function that calls the associated task generator plugin.
@@ -35,10 +60,33 @@ def get_tasks(
         needed_dtypes=needed_dtypes,
         samples=samples,
         chunk_size=chunk_size,
+        needed_columns=needed_columns,
+        dataset_capabilities=dataset_capabilities,
+        pipeline_function=pipeline_function,
+        realizations=realizations,
     )
     return result
 
 
+def get_worker_layout(threads: int, capabilities: DatasetCapability) -> dict:
+    """
+    Decide how to lay out the dask workers, based on what the dataset can do.
+    Every worker process holds its own copy of the dataset. If the dataset is
+    thread safe but copies can't share memory, it's cheaper to run a single
+    process with many threads. Otherwise we use one thread per process.
+    """
+    n_workers = threads - 1
+    thread_safe = DatasetCapability.THREAD_SAFE in capabilities
+    shared_memory = DatasetCapability.SHARED_MEMORY in capabilities
+    if thread_safe and not shared_memory:
+        logger.info(
+            "Dataset is thread safe, using a single worker process"
+            f" with {n_workers} threads"
+        )
+        return {"n_workers": 1, "threads_per_worker": n_workers}
+    return {"n_workers": n_workers, "threads_per_worker": 1}
+
+
 @register
 def generate_tasks(
     client,
@@ -47,14 +95,22 @@ def generate_tasks(
     needed_dtypes: list,
     samples: list,
     chunk_size: int = 1000,
+    needed_columns: dict = {},
+    dataset_capabilities: DatasetCapability = DatasetCapability.NONE,
+    pipeline_function=None,
+    realizations: list = None,
 ):
     """
     This is a default task generator. It will generate tasks for the scheduler to
     execute. It is possible to overwrite this, so it is defined as a plugin.
+
+    If the dataset has several realizations, every chunk is run once in each
+    realization.
     """
 
-    logger.info("Building task pipeline...")
-    pipeline_function = build_pipeline(parameters, dependency_graph)
+    if pipeline_function is None:
+        logger.info("Building task pipeline...")
+        pipeline_function = build_pipeline(parameters, dependency_graph)
     n_chunks = math.ceil(len(samples) / chunk_size)
     n_workers = len(client.nthreads())
 
@@ -69,26 +125,189 @@ def generate_tasks(
 
     logger.info(f"Chunking samples with chunksize = {chunk_size}")
 
-    chunks = np.array_split(samples, n_chunks)
     sample_shape = parameters.sampling_parameters.sample_shape
     sample_dimensions = parameters.sampling_parameters.sample_dimensions
+    # Sort the samples along a space-filling curve before chunking, so each chunk
+    # covers a compact patch of sky (or of the box).
+    if sample_shape == "Circle":
+        samples, tiles = sort_by_tile(samples, get_affinity_nside(parameters))
+        query_shape = "cone"
+    elif sample_shape in CARTESIAN_SHAPES:
+        samples, tiles = sort_by_cell(samples, parameters.dataset_parameters.box_size)
+        query_shape = sample_shape.lower()
+    else:
+        raise NotImplementedError(f"Sample shape {sample_shape} is not supported")
+    chunks = np.array_split(samples, n_chunks)
+    chunk_tiles = [np.unique(t) for t in np.array_split(tiles, n_chunks)]
+    if realizations is not None:
+        logger.info(f"Running every sample in {len(realizations)} realizations")
+    # Tasks are grouped by realization, so each worker is handed a contiguous run
+    # of realizations and only has to open those. The same tile holds different
+    # data in each realization, so tiles are only shared within a realization.
+    tasks = [
+        (realization, chunk, {(realization, tile) for tile in chunk_tiles_})
+        for realization in realizations or [None]
+        for chunk, chunk_tiles_ in zip(chunks, chunk_tiles)
+    ]
+    cached_tiles = {}
+    if realizations is None:
+        cached_tiles = {
+            worker: {(None, tile) for tile in tiles}
+            for worker, tiles in client.run(get_cached_tiles).items()
+        }
+    task_workers = assign_chunks_to_workers(
+        [t[2] for t in tasks], list(client.nthreads()), cached_tiles
+    )
 
-    if sample_shape != "Circle":
-        raise NotImplementedError("Only circular samples are currently supported")
-
-    logger.info(f"Submitting {n_chunks} chunks to {n_workers} workers")
+    logger.info(f"Submitting {len(tasks)} chunks to {n_workers} workers")
     try:
         sample_dimension = max(sample_dimensions)
     except TypeError:
         sample_dimension = sample_dimensions
+    apertures = get_apertures(sample_dimensions)
+    sampling_parameters = parameters.sampling_parameters
+    if query_shape != "cone" and (
+        apertures is not None
+        or sampling_parameters.redshift_bins is not None
+        or split_dtypes(needed_dtypes)[1]
+    ):
+        raise NotImplementedError(
+            "Multiple apertures, redshift slices and derived data types are only"
+            " supported for sky samples"
+        )
+    if apertures is not None:
+        logger.info(f"Sampling {len(apertures[0])} apertures from a single fetch")
+    slices = None
+    if (bins := sampling_parameters.redshift_bins) is not None:
+        logger.info(f"Splitting samples into {len(bins) - 1} redshift slices")
+        slices = (
+            np.asarray(bins, dtype=np.float64),
+            sampling_parameters.redshift_column,
+        )
     f = partial(
         main_task,
         dtypes=needed_dtypes,
-        sample_shape="cone",
+        sample_shape=query_shape,
         sample_dimensions=sample_dimension,
         pipeline_function=pipeline_function,
+        capabilities=dataset_capabilities,
+        columns=needed_columns,
+        coordinate_columns=parameters.dataset_parameters.coordinate_columns,
+        apertures=apertures,
+        aperture_dtypes=sampling_parameters.aperture_dtypes,
+        slices=slices,
+        slice_dtypes=sampling_parameters.slice_dtypes,
     )
-    return client.map(f, chunks)
+    # Chunks prefer the worker that has been handed the same tiles, but can be
+    # stolen by any other worker that goes idle.
+    return [
+        client.submit(
+            f,
+            chunk,
+            realization=realization,
+            workers=[worker],
+            allow_other_workers=True,
+        )
+        for (realization, chunk, _), worker in zip(tasks, task_workers)
+    ]
+
+
+def get_apertures(sample_dimensions):
+    """
+    A list of sample dimensions means multi-aperture sampling. Returns the radii
+    in degrees (smallest first) and a label for each, which is used to name the
+    output columns. Returns None for a single aperture.
+    """
+    if not isinstance(sample_dimensions, u.Quantity) or sample_dimensions.isscalar:
+        return None
+    dimensions = np.sort(sample_dimensions.flatten())
+    labels = [f"{d.value:g}{d.unit.to_string()}" for d in dimensions]
+    return dimensions.to_value(u.deg), labels
+
+
+def get_affinity_nside(parameters: BaseModel) -> int:
+    """
+    Chunks are grouped using the same tiles as the dataset cache, if there is one.
+    """
+    cache_parameters = parameters.dataset_parameters.cache
+    if cache_parameters is not None:
+        return cache_parameters.nside
+    return 32
+
+
+def sort_by_tile(samples, nside: int):
+    """
+    Sort samples by the (nested) HEALPix tile they fall in. Nested indices follow
+    a space-filling curve, so samples that are close in the sorted order are close
+    on the sky. Returns the sorted samples and their tiles.
+    """
+    centers = as_center_array(samples)
+    tiles = TileScheme(nside).tile_of(centers[:, 0], centers[:, 1])
+    order = np.argsort(tiles, kind="stable")
+    return samples[order], tiles[order]
+
+
+def sort_by_cell(samples, box_size: float, bits: int = 10):
+    """
+    Sort positions in a box along a Morton (Z-order) curve, the Cartesian
+    equivalent of `sort_by_tile`. The box is split into 2**bits cells per side.
+    Returns the sorted samples and the Morton code of the cell each falls in.
+    """
+    cells = np.floor(samples / box_size * 2**bits).astype(np.int64)
+    cells = np.clip(cells, 0, 2**bits - 1)
+    codes = np.zeros(len(samples), dtype=np.int64)
+    for bit in range(bits):
+        for axis in range(3):
+            codes |= ((cells[:, axis] >> bit) & 1) << (3 * bit + axis)
+    order = np.argsort(codes, kind="stable")
+    return samples[order], codes[order]
+
+
+def assign_chunks_to_workers(
+    chunk_tiles: list, workers: list, cached_tiles: dict = {}
+) -> list:
+    """
+    Place each chunk on the worker that already has the most of its tiles, either
+    because it was given chunks that need them or because they are in its cache.
+    No worker gets more than its share of the chunks. A chunk that shares no tiles
+    with any worker goes to the least loaded one.
+    """
+    capacity = math.ceil(len(chunk_tiles) / len(workers))
+    held = {worker: set(cached_tiles.get(worker, ())) for worker in workers}
+    counts = dict.fromkeys(workers, 0)
+    assignments = []
+    for tiles in chunk_tiles:
+        tiles = set(tiles)
+        worker = max(
+            (w for w in workers if counts[w] < capacity),
+            key=lambda w: (len(tiles & held[w]), -counts[w]),
+        )
+        held[worker] |= tiles
+        counts[worker] += 1
+        assignments.append(worker)
+    return assignments
+
+
+def get_cached_tiles(dask_worker) -> set:
+    """
+    Get the tiles in a worker's own caches, if its dataset has any. This is meant
+    to be called with `client.run`.
+    """
+    dataset = getattr(dask_worker, "dataset", None)
+    if (cached_tiles := getattr(dataset, "cached_tiles", None)) is None:
+        return set()
+    return cached_tiles()
+
+
+def get_cache_statistics(dask_worker):
+    """
+    Collect the cache statistics from a worker's dataset, if it has any. This is
+    meant to be called with `client.run`.
+    """
+    dataset = getattr(dask_worker, "dataset", None)
+    if (statistics := getattr(dataset, "cache_statistics", None)) is None:
+        return {}
+    return statistics()
 
 
 def build_pipeline(parameters: BaseModel, dependency_graph):
@@ -111,15 +330,85 @@ def build_pipeline(parameters: BaseModel, dependency_graph):
     param_dictionary.update({"analysis_parameters": analysis_param_dictionary})
     # There's a bug in the current beta version of pydantic... Working around it
     param_dictionary.pop("analysis_definition")
+    # Analyses with several output files return one row per file
+    nested = isinstance(parameters.output_parameters.output_paths, dict)
 
-    pipeline_function = partial(
-        pipeline,
+    if not parameters.sweep:
+        return partial(
+            pipeline,
+            parameters=param_dictionary,
+            transformations=transformations,
+            transformation_definitions=transformation_defs,
+            task_order=task_order,
+            nested=nested,
+        )
+
+    points = get_sweep_points(parameters.sweep)
+    swept_tasks = get_swept_tasks(transformations, dependency_graph, parameters.sweep)
+    logger.info(
+        f"Sweeping {len(points)} parameter values, which affect"
+        f" {len(swept_tasks)} of {len(task_order)} transformations"
+    )
+    return partial(
+        sweep_pipeline,
         parameters=param_dictionary,
+        sweep_points=points,
+        point_parameters=[set_parameters(param_dictionary, p) for p in points],
+        swept_tasks=swept_tasks,
         transformations=transformations,
         transformation_definitions=transformation_defs,
         task_order=task_order,
+        nested=nested,
     )
-    return pipeline_function
+
+
+def get_sweep_points(sweep: dict) -> list:
+    """
+    Get every combination of the swept parameter values. Each point is a
+    dictionary of parameter name -> value.
+    """
+    names = list(sweep)
+    return [dict(zip(names, values)) for values in product(*sweep.values())]
+
+
+def get_swept_tasks(transformations: dict, dependency_graph, sweep: dict) -> set:
+    """
+    Find the transformations that have to be re-run for each sweep point. These
+    are the ones that use a swept parameter, plus everything downstream of them.
+    """
+    swept = set()
+    for name, transformation in transformations.items():
+        used = transformation.get("needed-parameters", [])
+        if used == "all":
+            swept.add(name)
+            continue
+        used = used + transformation.get("optional-parameters", [])
+        if any(p in used for p in sweep):
+            swept.add(name)
+    for name in list(swept):
+        swept.update(nx.descendants(dependency_graph, name))
+    return swept
+
+
+def set_parameters(param_dictionary: dict, point: dict) -> dict:
+    """
+    Get a copy of the parameter dictionary with the values of a sweep point
+    filled in. Names follow the same convention as "needed-parameters".
+    """
+    output = deepcopy(param_dictionary)
+    for name, value in point.items():
+        path = name.split(".")
+        if path[0] == "Main":
+            obj = output
+        else:
+            obj = output["analysis_parameters"]
+            path.insert(0, "analysis_parameters")
+        for p in path[1:-1]:
+            obj = obj[p]
+        if path[-1] not in obj:
+            raise utils.CosmapConfigException(f"Cannot sweep unknown parameter {name}!")
+        obj[path[-1]] = value
+    return output
 
 
 def main_task(
@@ -129,6 +418,14 @@ def main_task(
     dtypes,
     pipeline_function,
     other_args={},
+    capabilities: DatasetCapability = DatasetCapability.NONE,
+    columns: dict = {},
+    coordinate_columns: tuple = ("ra", "dec"),
+    apertures: tuple = None,
+    aperture_dtypes: list = ["catalog"],
+    slices: tuple = None,
+    slice_dtypes: list = ["catalog"],
+    realization: str = None,
     *args,
     **kwargs,
 ):
@@ -137,12 +434,33 @@ def main_task(
     logger.info(f"Worker {my_id} recieved {len(coordinates)} samples")
 
     dataset = worker.dataset
-    sample_generator = dataset.get_data_from_samples(
+    if realization is not None:
+        dataset = dataset[realization]
+    dataset = as_batch_dataset(dataset, capabilities)
+    query_args = {}
+    if columns and DatasetCapability.COLUMN_PUSHDOWN in capabilities:
+        query_args.update({"columns": columns})
+    sample_generator = get_sample_generator(
+        dataset,
         coordinates,
-        dtypes=dtypes,
-        sample_type=sample_shape,
-        sample_dimensions=sample_dimensions,
+        dtypes,
+        sample_shape,
+        sample_dimensions,
+        coordinate_columns,
+        query_args,
+        apertures,
+        aperture_dtypes,
+        slices,
+        slice_dtypes,
+        partial(get_mask_raster, worker, realization=realization),
     )
+    if apertures is not None:
+        pipeline_function = partial(
+            aperture_pipeline,
+            pipeline_function=pipeline_function,
+            apertures=apertures,
+            prefixed=get_prefixed_dtypes(dtypes, aperture_dtypes),
+        )
     logger.info(f"Worker {my_id} finished bootstrapping this chunk...")
     results = []
     logger.info(f"Worker {my_id} is now processing samples...")
@@ -150,12 +468,20 @@ def main_task(
         if i and (i % 100 == 0):
             logger.info(f"Worker {my_id} has processed {i} samples from this chunk")
         try:
-            results.append(
-                pipeline_function(data=sample, sample_region=region, **other_args)
-            )
+            output = pipeline_function(data=sample, sample_region=region, **other_args)
         except analysis.CosmapBadSampleError:
             logger.warning("Bad sample detected. Skipping...")
             continue
+        # Sweep outputs are only tagged once the apertures have been combined, so
+        # the tags aren't suffixed with the aperture labels
+        output = tag_sweeps(output)
+        if realization is not None:
+            output = tag_output(output, {"realization": realization})
+        # Parameter sweeps produce one output per sweep point
+        if isinstance(output, list):
+            results.extend(output)
+        else:
+            results.append(output)
     if i < (len(coordinates) - 1):
         logger.warning(
             "Worker got less data samples than expected. This "
@@ -165,24 +491,365 @@ def main_task(
     return results
 
 
+def get_sample_generator(
+    dataset,
+    coordinates,
+    dtypes: list,
+    sample_shape: str,
+    sample_dimensions,
+    coordinate_columns: tuple,
+    query_args: dict = {},
+    apertures: tuple = None,
+    aperture_dtypes: list = [],
+    slices: tuple = None,
+    slice_dtypes: list = [],
+    mask_rasters: Callable = None,
+):
+    """
+    Get an iterator of (region, data) tuples for a chunk. Derived data types (see
+    `cosmap.dataset.derived`) are computed here, as is the sorting needed for
+    multi-aperture sampling and redshift slices. For batch datasets, this is done
+    once for the whole chunk, otherwise it's done one sample at a time.
+    """
+    base_dtypes, derived = split_dtypes(dtypes)
+    # Each step is given as a pair of functions, one that works on the results
+    # for a whole chunk and one that works on a single sample.
+    steps = []
+    needed = {dtype: set() for dtype in base_dtypes}
+    if apertures is not None:
+        radii = apertures[0]
+        sorted_dtypes = [d for d in aperture_dtypes if d in base_dtypes]
+        steps.append(
+            (
+                lambda results, centers: sort_chunk_by_separation(
+                    results, centers, radii, sorted_dtypes, coordinate_columns
+                ),
+                lambda sample, region: sort_sample_by_separation(
+                    sample,
+                    region_center(region),
+                    radii,
+                    sorted_dtypes,
+                    coordinate_columns,
+                ),
+            )
+        )
+        for dtype in sorted_dtypes:
+            needed[dtype].update(coordinate_columns)
+    if slices is not None:
+        bins, redshift_column = slices
+        sliced_dtypes = [d for d in slice_dtypes if d in base_dtypes]
+        steps.append(
+            (
+                lambda results, centers: sort_chunk_by_redshift(
+                    results, bins, sliced_dtypes, redshift_column
+                ),
+                lambda sample, region: sort_sample_by_redshift(
+                    sample, bins, sliced_dtypes, redshift_column
+                ),
+            )
+        )
+        for dtype in sliced_dtypes:
+            needed[dtype].add(redshift_column)
+    if derived:
+        radius = float(as_radius_array(sample_dimensions, 1)[0])
+        steps.append(
+            (
+                lambda results, centers: results
+                | derive_chunk(
+                    results,
+                    centers,
+                    derived,
+                    coordinate_columns,
+                    mask_rasters,
+                    radius,
+                ),
+                lambda sample, region: sample
+                | derive_sample(
+                    sample, region, derived, coordinate_columns, mask_rasters, radius
+                ),
+            )
+        )
+        for base, kind in derived.values():
+            # Masks aren't tables, so there are no columns to ask for
+            if kind != "raster":
+                needed[base].update(coordinate_columns)
+
+    if columns := query_args.get("columns"):
+        # Make sure the columns these steps rely on are read, even if nothing
+        # else asks for them
+        columns = dict(columns)
+        for dtype, names in needed.items():
+            if names and (declared := columns.get(dtype)) is not None:
+                columns.update({dtype: sorted(set(declared) | names)})
+        query_args = dict(query_args, columns=columns)
+
+    batch = isinstance(dataset, BatchQueryAdapter)
+    if batch and steps:
+
+        def prepare(results, centers):
+            for chunk_step, _ in steps:
+                results = chunk_step(results, centers)
+            return results
+
+        query_args = dict(query_args, prepare=prepare)
+
+    samples = dataset.get_data_from_samples(
+        coordinates,
+        dtypes=base_dtypes,
+        sample_type=sample_shape,
+        sample_dimensions=sample_dimensions,
+        **query_args,
+    )
+    if batch or not steps:
+        return samples
+    return (prepare_sample(region, sample, steps) for region, sample in samples)
+
+
+def prepare_sample(region, sample: dict, steps: list):
+    for _, sample_step in steps:
+        sample = sample_step(sample, region)
+    return region, sample
+
+
+def get_prefixed_dtypes(dtypes: list, aperture_dtypes: list) -> dict:
+    """
+    Get the data types that are cut down to each aperture. This is the sorted data
+    types themselves, plus anything derived from them. Returns name -> the sorted
+    data type whose aperture counts apply.
+    """
+    base_dtypes, derived = split_dtypes(dtypes)
+    prefixed = {d: d for d in aperture_dtypes if d in base_dtypes}
+    prefixed.update(
+        {name: base for name, (base, _) in derived.items() if base in prefixed}
+    )
+    return prefixed
+
+
+def aperture_pipeline(
+    data: dict,
+    sample_region,
+    pipeline_function,
+    apertures: tuple,
+    prefixed: dict,
+    **kwargs,
+):
+    """
+    Run the pipeline once for each aperture, on views of the data that only
+    contain the objects inside it. The outputs are combined into a single output
+    with one set of columns per aperture.
+    """
+    radii, labels = apertures
+    ra, dec = region_center(sample_region)
+    outputs = {}
+    for j, (radius, label) in enumerate(zip(radii, labels)):
+        aperture_data = dict(data)
+        for dtype, base in prefixed.items():
+            count = data[f"{base}_apertures"][j]
+            aperture_data.update({dtype: prefix(data[dtype], count)})
+        outputs.update(
+            {
+                label: pipeline_function(
+                    data=aperture_data,
+                    sample_region=SampleRegion(ra, dec, radius),
+                    **kwargs,
+                )
+            }
+        )
+    return combine_aperture_outputs(outputs)
+
+
+def combine_aperture_outputs(outputs: dict):
+    """
+    Combine the outputs for each aperture (keyed by label) by suffixing every
+    column with the aperture label. Nested outputs are combined output by output,
+    and lists of outputs (from parameter sweeps) are combined element by element.
+    """
+    first = next(iter(outputs.values()))
+    if isinstance(first, list):
+        combined = [
+            combine_aperture_outputs({label: o[i] for label, o in outputs.items()})
+            for i in range(len(first))
+        ]
+        if isinstance(first, SweepOutputs):
+            return SweepOutputs(combined, first.points)
+        return combined
+    if not isinstance(first, dict):
+        return {label: output for label, output in outputs.items()}
+    if isinstance(first, NestedOutputs):
+        # An analysis run together with others that rejected any of the apertures
+        # loses the whole sample
+        return NestedOutputs(
+            {
+                key: combine_aperture_outputs(
+                    {label: o[key] for label, o in outputs.items()}
+                )
+                for key in first
+                if all(key in o for o in outputs.values())
+            }
+        )
+    return {
+        f"{name}_{label}": value
+        for label, output in outputs.items()
+        for name, value in output.items()
+    }
+
+
 def pipeline(
     data: dict,
-    sample_region: SkyCoord,
+    sample_region: SampleRegion,
     parameters: dict,
     transformations: dict,
     transformation_definitions: ModuleType,
     task_order: list,
+    nested: bool = False,
 ):
     outputs = {}
 
     for task in task_order:
-        needed_data = transformations[task].get("needed-data", [])
-        inputs = {n: data[n] for n in needed_data}
-        needed_parameters = utils.get_task_parameters_from_dictionary(
-            parameters, "Main", task, outputs
+        result = run_transformation(
+            task,
+            data,
+            sample_region,
+            parameters,
+            transformations,
+            transformation_definitions,
+            outputs,
         )
-        inputs.update(needed_parameters)
-        inputs.update({"sample_region": sample_region})
-        result = getattr(transformation_definitions, task)(**inputs)
         outputs.update({task: result})
-    return outputs[task_order[-1]]
+    output = outputs[task_order[-1]]
+    return NestedOutputs(output) if nested else output
+
+
+def sweep_pipeline(
+    data: dict,
+    sample_region: SampleRegion,
+    parameters: dict,
+    sweep_points: list,
+    point_parameters: list,
+    swept_tasks: set,
+    transformations: dict,
+    transformation_definitions: ModuleType,
+    task_order: list,
+    nested: bool = False,
+):
+    """
+    Run the pipeline for every sweep point. Transformations that don't depend on
+    a swept parameter are run once, and their outputs are shared between the sweep
+    points. Returns one output per sweep point, which are tagged with the parameter
+    values by `tag_sweeps`.
+    """
+    outputs = {}
+    for task in task_order:
+        # Nothing upstream of a shared transformation is swept, so these can
+        # always be run first.
+        if task not in swept_tasks:
+            result = run_transformation(
+                task,
+                data,
+                sample_region,
+                parameters,
+                transformations,
+                transformation_definitions,
+                outputs,
+            )
+            outputs.update({task: result})
+
+    results = []
+    for point, point_parameters_ in zip(sweep_points, point_parameters):
+        point_outputs = dict(outputs)
+        for task in task_order:
+            if task in swept_tasks:
+                result = run_transformation(
+                    task,
+                    data,
+                    sample_region,
+                    point_parameters_,
+                    transformations,
+                    transformation_definitions,
+                    point_outputs,
+                )
+                point_outputs.update({task: result})
+        output = point_outputs[task_order[-1]]
+        results.append(NestedOutputs(output) if nested else output)
+    return SweepOutputs(results, sweep_points)
+
+
+def fused_pipeline(data: dict, sample_region: SampleRegion, pipelines: dict):
+    """
+    Run the pipelines of several analyses on the same sample. The outputs are
+    keyed by analysis name. An analysis that rejects the sample only loses its own
+    output, the sample is only skipped if every analysis rejects it.
+    """
+    outputs = {}
+    for name, pipeline_function in pipelines.items():
+        try:
+            outputs[name] = pipeline_function(data=data, sample_region=sample_region)
+        except analysis.CosmapBadSampleError:
+            logger.warning(f"Bad sample detected by analysis {name}. Skipping...")
+    if not outputs:
+        raise analysis.CosmapBadSampleError
+    return NestedOutputs(outputs)
+
+
+def run_transformation(
+    task: str,
+    data: dict,
+    sample_region: SampleRegion,
+    parameters: dict,
+    transformations: dict,
+    transformation_definitions: ModuleType,
+    outputs: dict,
+):
+    needed_data = transformations[task].get("needed-data", [])
+    inputs = {n: data[n] for n in needed_data}
+    needed_parameters = utils.get_task_parameters_from_dictionary(
+        parameters, "Main", task, outputs
+    )
+    inputs.update(needed_parameters)
+    inputs.update({"sample_region": sample_region})
+    return getattr(transformation_definitions, task)(**inputs)
+
+
+class SweepOutputs(list):
+    """
+    The outputs of a parameter sweep, one per sweep point, before they have been
+    tagged with the parameter values.
+    """
+
+    def __init__(self, outputs: list, points: list):
+        super().__init__(outputs)
+        self.points = points
+
+
+class NestedOutputs(dict):
+    """
+    Outputs keyed by output file (for analyses with several output files) or by
+    analysis (for several analyses run together), rather than a single row. Each
+    value is an output in its own right.
+    """
+
+
+def tag_sweeps(output):
+    """
+    Tag the outputs of any parameter sweeps with their parameter values. Outputs of
+    several analyses run together are tagged analysis by analysis.
+    """
+    if isinstance(output, SweepOutputs):
+        return [tag_output(o, point) for o, point in zip(output, output.points)]
+    if isinstance(output, NestedOutputs):
+        return NestedOutputs({key: tag_sweeps(value) for key, value in output.items()})
+    return output
+
+
+def tag_output(output, point: dict):
+    """
+    Add the values of a sweep point to an output, as extra columns. Nested outputs
+    are tagged output by output, and lists of outputs (from parameter sweeps) are
+    tagged element by element.
+    """
+    tags = {name.split(".")[-1]: value for name, value in point.items()}
+    if isinstance(output, list):
+        return [tag_output(o, tags) for o in output]
+    if isinstance(output, NestedOutputs):
+        return NestedOutputs({key: tag_output(o, tags) for key, o in output.items()})
+    return output | tags
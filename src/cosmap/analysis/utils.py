@@ -1,7 +1,7 @@
 from loguru import logger
 from pydantic import BaseModel
 
-from cosmap.analysis.analysis import CosmapAnalysis
+from cosmap.analysis.analysis import CosmapAnalysis, CosmapFusedAnalysis
 from cosmap.config.block import create_analysis_block
 
 
@@ -25,6 +25,40 @@ def build_analysis_object(analysis_data, run_configuration, **kwargs):
     -------
     analysis_object: CosmapAnalysis
     """
+    block = build_analysis_block(analysis_data, run_configuration)
+    plugins = analysis_data.get("plugins", {})
+    analysis_object = CosmapAnalysis(
+        analysis_paramters=block, plugins=plugins, **kwargs
+    )
+    return analysis_object
+
+
+def build_fused_analysis_object(analyses: dict, **kwargs):
+    """
+    Construct a single analysis object that runs several installed analyses (or
+    variants) over the same samples.
+
+    Parameters
+    ----------
+    analyses: dict
+        Maps a name for each analysis to a tuple of its analysis files (as loaded
+        by `manage.load_analysis_files`) and its configuration
+
+    Returns
+    -------
+    analysis_object: CosmapFusedAnalysis
+    """
+    blocks = {
+        name: build_analysis_block(analysis_data, run_configuration)
+        for name, (analysis_data, run_configuration) in analyses.items()
+    }
+    return CosmapFusedAnalysis(analysis_parameters=blocks, **kwargs)
+
+
+def build_analysis_block(analysis_data, run_configuration):
+    """
+    Build the parameter block for an installed analysis from its configuration.
+    """
     module = analysis_data["module"]
     transformations = analysis_data["transformations"]
     additional_parameters = analysis_data["parameters"]
@@ -46,10 +80,7 @@ def build_analysis_object(analysis_data, run_configuration, **kwargs):
     run_configuration = update_nested_dict(run_configuration, additional_parameters)
     block = create_analysis_block("Main", main_config_definition, run_configuration)
     block.analysis_parameters.transformations = transformations
-    analysis_object = CosmapAnalysis(
-        analysis_paramters=block, plugins=plugins, **kwargs
-    )
-    return analysis_object
+    return block
 
 
 def update_nested_dict(original, update):
@@ -65,6 +96,30 @@ def update_nested_dict(original, update):
     return original
 
 
+def get_needed_columns(transformations: dict) -> dict:
+    """
+    Transformations can declare the columns they use from each data type with the
+    "needed-columns" key, e.g. {"catalog": ["ra", "dec", "redshift"]}. The columns
+    for a data type are the union of every declaration. If any transformation that
+    requests a data type does not declare its columns, we can't know what will be
+    used, so all columns of that data type are read.
+    """
+    columns = {}
+    undeclared = set()
+    for transformation in transformations.values():
+        declared = transformation.get("needed-columns", {})
+        for dtype in transformation.get("needed-data", []):
+            if dtype not in declared:
+                undeclared.add(dtype)
+        for dtype, names in declared.items():
+            columns.setdefault(dtype, set()).update(names)
+    return {
+        dtype: sorted(names)
+        for dtype, names in columns.items()
+        if dtype not in undeclared
+    }
+
+
 def load_transformations(parameters: BaseModel, block_=None):
     output = {}
     definition_module = getattr(parameters.analysis_definition, "transformations")
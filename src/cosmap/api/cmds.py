@@ -1,11 +1,16 @@
 import json
+from copy import deepcopy
 from pathlib import Path
 
 import toml
 from loguru import logger
 
 from cosmap.analysis import manage
-from cosmap.analysis.utils import build_analysis_object
+from cosmap.analysis.utils import (
+    build_analysis_object,
+    build_fused_analysis_object,
+    update_nested_dict,
+)
 
 
 def install_analysis(analysis_path: Path, overwrite=False, name=None):
@@ -28,6 +33,9 @@ def run_analysis(analysis_path: Path):
             f"Could not parse the analysis config {analysis_path}: expect"
             "a toml or json file"
         )
+    if "analyses" in config:
+        run_fused_analyses(analysis_path, config)
+        return
     try:
         base_analysis = config["base-analysis"]
     except KeyError:
@@ -47,6 +55,43 @@ def run_analysis(analysis_path: Path):
     analysis_object.run()
 
 
+def run_fused_analyses(analysis_path: Path, config: dict):
+    """
+    Run several analyses over the same samples and dataset. Each entry in the
+    "analyses" list names a base analysis (and optionally a variant and a name),
+    and may override any of the shared configuration, such as the output paths.
+    """
+    shared_config = {k: v for k, v in config.items() if k != "analyses"}
+    analyses = {}
+    for entry in config["analyses"]:
+        entry = deepcopy(entry)
+        try:
+            base_analysis = entry["base-analysis"]
+        except KeyError:
+            raise KeyError(
+                "Every entry in `analyses` needs a base analysis in the config "
+                f"file {analysis_path}"
+            )
+        amod = entry.get("analysis-mod", None)
+        name = entry.pop(
+            "name", base_analysis if amod is None else f"{base_analysis}-{amod}"
+        )
+        if name in analyses:
+            raise ValueError(
+                f"Analysis name `{name}` is used more than once in {analysis_path}."
+                " Use the `name` key to tell them apart"
+            )
+        logger.info(f"Loading analysis files for {name}")
+        analysis_data = manage.load_analysis_files(base_analysis, amod)
+        run_configuration = update_nested_dict(deepcopy(shared_config), entry)
+        analyses.update({name: (analysis_data, run_configuration)})
+
+    logger.info(f"Preparing {len(analyses)} analyses to run together")
+    analysis_object = build_fused_analysis_object(analyses)
+    logger.info(f"Running analyses {', '.join(analyses)}")
+    analysis_object.run()
+
+
 def list_analyses():
     model_names = list(manage.get_known_analyses().keys())
     if not model_names:
@@ -53,12 +53,49 @@ class CosmapAnalysisParameters(BaseModel):
         extra = "allow"
 
 
+class CosmapTargetParameters(BaseModel):
+    """
+    With a sample_type of "Targets", samples are centered on objects from a target
+    catalog rather than drawn at random. The targets are the rows of the catalog at
+    path (anything astropy can read) that pass every filter, using the same syntax
+    as the dataset filters. For simulation boxes, coordinate_columns should be the
+    three position columns.
+
+    If n_samples is smaller than the number of targets, a random subset is drawn,
+    weighted by weight_column if one is given. Otherwise every target is used once.
+    If cache_path is set, the selection is cached there so later runs don't have to
+    read the catalog again.
+    """
+
+    path: Path
+    format: Optional[str] = None
+    filters: list[str] = []
+    coordinate_columns: list[str] = ["ra", "dec"]
+    weight_column: Optional[str] = None
+    cache_path: Optional[Path] = None
+    seed: Optional[int] = None
+
+
 class CosmapSamplingParameters(BaseModel):
     """
     Cosmap analyses always involve repeating the same process on several
     different "regions" (samlles) of the sky. This class deifnes the parameters
     that are used to define the samples, and the greater region they are drawn from.
     The individual sampler will be responsible for actually evaluating the inputs here.
+
+    If sample_dimensions is a list, every sample is fetched once at the largest
+    dimension and the analysis is run once per dimension, with one set of output
+    columns for each. Only the data types in aperture_dtypes are cut down to each
+    aperture, everything else is passed through as fetched.
+
+    If redshift_bins are given, each sample is also split into redshift shells. The
+    data types in slice_dtypes are sorted by redshift_column, and each shell is
+    handed to the transformations as "<dtype>_slices". This can't be combined with
+    multiple apertures.
+
+    A sample_type of "PoissonDisk" places samples at random, but never closer than
+    min_separation to each other. By default, this is the sample diameter, so no
+    two samples overlap.
     """
 
     region_shape: str = "Rectangle"
@@ -68,12 +105,43 @@ class CosmapSamplingParameters(BaseModel):
     sample_shape: str = "Circle"
     sample_dimensions: sky.Quantity = None
     sample_type: str = "Random"
+    min_separation: sky.Quantity = None
     n_samples: int = 1000
     dtypes: set[str] = None
+    aperture_dtypes: list[str] = ["catalog"]
+    redshift_bins: Optional[list[float]] = None
+    redshift_column: str = "redshift"
+    slice_dtypes: list[str] = ["catalog"]
+    targets: Optional[CosmapTargetParameters] = None
 
     class Config:
         arbitrary_types_allowed = True
 
+    @validator("redshift_bins")
+    def validate_redshift_bins(cls, v):
+        if v is not None and (len(v) < 2 or any(b <= a for a, b in zip(v, v[1:]))):
+            raise ValueError("redshift_bins must be at least two increasing edges")
+        return v
+
+    @model_validator(mode="after")
+    def validate_targets(self):
+        if self.sample_type == "Targets" and self.targets is None:
+            raise ValueError("Sampling from targets requires a targets block")
+        return self
+
+    @model_validator(mode="after")
+    def validate_slices(self):
+        dimensions = self.sample_dimensions
+        if (
+            self.redshift_bins is not None
+            and dimensions is not None
+            and not dimensions.isscalar
+        ):
+            raise ValueError(
+                "Redshift slices can't be combined with multiple apertures"
+            )
+        return self
+
     @validator("region_bounds")
     def validate_region_bounds(cls, v, values):
         if (
@@ -86,17 +154,54 @@ class CosmapSamplingParameters(BaseModel):
         return v
 
 
+class CosmapCacheParameters(BaseModel):
+    """
+    Caching is opt-in. When enabled, data is fetched one tile (a HEALPix pixel of
+    the given nside) at a time. Each worker keeps recently used tiles in memory, up
+    to memory_max_bytes (0 disables the memory cache). If a path is given, tiles
+    are also kept on disk between runs, up to max_bytes. Only the listed data types
+    are tiled.
+    """
+
+    path: Optional[Path] = None
+    max_bytes: int = 10 * 1024**3
+    memory_max_bytes: int = 1024**3
+    nside: int = 64
+    dtypes: list[str] = ["catalog"]
+
+
 class CosmapDatasetParameters(BaseModel):
     """
     Cosmap analyses always involve repeatedly querying some large survey
     dataset. This block contains that information. The default wrapper is
     heinlein, which is optimized for large survey datasets.
+
+    Static row filters can be declared per data type in `filters`. These are
+    applied by the dataset wrapper when the data is loaded, see
+    `cosmap.dataset.filters` for the syntax.
+
+    For periodic simulation boxes (snapshots), set box_size to the side length of
+    the box, in the same units as the position columns. Samples are then drawn in
+    comoving Cartesian coordinates, with a sample_shape of "Sphere" or "Cube".
+
+    For ensembles of independent realizations, set realizations to true. Each
+    file under dataset_path is then treated as its own dataset, every sample is
+    run in every realization, and the outputs gain a "realization" column with the
+    name of the file they came from. Each worker keeps at most open_realizations
+    of them open at once.
     """
 
     dataset_name: Optional[str] = None
     dataset_path: Optional[Path] = None
     dataset_wrapper: str = "heinlein"
     dataset_columns: Optional[list[str]] = None
+    filters: dict[str, list[str] | str] = {}
+    coordinate_columns: tuple[str, str] = ("ra", "dec")
+    position_columns: tuple[str, str, str] = ("x", "y", "z")
+    box_size: Optional[float] = None
+    realizations: bool = False
+    open_realizations: int = Field(default=4, ge=1)
+    cache: Optional[CosmapCacheParameters] = None
 
     @model_validator(mode="after")
     def validate_wrapper(self):
@@ -108,14 +213,67 @@ class CosmapDatasetParameters(BaseModel):
             raise ValueError(
                 "When using the opencosmo wrapper, a dataset path must be set"
             )
+        if self.box_size is not None and self.cache is not None:
+            raise ValueError("Tile caching is not supported for simulation boxes")
+        if self.realizations and self.cache is not None:
+            raise ValueError("Tile caching is not supported for multiple realizations")
+        if self.dataset_wrapper == "parquet" and self.dataset_path is None:
+            raise ValueError(
+                "When using the parquet wrapper, a dataset path must be set"
+            )
         return self
 
 
+class CosmapConvergenceParameters(BaseModel):
+    """
+    Stops the run early, once the listed output columns are known well enough.
+    Each statistic ("mean", "median" or a quantile between 0 and 1) of each column
+    is tracked as chunks complete. Once every one of them has a relative precision
+    of at most `precision`, outstanding chunks are cancelled. Quantile precision is
+    taken from a confidence interval at the given confidence level. At least
+    min_samples outputs are always used.
+    """
+
+    columns: list[str]
+    statistics: list[str | float] = ["mean"]
+    precision: float = Field(default=0.01, gt=0)
+    confidence: float = Field(default=0.68, gt=0, lt=1)
+    min_samples: int = Field(default=100, ge=2)
+
+    @validator("statistics", each_item=True)
+    def validate_statistic(cls, v):
+        if v in ("mean", "median"):
+            return v
+        try:
+            quantile = float(v)
+        except ValueError:
+            raise ValueError(f"Unknown statistic {v}")
+        if not 0 < quantile < 1:
+            raise ValueError("Quantiles must be between 0 and 1")
+        return quantile
+
+
 class CosmapOutputParameters(BaseModel):
+    """
+    Outputs are written as "csv", "parquet" or "hdf5" (see write_format). Options
+    for the writer, such as the compression or the parquet row_group_size, go in
+    writer_config.
+
+    By default, outputs are written on a background thread, so the analysis can
+    keep collecting results while they are written. Up to write_queue_size chunks
+    of results can be waiting at once. They are written once write_batch_rows
+    rows have built up, or every write_interval seconds.
+    """
+
     base_output_path: Path = Path.cwd()
     output_paths: Path | dict = None
     output_formats: str | dict = "dataframe"
     write_format: str = "csv"
+    writer_config: dict = {}
+    background_writes: bool = True
+    write_queue_size: int = Field(default=64, ge=1)
+    write_batch_rows: int = Field(default=50000, ge=1)
+    write_interval: float = Field(default=30.0, gt=0)
 
 
 class CosmapParameters(BaseModel):
@@ -126,9 +284,19 @@ class CosmapParameters(BaseModel):
     the number of cores to use), but more importantly contains
     sub-blocks, which are used by various parts of the analysis.
     process.
+
+    A parameter sweep runs the analysis for several values of one or more
+    parameters in a single pass over the samples. Parameters are named the same
+    way as in "needed-parameters", e.g. {"Main.min_radius": [1, 2, 5]}. If more
+    than one parameter is swept, every combination of their values is run.
+
+    If a convergence block is given, n_samples is an upper limit, and the run stops
+    as soon as the tracked outputs have converged.
     """
 
     threads: int = Field(default=1, ge=1)
+    sweep: dict[str, list] = {}
+    convergence: Optional[CosmapConvergenceParameters] = None
     output_parameters: CosmapOutputParameters
     analysis_definition: ModuleType = None
     analysis_parameters: CosmapAnalysisParameters
@@ -1,11 +1,25 @@
-from typing import Protocol, runtime_checkable
+from typing import Iterator, Optional, Protocol, runtime_checkable
 
 import astropy.units as u
+import numpy as np
 from astropy.coordinates import SkyCoord
 
+from .batch import BatchQueryAdapter, RaggedColumns, as_batch_dataset
+from .capabilities import DatasetCapability, get_capabilities
 from .plugins import get_dataset
+from .region import SampleRegion
 
-__all__ = ["CosmapDataset", "get_dataset"]
+__all__ = [
+    "CosmapDataset",
+    "BatchQueryDataset",
+    "BatchQueryAdapter",
+    "RaggedColumns",
+    "SampleRegion",
+    "as_batch_dataset",
+    "DatasetCapability",
+    "get_capabilities",
+    "get_dataset",
+]
 
 
 @runtime_checkable
@@ -25,3 +39,39 @@ class CosmapDataset(Protocol):
         matching the dtype names, and the values being the data.
         """
         pass
+
+
+@runtime_checkable
+class BatchQueryDataset(Protocol):
+    """
+    Datasets that can answer all the samples in a chunk at once should implement
+    this protocol, and advertise DatasetCapability.BATCH_QUERIES. Datasets that only
+    implement `cone_search` will be wrapped in a `BatchQueryAdapter`, which provides
+    both methods on top of single cone searches.
+    """
+
+    def query_many(
+        self,
+        centers: np.ndarray,
+        radii: u.Quantity,
+        dtypes: list,
+        columns: Optional[dict] = None,
+    ) -> dict:
+        """
+        Query many cones at once. Centers are an (n, 2) array of RA/Dec in degrees,
+        and radii is either a single value or one per center. Columns optionally maps
+        a dtype to the list of columns that are needed. Should return a dictionary
+        with the keys matching the dtype names, and the values being RaggedColumns
+        (or, for data types that aren't tables, a list with one object per center).
+        """
+        pass
+
+    def get_data_from_samples(
+        self, coordinates, dtypes: list, sample_type: str, sample_dimensions, **kwargs
+    ) -> Iterator[tuple]:
+        """
+        Yield a (region, data) tuple for each sample in a chunk, where data is a
+        dictionary with the keys matching the dtype names. This is what the task
+        runner actually calls on the workers.
+        """
+        pass
@@ -0,0 +1,92 @@
+import numpy as np
+
+from cosmap.dataset.batch import RaggedColumns, slice_rows, take_rows
+from cosmap.dataset.geometry import to_degrees, unit_vectors
+from cosmap.dataset.neighbors import SampleNeighbors
+
+"""
+Multi-aperture sampling. Data is fetched once per sample at the largest aperture,
+and the objects in each sample are sorted by their separation from the center. The
+objects inside any smaller aperture are then a prefix of the sample, so each
+aperture is just a view of the first few rows.
+
+Alongside each sorted data type, "<dtype>_apertures" holds the number of objects
+inside each aperture (smallest first), which is also where the prefixes end.
+"""
+
+
+def sort_chunk_by_separation(
+    results: dict,
+    centers: np.ndarray,
+    radii: np.ndarray,
+    dtypes: list,
+    coordinate_columns: tuple,
+) -> dict:
+    """
+    Sort the objects in every sample of a chunk by separation from the sample
+    center, in a single pass over the whole chunk.
+    """
+    results = dict(results)
+    cos_radii = np.cos(np.radians(radii))
+    ra_column, dec_column = coordinate_columns
+    center_vectors = unit_vectors(centers[:, 0], centers[:, 1])
+    for dtype in dtypes:
+        if (ragged := results.get(dtype)) is None:
+            continue
+        samples = np.repeat(np.arange(len(ragged)), ragged.counts)
+        columns = ragged.columns
+        vectors = unit_vectors(
+            to_degrees(columns[ra_column]), to_degrees(columns[dec_column])
+        ).reshape(-1, 3)
+        cos_separation = np.einsum("ij,ij->i", vectors, center_vectors[samples])
+        order = np.lexsort((-cos_separation, samples))
+        counts = np.stack(
+            [
+                np.bincount(samples[cos_separation >= c], minlength=len(ragged))
+                for c in cos_radii
+            ],
+            axis=-1,
+        )
+        results.update(
+            {
+                dtype: RaggedColumns(take_rows(ragged.columns, order), ragged.offsets),
+                f"{dtype}_apertures": counts,
+            }
+        )
+    return results
+
+
+def sort_sample_by_separation(
+    sample: dict,
+    center: tuple,
+    radii: np.ndarray,
+    dtypes: list,
+    coordinate_columns: tuple,
+) -> dict:
+    """
+    Sort the objects in a single sample by separation from its center.
+    """
+    sample = dict(sample)
+    cos_radii = np.cos(np.radians(radii))
+    ra_column, dec_column = coordinate_columns
+    center_vector = unit_vectors(*center)
+    for dtype in dtypes:
+        if (data := sample.get(dtype)) is None:
+            continue
+        vectors = unit_vectors(
+            to_degrees(data[ra_column]), to_degrees(data[dec_column])
+        ).reshape(-1, 3)
+        cos_separation = vectors @ center_vector
+        order = np.argsort(-cos_separation, kind="stable")
+        counts = (cos_separation[:, None] >= cos_radii).sum(axis=0)
+        sample.update({dtype: take_rows(data, order), f"{dtype}_apertures": counts})
+    return sample
+
+
+def prefix(data, n: int):
+    """
+    Get the first n rows of a sample's data, without copying.
+    """
+    if isinstance(data, SampleNeighbors):
+        return SampleNeighbors(data.index, data.start, data.start + n)
+    return slice_rows(data, 0, n)
@@ -0,0 +1,220 @@
+from typing import Callable, Optional
+
+import astropy.units as u
+import numpy as np
+import pandas as pd
+from astropy.coordinates import SkyCoord
+from astropy.table import Table, vstack
+
+from cosmap.dataset.capabilities import DatasetCapability
+from cosmap.dataset.region import SampleRegion
+
+"""
+Batch queries let a dataset answer all the samples in a chunk at once, rather than
+one cone at a time. The result for each tabular data type is a RaggedColumns object,
+which stores the data for every sample in a single flat table, plus the offsets of
+each sample within it. Data types that aren't tables (like masks) can't be
+flattened, so they are returned as a list with one object per sample.
+
+Datasets that only implement `cone_search` can still be used through the
+BatchQueryAdapter, which falls back to one query per sample.
+"""
+
+
+class RaggedColumns:
+    """
+    The result of a batch query for a single data type. The rows belonging to
+    sample i are columns[offsets[i]:offsets[i+1]]. The columns may be a mapping
+    of name to array, an astropy Table or a pandas DataFrame. Indexing returns
+    a slice of the flat data, which is a view wherever the underlying type allows.
+
+    Building the flat data usually means gathering rows from the dataset (and
+    cones may share rows), so that step copies the data once per chunk.
+    """
+
+    def __init__(self, columns, offsets: np.ndarray):
+        self.columns = columns
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def counts(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def __getitem__(self, i: int):
+        return slice_rows(self.columns, self.offsets[i], self.offsets[i + 1])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @classmethod
+    def from_parts(cls, parts: list, columns: Optional[list] = None):
+        """
+        Build a ragged result from a list of per-sample results.
+        """
+        counts = [_length(p) for p in parts]
+        offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        if columns is not None:
+            parts = [select_columns(p, columns) for p in parts]
+        return cls(concatenate(parts), offsets)
+
+
+def is_tabular(data) -> bool:
+    return isinstance(data, (dict, Table, pd.DataFrame))
+
+
+def pack_parts(parts: list, columns: Optional[list] = None):
+    """
+    Combine the per-sample results for one data type. Tables become RaggedColumns,
+    anything else is kept as a list with one object per sample.
+    """
+    if parts and not all(is_tabular(p) for p in parts):
+        return list(parts)
+    return RaggedColumns.from_parts(parts, columns)
+
+
+def _length(data):
+    if isinstance(data, dict):
+        return len(next(iter(data.values()))) if data else 0
+    return len(data)
+
+
+def select_columns(data, columns: list):
+    if isinstance(data, dict):
+        return {c: data[c] for c in columns}
+    return data[columns]
+
+
+def concatenate(parts: list):
+    """
+    Combine several tables (or mappings of columns) of the same type into one.
+    """
+    if not parts:
+        return {}
+    if isinstance(parts[0], Table):
+        return vstack(parts, join_type="exact", metadata_conflicts="silent")
+    elif isinstance(parts[0], pd.DataFrame):
+        return pd.concat(parts, ignore_index=True)
+    elif isinstance(parts[0], dict):
+        return {c: np.concatenate([p[c] for p in parts]) for c in parts[0]}
+    raise TypeError(f"Don't know how to combine results of type {type(parts[0])}")
+
+
+def take_rows(data, indices: np.ndarray):
+    """
+    Select rows by index from a table, DataFrame or mapping of columns.
+    """
+    if isinstance(data, pd.DataFrame):
+        return data.iloc[indices]
+    elif isinstance(data, dict):
+        return {name: col[indices] for name, col in data.items()}
+    return data[indices]
+
+
+def slice_rows(data, start: int, stop: int):
+    """
+    Get a contiguous range of rows from a table, DataFrame or mapping of columns,
+    without copying.
+    """
+    if isinstance(data, pd.DataFrame):
+        return data.iloc[start:stop]
+    elif isinstance(data, dict):
+        return {name: col[start:stop] for name, col in data.items()}
+    return data[start:stop]
+
+
+def as_radius_array(radii, n: int) -> np.ndarray:
+    """
+    Radii may be passed as a single Quantity or one per sample. Return them as a
+    float64 array in degrees.
+    """
+    if isinstance(radii, u.Quantity):
+        radii = radii.to_value(u.deg)
+    return np.broadcast_to(np.asarray(radii, dtype=np.float64), (n,))
+
+
+def as_center_array(centers) -> np.ndarray:
+    """
+    Convert sample centers into an (n, 2) float64 array of RA/Dec in degrees.
+    """
+    if isinstance(centers, SkyCoord):
+        return np.column_stack([centers.ra.deg, centers.dec.deg])
+    return np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+
+
+class BatchQueryAdapter:
+    """
+    Gives any dataset the batch interface. If the dataset advertises native batch
+    queries, we use its `query_many`. Otherwise, we fall back to one `cone_search`
+    per sample and pack the results.
+    """
+
+    def __init__(self, dataset, native_batch: bool = False):
+        self.dataset = dataset
+        self.native_batch = native_batch
+
+    def query_many(
+        self,
+        centers: np.ndarray,
+        radii,
+        dtypes: list,
+        columns: Optional[dict] = None,
+    ) -> dict:
+        if self.native_batch:
+            return self.dataset.query_many(centers, radii, dtypes, columns)
+        centers = as_center_array(centers)
+        radii = as_radius_array(radii, len(centers))
+        columns = columns or {}
+        parts = {dtype: [] for dtype in dtypes}
+        for (ra, dec), radius in zip(centers, radii):
+            data = self.dataset.cone_search(
+                SkyCoord(ra, dec, unit="deg"), radius * u.deg, list(dtypes)
+            )
+            for dtype in dtypes:
+                parts[dtype].append(data[dtype])
+        return {dtype: pack_parts(p, columns.get(dtype)) for dtype, p in parts.items()}
+
+    def get_data_from_samples(
+        self,
+        coordinates,
+        dtypes,
+        sample_type,
+        sample_dimensions,
+        columns: Optional[dict] = None,
+        prepare: Optional[Callable] = None,
+        *args,
+        **kwargs,
+    ):
+        """
+        Run the batch query for the whole chunk, then hand the samples out one at
+        a time. The centers stay plain floats, the regions only build astropy
+        objects if they are asked for.
+
+        If given, `prepare` is called with the batch results and the centers, and
+        returns the results to hand out (for example, with derived data added).
+        """
+        if sample_type != "cone":
+            raise NotImplementedError("Only cone samples are currently supported")
+        centers = as_center_array(coordinates)
+        radii = as_radius_array(sample_dimensions, len(centers))
+        results = self.query_many(centers, radii, dtypes, columns)
+        if prepare is not None:
+            results = prepare(results, centers)
+        for i, ((ra, dec), radius) in enumerate(zip(centers, radii)):
+            region = SampleRegion(ra, dec, radius)
+            yield region, {dtype: result[i] for dtype, result in results.items()}
+
+
+def as_batch_dataset(dataset, capabilities=DatasetCapability.NONE):
+    """
+    Datasets that handle chunks of samples themselves are used as-is. Anything else
+    is wrapped so that it can.
+    """
+    if hasattr(dataset, "get_data_from_samples"):
+        return dataset
+    native_batch = DatasetCapability.BATCH_QUERIES in capabilities
+    return BatchQueryAdapter(dataset, native_batch=native_batch)
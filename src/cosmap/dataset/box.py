@@ -0,0 +1,133 @@
+from typing import Optional
+
+import astropy.units as u
+import numpy as np
+from scipy.spatial import cKDTree
+
+from cosmap.dataset.batch import RaggedColumns, select_columns, take_rows
+from cosmap.dataset.region import BoxRegion, periodic_offsets
+
+"""
+Sampling of periodic simulation boxes (snapshots) rather than lightcones. Samples
+are spheres or cubes in comoving Cartesian coordinates, and wrap around the edges
+of the box.
+
+The whole box is held in memory on each worker, along with a periodic KD-tree over
+the positions. Both are built once, when the dataset is attached to the worker, and
+each chunk of samples is then answered with a single batch of tree queries.
+"""
+
+SAMPLE_SHAPES = ("sphere", "cube")
+
+
+class PeriodicBoxDataset:
+    """
+    Positions (and so the box size) are in the units of the position columns, if
+    they have any. Sample centers and sizes with units are converted to them, plain
+    numbers are taken to be in them already. If the positions have no units, the
+    units of the samples are assumed to match them.
+    """
+
+    def __init__(
+        self,
+        data,
+        box_size: float,
+        position_columns: tuple = ("x", "y", "z"),
+    ):
+        self.data = data
+        self.box_size = float(box_size)
+        self.position_columns = tuple(position_columns)
+        self.box_unit = self.__unit_of(data[self.position_columns[0]])
+        positions = np.column_stack(
+            [self.to_box_units(data[c]) for c in self.position_columns]
+        )
+        # The tree requires every position to be inside the box
+        self.positions = positions % self.box_size
+        self.tree = cKDTree(self.positions, boxsize=self.box_size)
+
+    def to_box_units(self, value) -> np.ndarray:
+        if self.__unit_of(value) is not None:
+            value = u.Quantity(value)
+            # Without units on the positions, there is nothing to convert to
+            unit = value.unit if self.box_unit is None else self.box_unit
+            value = value.to_value(unit)
+        return np.asarray(value, dtype=np.float64)
+
+    @staticmethod
+    def __unit_of(value):
+        unit = getattr(value, "unit", None)
+        return None if unit == u.dimensionless_unscaled else unit
+
+    def query_many(
+        self,
+        centers: np.ndarray,
+        radii,
+        dtypes: list,
+        columns: Optional[dict] = None,
+    ) -> dict:
+        """
+        Find the objects in each of a set of spheres. Centers are an (n, 3) array of
+        positions, and radii is either a single value or one per center. Only the
+        catalog is available for boxes.
+        """
+        centers, radii = self.__prepare(centers, radii)
+        members = self.tree.query_ball_point(centers, radii)
+        return self.__pack(members, columns)
+
+    def query_many_cubes(
+        self,
+        centers: np.ndarray,
+        sides,
+        dtypes: list,
+        columns: Optional[dict] = None,
+    ) -> dict:
+        """
+        Like `query_many`, but for cubes with the given side lengths.
+        """
+        centers, sides = self.__prepare(centers, sides)
+        # Search the sphere that encloses each cube, then cut it down
+        members = self.tree.query_ball_point(centers, sides / 2 * np.sqrt(3))
+        members = [
+            self.__in_cube(m, c, side) for m, c, side in zip(members, centers, sides)
+        ]
+        return self.__pack(members, columns)
+
+    def __prepare(self, centers, sizes) -> tuple:
+        centers = self.to_box_units(centers).reshape(-1, 3) % self.box_size
+        sizes = np.broadcast_to(self.to_box_units(sizes), len(centers))
+        return centers, sizes
+
+    def __pack(self, members: list, columns: Optional[dict]) -> dict:
+        members = [np.sort(np.asarray(m, dtype=np.int64)) for m in members]
+        offsets = np.zeros(len(members) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(m) for m in members])
+        indices = np.concatenate(members) if members else np.empty(0, dtype=np.int64)
+        catalog = take_rows(self.data, indices)
+        if (names := (columns or {}).get("catalog")) is not None:
+            catalog = select_columns(catalog, names)
+        return {"catalog": RaggedColumns(catalog, offsets)}
+
+    def __in_cube(self, members, center, size: float) -> np.ndarray:
+        members = np.asarray(members, dtype=np.int64)
+        offsets = periodic_offsets(self.positions[members], center, self.box_size)
+        return members[np.all(np.abs(offsets) <= size / 2, axis=1)]
+
+    def get_data_from_samples(
+        self,
+        coordinates,
+        dtypes,
+        sample_type,
+        sample_dimensions,
+        columns: Optional[dict] = None,
+        *args,
+        **kwargs,
+    ):
+        if sample_type not in SAMPLE_SHAPES:
+            raise NotImplementedError(f"Unknown sample shape {sample_type} for a box")
+        size = float(self.to_box_units(sample_dimensions))
+        centers = self.to_box_units(coordinates).reshape(-1, 3)
+        query = self.query_many if sample_type == "sphere" else self.query_many_cubes
+        results = query(centers, size, dtypes, columns)
+        for i, center in enumerate(centers):
+            region = BoxRegion(center, sample_type, size, self.box_size)
+            yield region, {dtype: result[i] for dtype, result in results.items()}
@@ -0,0 +1,275 @@
+import hashlib
+import json
+import os
+import shutil
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from uuid import uuid4
+
+import astropy.units as u
+import numpy as np
+import pandas as pd
+from astropy.coordinates import SkyCoord
+from astropy.table import Column, QTable, Table
+from loguru import logger
+
+"""
+Caches for tiles of data fetched from a dataset. Tiles are keyed by a string
+(see `cosmap.dataset.tiles.tile_key`), and a cache only ever holds tiles for a
+single dataset configuration.
+
+The memory cache lives on a single worker, and holds recently used tiles so that
+overlapping samples and neighboring chunks don't have to fetch them again.
+
+The disk cache persists between runs. Each tile is stored as a directory with one
+.npy file per column, plus a small json file describing how to rebuild the table.
+Columns are memory-mapped when a tile is read back, so a cache hit costs very little
+beyond the page cache.
+"""
+
+
+def cache_key(**config) -> str:
+    """
+    Build a key from everything that affects the content of a tile (the dataset,
+    the columns, the filters and the tiling). Values only need a stable repr.
+    """
+    description = json.dumps(
+        {k: repr(v) for k, v in sorted(config.items())}, sort_keys=True
+    )
+    return hashlib.sha1(description.encode()).hexdigest()[:16]
+
+
+class MemoryTileCache:
+    name = "memory"
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.__tiles = OrderedDict()
+        self.__size = 0
+        self.__lock = Lock()
+
+    def get(self, key: str):
+        with self.__lock:
+            if (entry := self.__tiles.get(key)) is None:
+                self.misses += 1
+                return None
+            self.__tiles.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, data):
+        size = data_nbytes(data)
+        if size > self.max_bytes:
+            return
+        with self.__lock:
+            if key in self.__tiles:
+                return
+            self.__tiles[key] = (data, size)
+            self.__size += size
+            while self.__size > self.max_bytes:
+                _, (_, evicted_size) = self.__tiles.popitem(last=False)
+                self.__size -= evicted_size
+
+    def statistics(self) -> dict:
+        with self.__lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def keys(self) -> list:
+        with self.__lock:
+            return list(self.__tiles)
+
+
+class DiskTileCache:
+    name = "disk"
+
+    def __init__(self, path: Path, key: str, max_bytes: int):
+        self.root = Path(path) / key
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.__size = sum(size for _, size, _ in self.__scan())
+        # Guards the counters. Reads and writes don't need it, since tiles are only
+        # ever swapped in whole.
+        self.__lock = Lock()
+
+    def get(self, key: str):
+        path = self.root / key
+        try:
+            data = read_tile(path)
+        except (FileNotFoundError, ValueError):
+            # Either not cached, or evicted by another process while reading
+            with self.__lock:
+                self.misses += 1
+            return None
+        # Mark the tile as recently used for eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        with self.__lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data):
+        path = self.root / key
+        if path.exists():
+            return
+        tmp_path = self.root / f".{key}.{uuid4().hex}"
+        try:
+            size = write_tile(tmp_path, data)
+        except (TypeError, ValueError) as e:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            logger.debug(f"Could not cache tile {key}: {e}")
+            return
+        try:
+            # Writes go to a temporary directory first, so other processes never
+            # see a partially written tile.
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another process beat us to it
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        with self.__lock:
+            self.__size += size
+            full = self.__size > self.max_bytes
+        if full:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used tiles until the cache is under its size cap.
+        """
+        tiles = sorted(self.__scan(), key=lambda t: t[0])
+        total = sum(size for _, size, _ in tiles)
+        for _, size, path in tiles:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+        with self.__lock:
+            self.__size = total
+
+    def statistics(self) -> dict:
+        with self.__lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def __scan(self):
+        for path in self.root.iterdir():
+            if path.name.startswith("."):
+                continue
+            try:
+                mtime = path.stat().st_mtime
+                size = sum(f.stat().st_size for f in path.iterdir())
+            except FileNotFoundError:
+                continue
+            yield mtime, size, path
+
+
+def data_nbytes(data) -> int:
+    """
+    Estimate the memory used by a tile.
+    """
+    if isinstance(data, pd.DataFrame):
+        return int(data.memory_usage(index=False).sum())
+    elif isinstance(data, dict):
+        columns = data.values()
+    elif isinstance(data, Table):
+        columns = data.columns.values()
+    else:
+        raise TypeError(f"Don't know how to measure data of type {type(data)}")
+    size = 0
+    for column in columns:
+        if isinstance(column, SkyCoord):
+            # Mostly two (or three) float64 arrays
+            size += 24 * len(column)
+        else:
+            size += np.asarray(column).nbytes
+    return size
+
+
+def write_tile(path: Path, data) -> int:
+    """
+    Write a tile to a directory, returning the number of bytes written.
+    """
+    columns, meta = serialize(data)
+    path.mkdir(parents=True)
+    size = 0
+    for i, values in enumerate(columns):
+        file = path / f"{i}.npy"
+        np.save(file, values, allow_pickle=False)
+        size += file.stat().st_size
+    with open(path / "meta.json", "w") as f:
+        json.dump(meta, f)
+    return size
+
+
+def read_tile(path: Path):
+    with open(path / "meta.json", "r") as f:
+        meta = json.load(f)
+    columns = [np.load(path / f"{i}.npy", mmap_mode="r") for i in range(meta["n"])]
+    return deserialize(columns, meta)
+
+
+def serialize(data) -> tuple:
+    """
+    Break a tile down into plain arrays, plus the metadata needed to rebuild it.
+    Supports astropy Tables (including Quantity and SkyCoord columns), pandas
+    DataFrames and mappings of column name to array.
+    """
+    arrays = []
+    entries = []
+    if isinstance(data, dict):
+        kind = "dict"
+        items = data.items()
+    elif isinstance(data, pd.DataFrame):
+        kind = "pandas"
+        items = ((name, data[name].to_numpy()) for name in data.columns)
+    elif isinstance(data, Table):
+        kind = "qtable" if isinstance(data, QTable) else "table"
+        items = ((name, data[name]) for name in data.colnames)
+    else:
+        raise TypeError(f"Don't know how to cache data of type {type(data)}")
+
+    for name, column in items:
+        entry = {"name": name, "kind": "array", "unit": None}
+        if isinstance(column, SkyCoord):
+            entry.update({"kind": "skycoord", "frame": column.frame.name})
+            arrays.extend([column.spherical.lon.deg, column.spherical.lat.deg])
+        elif isinstance(column, u.Quantity):
+            entry.update({"unit": column.unit.to_string()})
+            arrays.append(np.asarray(column.value))
+        else:
+            if isinstance(column, Column) and column.unit is not None:
+                entry.update({"unit": column.unit.to_string()})
+            arrays.append(np.ma.getdata(np.asarray(column)))
+        entries.append(entry)
+    return arrays, {"kind": kind, "n": len(arrays), "columns": entries}
+
+
+def deserialize(arrays: list, meta: dict):
+    arrays = iter(arrays)
+    columns = {}
+    for entry in meta["columns"]:
+        if entry["kind"] == "skycoord":
+            lon, lat = next(arrays), next(arrays)
+            column = SkyCoord(lon, lat, unit="deg", frame=entry["frame"])
+        elif entry["unit"] is None:
+            column = next(arrays)
+        elif meta["kind"] == "table":
+            column = Column(next(arrays), unit=entry["unit"], copy=False)
+        else:
+            column = u.Quantity(next(arrays), entry["unit"], copy=False)
+        columns.update({entry["name"]: column})
+    match meta["kind"]:
+        case "table":
+            return Table(columns, copy=False)
+        case "qtable":
+            return QTable(columns, copy=False)
+        case "pandas":
+            return pd.DataFrame(columns, copy=False)
+        case _:
+            return columns
@@ -0,0 +1,31 @@
+from enum import Flag, auto
+
+
+class DatasetCapability(Flag):
+    """
+    Capabilities a dataset wrapper can advertise. The wrapper plugin sets these as
+    the `capabilities` class attribute, and the task engine uses them to decide how
+    to lay out the workers and how to query the dataset.
+
+    BATCH_QUERIES: The dataset implements `query_many` natively.
+    COLUMN_PUSHDOWN: The dataset accepts a `columns` argument, and will only read
+        the columns the analysis actually needs.
+    SHARED_MEMORY: Copies of the dataset on the same node share their memory, so
+        running many worker processes is cheap.
+    THREAD_SAFE: A single copy of the dataset can be queried from several threads
+        at once.
+    """
+
+    NONE = 0
+    BATCH_QUERIES = auto()
+    COLUMN_PUSHDOWN = auto()
+    SHARED_MEMORY = auto()
+    THREAD_SAFE = auto()
+
+
+def get_capabilities(wrapper) -> DatasetCapability:
+    """
+    Get the capabilities of a wrapper plugin (or its class). Wrappers that don't
+    advertise anything are assumed to support nothing beyond the basic protocol.
+    """
+    return getattr(wrapper, "capabilities", DatasetCapability.NONE)
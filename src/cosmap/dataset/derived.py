@@ -0,0 +1,171 @@
+from typing import Callable
+
+import numpy as np
+
+from cosmap.dataset.batch import RaggedColumns
+from cosmap.dataset.geometry import to_degrees
+from cosmap.dataset.masks import RaggedMaskRasters, SampleMaskRaster
+from cosmap.dataset.neighbors import NeighborIndex
+from cosmap.dataset.region import SampleRegion
+
+"""
+Derived data types are computed by cosmap from the data fetched for each sample,
+rather than read from the dataset. They are requested in "needed-data" like any
+other data type, as the name of the data type they are derived from plus a suffix:
+
+    "catalog_geometry": The angular separation, position angle (east of north) and
+        gnomonic (tangent-plane) x/y offsets of every object in the catalog from
+        the sample center, all in degrees. The arrays are aligned row-by-row with
+        the catalog.
+
+    "catalog_index": A neighbor search over the objects in the sample, with radius
+        and k-nearest-neighbor queries (see `cosmap.dataset.neighbors`). Indices
+        returned by the queries are rows of the catalog.
+
+    "mask_raster": Vectorized point-in-mask tests and masked area fractions for
+        the sample, backed by a raster of the mask that each worker builds up as
+        it goes (see `cosmap.dataset.masks`). Masks aren't tables, so they reach
+        this as one mask object per sample.
+
+When the dataset supports batch queries, derived data is computed in a single
+vectorized pass over every object fetched for the chunk, and a single neighbor
+index is shared by every sample in the chunk.
+"""
+
+DERIVED_KINDS = ("geometry", "index", "raster")
+
+
+def split_dtypes(dtypes) -> tuple:
+    """
+    Split requested data types into the ones the dataset has to provide, and the
+    ones cosmap derives. Derived types are returned as name -> (base, kind).
+    """
+    base = set()
+    derived = {}
+    for dtype in dtypes:
+        prefix, _, kind = dtype.rpartition("_")
+        if prefix and kind in DERIVED_KINDS:
+            derived.update({dtype: (prefix, kind)})
+            base.add(prefix)
+        else:
+            base.add(dtype)
+    return sorted(base), derived
+
+
+def sample_geometry(ra, dec, center_ra, center_dec) -> dict:
+    """
+    Compute separations, position angles and gnomonic offsets of objects from
+    their sample centers. Everything is in degrees, and the centers may either be
+    scalars or one per object.
+    """
+    ra, dec = np.radians(ra), np.radians(dec)
+    center_ra, center_dec = np.radians(center_ra), np.radians(center_dec)
+    delta_ra = ra - center_ra
+    sin_dec, cos_dec = np.sin(dec), np.cos(dec)
+    sin_dec0, cos_dec0 = np.sin(center_dec), np.cos(center_dec)
+    cos_delta = np.cos(delta_ra)
+
+    east = cos_dec * np.sin(delta_ra)
+    north = cos_dec0 * sin_dec - sin_dec0 * cos_dec * cos_delta
+    cos_c = sin_dec0 * sin_dec + cos_dec0 * cos_dec * cos_delta
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = np.degrees(east / cos_c)
+        y = np.degrees(north / cos_c)
+    return {
+        "separation": np.degrees(np.arctan2(np.hypot(east, north), cos_c)),
+        "position_angle": np.degrees(np.arctan2(east, north)) % 360.0,
+        "x": x,
+        "y": y,
+    }
+
+
+def derive_chunk(
+    results: dict,
+    centers: np.ndarray,
+    derived: dict,
+    coordinate_columns: tuple,
+    mask_rasters: Callable = None,
+    radius: float = None,
+) -> dict:
+    """
+    Compute derived data for a whole chunk at once from the ragged batch results.
+    Mask rasters are looked up by the name of the masked data type with
+    `mask_rasters`.
+    """
+    output = {}
+    ra_column, dec_column = coordinate_columns
+    for name, (base, kind) in derived.items():
+        ragged = results[base]
+        if kind == "geometry":
+            row_centers = np.repeat(centers, ragged.counts, axis=0)
+            values = sample_geometry(
+                to_degrees(ragged.columns[ra_column]),
+                to_degrees(ragged.columns[dec_column]),
+                row_centers[:, 0],
+                row_centers[:, 1],
+            )
+            output.update({name: RaggedColumns(values, ragged.offsets)})
+        elif kind == "index":
+            index = NeighborIndex(
+                to_degrees(ragged.columns[ra_column]),
+                to_degrees(ragged.columns[dec_column]),
+                ragged.offsets,
+            )
+            output.update({name: index})
+        elif kind == "raster":
+            output.update(
+                {name: RaggedMaskRasters(mask_rasters(base), ragged, centers, radius)}
+            )
+    return output
+
+
+def derive_sample(
+    sample: dict,
+    region,
+    derived: dict,
+    coordinate_columns: tuple,
+    mask_rasters: Callable = None,
+    radius: float = None,
+) -> dict:
+    """
+    Compute derived data for a single sample. This is used for datasets that hand
+    out samples one at a time.
+    """
+    output = {}
+    ra_column, dec_column = coordinate_columns
+    center_ra, center_dec = region_center(region)
+    for name, (base, kind) in derived.items():
+        data = sample[base]
+        if kind == "geometry":
+            values = sample_geometry(
+                to_degrees(data[ra_column]),
+                to_degrees(data[dec_column]),
+                center_ra,
+                center_dec,
+            )
+            output.update({name: values})
+        elif kind == "index":
+            ra = to_degrees(data[ra_column])
+            index = NeighborIndex(ra, to_degrees(data[dec_column]), [0, len(ra)])
+            output.update({name: index[0]})
+        elif kind == "raster":
+            output.update(
+                {
+                    name: SampleMaskRaster(
+                        mask_rasters(base), data, (center_ra, center_dec), radius
+                    )
+                }
+            )
+    return output
+
+
+def region_center(region) -> tuple:
+    """
+    Get the center of a sample region as RA/Dec in degrees. Regions from other
+    libraries are expected to either be a SkyCoord or have a `coordinate`.
+    """
+    if isinstance(region, SampleRegion):
+        return region.ra_deg, region.dec_deg
+    coordinate = getattr(region, "coordinate", region)
+    return coordinate.ra.deg, coordinate.dec.deg
@@ -0,0 +1,127 @@
+import operator
+import re
+
+import numpy as np
+from pydantic import BaseModel
+
+"""
+Row filters are static predicates that an analysis can declare for a given data type.
+They are applied by the dataset wrapper when the data is loaded (or indexed), before
+any individual samples are extracted. This means the catalogs that reach the
+transformations have already been cut, and the cut is only done once.
+
+Filters are declared in the dataset parameters, keyed by data type:
+
+    "dataset_parameters": {
+        "filters": {
+            "catalog": ["redshift < Main.z_s", "mag_i < 24"]
+        }
+    }
+
+The right hand side of each expression can either be a number or the name of a
+parameter, which will be resolved when the analysis is set up.
+"""
+
+
+class CosmapFilterException(Exception):
+    pass
+
+
+OPERATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+_expression = re.compile(r"^\s*([\w\-]+)\s*(<=|>=|==|!=|<|>)\s*(\S+)\s*$")
+
+
+class RowFilter:
+    """
+    A single predicate of the form `column <op> value`. The value has already been
+    resolved, so filters can be shipped to the workers as-is.
+    """
+
+    def __init__(self, column: str, op: str, value):
+        if op not in OPERATORS:
+            raise CosmapFilterException(f"Unknown filter operator '{op}'")
+        self.column = column
+        self.op = op
+        self.value = value
+
+    def mask(self, data) -> np.ndarray:
+        """
+        Evaluate the predicate against a table-like object (anything that can be
+        indexed by column name) and return a boolean mask.
+        """
+        return np.asarray(OPERATORS[self.op](data[self.column], self.value), dtype=bool)
+
+    def __repr__(self):
+        return f"RowFilter({self.column} {self.op} {self.value})"
+
+
+def parse_expression(expression: str) -> tuple:
+    match = _expression.match(expression)
+    if match is None:
+        raise CosmapFilterException(
+            f"Could not parse filter '{expression}'. Filters should be of the form "
+            "'column <op> value'"
+        )
+    return match.groups()
+
+
+def build_filters(filter_config: dict, parameters: BaseModel) -> dict:
+    """
+    Turn the filter block from the dataset parameters into lists of RowFilters,
+    resolving any parameters referenced in the expressions.
+    """
+    filters = {}
+    for dtype, expressions in filter_config.items():
+        if isinstance(expressions, str):
+            expressions = [expressions]
+        dtype_filters = []
+        for expression in expressions:
+            column, op, value = parse_expression(expression)
+            dtype_filters.append(
+                RowFilter(column, op, _resolve_value(value, parameters))
+            )
+        filters.update({dtype: dtype_filters})
+    return filters
+
+
+def apply_filters(data, filters: list):
+    """
+    Apply a list of filters to a table-like object in a single vectorized pass.
+    """
+    if not filters:
+        return data
+    mask = np.logical_and.reduce([f.mask(data) for f in filters])
+    return data[mask]
+
+
+def _resolve_value(value: str, parameters: BaseModel):
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    param_path = value.split(".")
+    if param_path[0] == "Main":
+        # Parameters declared in the analysis "Main" block live on the analysis
+        # parameters, but top-level parameters can also be referenced this way.
+        candidates = [parameters.analysis_parameters, parameters]
+        param_path = param_path[1:]
+    else:
+        candidates = [parameters.analysis_parameters]
+    for obj in candidates:
+        try:
+            for p in param_path:
+                obj = getattr(obj, p)
+            return obj
+        except AttributeError:
+            continue
+    raise CosmapFilterException(
+        f"Filter references parameter {value}, but it could not be found!"
+    )
@@ -0,0 +1,93 @@
+import astropy.units as u
+import numpy as np
+
+"""
+Small, vectorized helpers for working with positions on the sky. Everything in here
+works on plain float64 arrays of RA/Dec in degrees, so that the hot paths in the
+dataset wrappers never have to build astropy objects for individual samples.
+"""
+
+
+def to_degrees(values) -> np.ndarray:
+    """
+    Get a plain float64 array in degrees from a column that may or may not
+    carry units.
+    """
+    if isinstance(values, u.Quantity):
+        return values.to_value(u.deg)
+    return np.asarray(values, dtype=np.float64)
+
+
+def unit_vectors(ra, dec) -> np.ndarray:
+    """
+    Convert RA/Dec in degrees to an (n, 3) array of unit vectors.
+    """
+    ra = np.radians(np.asarray(ra, dtype=np.float64))
+    dec = np.radians(np.asarray(dec, dtype=np.float64))
+    cos_dec = np.cos(dec)
+    return np.stack([cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)], axis=-1)
+
+
+def vectors_to_radec(vectors: np.ndarray):
+    """
+    Convert unit vectors back to RA/Dec in degrees.
+    """
+    vectors = np.asarray(vectors, dtype=np.float64)
+    ra = np.degrees(np.arctan2(vectors[..., 1], vectors[..., 0])) % 360.0
+    dec = np.degrees(np.arcsin(np.clip(vectors[..., 2], -1.0, 1.0)))
+    return ra, dec
+
+
+def bounding_cone(centers: np.ndarray, radii: np.ndarray):
+    """
+    Find a cone that encloses a set of cones. The result does not have to be
+    minimal, it is just used to limit the amount of data that is read for a chunk.
+    Returns None if the cones are spread over the whole sky.
+    """
+    vectors = unit_vectors(centers[:, 0], centers[:, 1])
+    mean = vectors.mean(axis=0)
+    norm = np.linalg.norm(mean)
+    if norm < 1e-8:
+        return None
+    axis = mean / norm
+    separations = np.degrees(np.arccos(np.clip(vectors @ axis, -1.0, 1.0)))
+    radius = float(np.max(separations + radii))
+    if radius >= 180.0:
+        return None
+    ra, dec = vectors_to_radec(axis)
+    return (float(ra), float(dec)), radius
+
+
+def cone_members(ra, dec, centers: np.ndarray, radii: np.ndarray):
+    """
+    Find the objects that fall within each of a set of cones in a single sweep.
+    The objects are sorted by declination once, so each cone only has to test the
+    objects in its declination band.
+
+    Returns a flat array of object indices and an array of offsets, such that the
+    members of cone i are indices[offsets[i]:offsets[i+1]]. Indices within each cone
+    are in their original order.
+    """
+    ra = np.asarray(ra, dtype=np.float64)
+    dec = np.asarray(dec, dtype=np.float64)
+    order = np.argsort(dec, kind="stable")
+    sorted_dec = dec[order]
+    vectors = unit_vectors(ra[order], sorted_dec)
+    center_vectors = unit_vectors(centers[:, 0], centers[:, 1])
+    low = np.searchsorted(sorted_dec, centers[:, 1] - radii, side="left")
+    high = np.searchsorted(sorted_dec, centers[:, 1] + radii, side="right")
+    cos_radii = np.cos(np.radians(radii))
+
+    members = []
+    for i in range(len(centers)):
+        band = vectors[low[i] : high[i]]
+        inside = band @ center_vectors[i] >= cos_radii[i]
+        members.append(np.sort(order[low[i] : high[i]][inside]))
+
+    offsets = np.zeros(len(centers) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(m) for m in members])
+    if members:
+        indices = np.concatenate(members)
+    else:
+        indices = np.empty(0, dtype=np.int64)
+    return indices, offsets
@@ -0,0 +1,239 @@
+from threading import Lock
+
+import astropy.units as u
+import numpy as np
+from astropy.coordinates import SkyCoord
+from astropy_healpix import HEALPix
+
+from cosmap.dataset.geometry import to_degrees, unit_vectors
+
+"""
+Rasterized masks. Testing catalog positions against polygon masks (bright stars,
+survey edges...) is often the slowest part of a transformation, and overlapping
+samples end up testing the same patches of sky over and over.
+
+Instead, each worker keeps a raster of each mask on a fine HEALPix grid (nested
+ordering). A pixel's state is found by testing its center against the mask the
+first time it is needed, and after that it's a lookup. Only the pixels inside the
+sample that fetched the mask are kept, since that's where the fetched mask is
+known to be complete.
+
+The raster is filled in as samples come in, rather than computed up front. Datasets
+only hand out the mask for each sample's cone, so the mask for the whole region is
+never available in one piece. Overlapping samples and later chunks on the same
+worker still reuse every pixel that has been tested.
+
+The raster is stored per coarse tile. A tile holds a bitmap of the fine pixels in
+it, and once every pixel in a tile is known and they all agree, the bitmap is
+replaced by a single flag. Large clean (or fully masked) areas then cost almost
+nothing.
+
+Masks are requested in "needed-data" as "<dtype>_raster", for example
+"mask_raster", which gives a SampleMaskRaster for the sample. Every masked data type
+(and every realization) gets its own raster.
+"""
+
+# About 6.4 arcseconds per pixel
+RASTER_NSIDE = 2**15
+TILE_NSIDE = 64
+
+
+class MaskRaster:
+    """
+    The raster for a single worker, shared by every sample it processes.
+    """
+
+    def __init__(self, nside: int = RASTER_NSIDE, tile_nside: int = TILE_NSIDE):
+        if nside % tile_nside or nside < tile_nside:
+            raise ValueError("The raster nside must be a multiple of the tile nside")
+        self.healpix = HEALPix(nside=nside, order="nested")
+        self.tile_shift = 2 * int(np.log2(nside // tile_nside))
+        self.pixels_per_tile = 1 << self.tile_shift
+        self.__tiles = {}
+        self.__lock = Lock()
+
+    @property
+    def pixel_size(self) -> float:
+        return self.healpix.pixel_resolution.to_value(u.deg)
+
+    def pixels(self, ra, dec) -> np.ndarray:
+        return np.asarray(
+            self.healpix.lonlat_to_healpix(
+                np.asarray(ra) * u.deg, np.asarray(dec) * u.deg
+            ),
+            dtype=np.int64,
+        )
+
+    def pixel_centers(self, pixels: np.ndarray) -> tuple:
+        lon, lat = self.healpix.healpix_to_lonlat(pixels)
+        return lon.to_value(u.deg), lat.to_value(u.deg)
+
+    def cone_pixels(self, ra: float, dec: float, radius: float) -> np.ndarray:
+        return np.asarray(
+            self.healpix.cone_search_lonlat(ra * u.deg, dec * u.deg, radius * u.deg),
+            dtype=np.int64,
+        )
+
+    def lookup(self, pixels: np.ndarray) -> tuple:
+        """
+        Get whether each pixel is known, and whether it is masked.
+        """
+        known = np.zeros(len(pixels), dtype=bool)
+        masked = np.zeros(len(pixels), dtype=bool)
+        tiles = pixels >> self.tile_shift
+        for tile in np.unique(tiles):
+            if (entry := self.__tiles.get(tile)) is None:
+                continue
+            in_tile = tiles == tile
+            if isinstance(entry, bool):
+                known[in_tile] = True
+                masked[in_tile] = entry
+                continue
+            tile_known, tile_masked, _ = entry
+            local = pixels[in_tile] - (tile << self.tile_shift)
+            known[in_tile] = tile_known[local]
+            masked[in_tile] = tile_masked[local]
+        return known, masked
+
+    def store(self, pixels: np.ndarray, masked: np.ndarray):
+        tiles = pixels >> self.tile_shift
+        with self.__lock:
+            for tile in np.unique(tiles):
+                entry = self.__tiles.get(tile)
+                if isinstance(entry, bool):
+                    continue
+                if entry is None:
+                    entry = [
+                        np.zeros(self.pixels_per_tile, dtype=bool),
+                        np.zeros(self.pixels_per_tile, dtype=bool),
+                        0,
+                    ]
+                in_tile = tiles == tile
+                local = pixels[in_tile] - (tile << self.tile_shift)
+                new = ~entry[0][local]
+                entry[0][local[new]] = True
+                entry[1][local[new]] = masked[in_tile][new]
+                entry[2] += int(np.count_nonzero(new))
+                if entry[2] == self.pixels_per_tile and (
+                    not entry[1].any() or entry[1].all()
+                ):
+                    # Every pixel agrees, so the bitmap isn't needed any more
+                    entry = bool(entry[1][0])
+                self.__tiles[tile] = entry
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            0 if isinstance(e, bool) else e[0].nbytes + e[1].nbytes
+            for e in self.__tiles.values()
+        )
+
+
+class SampleMaskRaster:
+    """
+    The mask for a single sample, backed by the worker's raster. Positions are
+    RA/Dec in degrees, and may be scalars or arrays. For example, to drop the
+    masked objects from a catalog:
+
+        catalog = catalog[~mask_raster.is_masked(catalog["ra"], catalog["dec"])]
+    """
+
+    def __init__(self, raster: MaskRaster, mask, center: tuple, radius: float):
+        self.raster = raster
+        self.mask = mask
+        self.center = center
+        self.radius = radius
+
+    def is_masked(self, ra, dec):
+        ra, dec = to_degrees(ra), to_degrees(dec)
+        masked = self.__masked_pixels(self.raster.pixels(ra, dec).reshape(-1))
+        return masked[0] if np.ndim(ra) == 0 else masked.reshape(np.shape(ra))
+
+    def masked_fraction(self, radius: float = None) -> float:
+        """
+        Get the fraction of a cone around the sample center that is masked. The
+        radius is in degrees, and defaults to the radius of the sample.
+        """
+        radius = self.radius if radius is None else radius
+        pixels = self.raster.cone_pixels(*self.center, radius)
+        if not len(pixels):
+            return 0.0
+        return float(np.count_nonzero(self.__masked_pixels(pixels)) / len(pixels))
+
+    def __masked_pixels(self, pixels: np.ndarray) -> np.ndarray:
+        known, masked = self.raster.lookup(pixels)
+        if known.all():
+            return masked
+        unknown, inverse = np.unique(pixels[~known], return_inverse=True)
+        ra, dec = self.raster.pixel_centers(unknown)
+        values = evaluate_mask(self.mask, ra, dec)
+        masked[~known] = values[inverse]
+        # Pixels outside the sample may not be covered by the mask we fetched
+        center = unit_vectors(*self.center)
+        inside = unit_vectors(ra, dec).reshape(-1, 3) @ center >= np.cos(
+            np.radians(self.radius)
+        )
+        self.raster.store(unknown[inside], values[inside])
+        return masked
+
+
+class RaggedMaskRasters:
+    """
+    The mask rasters for every sample in a chunk. Masks are given as a list with
+    one mask per sample.
+    """
+
+    def __init__(self, raster: MaskRaster, masks: list, centers: np.ndarray, radius):
+        if len(masks) != len(centers):
+            raise ValueError(
+                f"Expected one mask per sample, got {len(masks)} masks for"
+                f" {len(centers)} samples"
+            )
+        self.raster = raster
+        self.masks = masks
+        self.centers = centers
+        self.radius = radius
+
+    def __len__(self):
+        return len(self.centers)
+
+    def __getitem__(self, i: int):
+        return SampleMaskRaster(
+            self.raster, self.masks[i], tuple(self.centers[i]), self.radius
+        )
+
+
+_rasters_lock = Lock()
+
+
+def get_mask_raster(worker, dtype: str, realization: str = None) -> MaskRaster:
+    """
+    Get the worker's raster for a masked data type (in a given realization),
+    creating it the first time it's needed.
+    """
+    with _rasters_lock:
+        if (rasters := getattr(worker, "mask_rasters", None)) is None:
+            rasters = {}
+            worker.mask_rasters = rasters
+        if (raster := rasters.get((dtype, realization))) is None:
+            raster = MaskRaster()
+            rasters[(dtype, realization)] = raster
+    return raster
+
+
+def evaluate_mask(mask, ra: np.ndarray, dec: np.ndarray) -> np.ndarray:
+    """
+    Test positions against a mask, and return True for the masked ones. Masks may
+    either implement `contains(ra, dec)`, or behave like heinlein masks, where
+    `mask(coordinates)` returns the coordinates that are not masked.
+    """
+    if len(ra) == 0:
+        return np.zeros(0, dtype=bool)
+    if hasattr(mask, "contains"):
+        return np.asarray(mask.contains(ra, dec), dtype=bool)
+    kept = mask.mask(SkyCoord(ra, dec, unit="deg"))
+    # The kept coordinates are a subset of the ones we passed in, so they match
+    # exactly.
+    positions = ra + 1j * dec
+    kept_positions = kept.ra.deg + 1j * kept.dec.deg
+    return ~np.isin(positions, kept_positions)
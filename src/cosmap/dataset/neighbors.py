@@ -0,0 +1,128 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from cosmap.dataset.geometry import unit_vectors
+
+"""
+Neighbor searches over the objects fetched for a chunk. A single KD-tree is built
+(lazily, on first use) over the unit vectors of every object in the chunk, and each
+sample gets a view that restricts the results to its own objects. Indices returned
+by the view are row indices into the sample's data, so they line up with the
+catalog handed to the transformation.
+
+Since neighboring samples overlap, an object may appear in the tree once for every
+sample that contains it. The views only ever return rows that belong to their own
+sample, so this is invisible from the outside.
+"""
+
+
+def chord_length(radius) -> np.ndarray:
+    """
+    Convert an angular radius in degrees to the distance between unit vectors.
+    """
+    return 2 * np.sin(np.radians(np.asarray(radius, dtype=np.float64)) / 2)
+
+
+def chord_to_degrees(chord) -> np.ndarray:
+    return np.degrees(2 * np.arcsin(np.clip(np.asarray(chord) / 2, 0.0, 1.0)))
+
+
+class NeighborIndex:
+    """
+    The neighbor search for a whole chunk. The rows belonging to sample i are
+    offsets[i]:offsets[i+1], as with RaggedColumns, and indexing returns the view
+    for a single sample.
+    """
+
+    def __init__(self, ra, dec, offsets: np.ndarray):
+        self.vectors = unit_vectors(ra, dec).reshape(-1, 3)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.__tree = None
+
+    @property
+    def tree(self) -> cKDTree:
+        if self.__tree is None:
+            self.__tree = cKDTree(self.vectors)
+        return self.__tree
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int):
+        return SampleNeighbors(self, self.offsets[i], self.offsets[i + 1])
+
+
+class SampleNeighbors:
+    """
+    Neighbor queries for a single sample. Positions are RA/Dec in degrees, and may
+    be scalars or arrays. For example, to find every pair of objects in the sample
+    within 10 arcseconds:
+
+        neighbors.query_radius(catalog["ra"], catalog["dec"], 10 / 3600)
+    """
+
+    def __init__(self, index: NeighborIndex, start: int, stop: int):
+        self.index = index
+        self.start = int(start)
+        self.stop = int(stop)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def query_radius(self, ra, dec, radius):
+        """
+        Find the objects in the sample within `radius` degrees of each position.
+        Returns an array of row indices for a scalar position, or a list of them
+        for an array of positions.
+        """
+        points = unit_vectors(ra, dec).reshape(-1, 3)
+        if len(self) == 0:
+            found = [np.empty(0, dtype=np.int64) for _ in points]
+        else:
+            rows = self.index.tree.query_ball_point(points, chord_length(radius))
+            found = [self.__local(np.asarray(r, dtype=np.int64)) for r in rows]
+        return found[0] if np.ndim(ra) == 0 else found
+
+    def query_knn(self, ra, dec, k: int = 1):
+        """
+        Find the k nearest objects in the sample to each position. Returns the
+        separations (in degrees) and row indices, each with shape (n, k), or (k,)
+        for a scalar position. If the sample has fewer than k objects, the missing
+        neighbors have an infinite separation and an index of -1.
+        """
+        points = unit_vectors(ra, dec).reshape(-1, 3)
+        separations = np.full((len(points), k), np.inf)
+        indices = np.full((len(points), k), -1, dtype=np.int64)
+        n_wanted = min(k, len(self))
+        pending = np.arange(len(points))
+        n_query = n_wanted
+        tree = self.index.tree if n_wanted else None
+        while n_wanted and pending.size:
+            # Objects from neighboring samples may be closer than the ones in
+            # this sample, so keep widening the search until we find enough.
+            n_query = min(n_query, tree.n)
+            distances, rows = tree.query(points[pending], k=n_query)
+            distances = distances.reshape(len(pending), -1)
+            rows = rows.reshape(len(pending), -1)
+            in_sample = (rows >= self.start) & (rows < self.stop)
+            done = (in_sample.sum(axis=1) >= n_wanted) | (n_query == tree.n)
+            order = np.argsort(~in_sample[done], axis=1, kind="stable")[:, :n_wanted]
+            found = np.take_along_axis(in_sample[done], order, axis=1)
+            done_rows = np.take_along_axis(rows[done], order, axis=1)
+            done_distances = np.take_along_axis(distances[done], order, axis=1)
+            separations[pending[done], :n_wanted] = np.where(
+                found, chord_to_degrees(done_distances), np.inf
+            )
+            indices[pending[done], :n_wanted] = np.where(
+                found, done_rows - self.start, -1
+            )
+            pending = pending[~done]
+            n_query *= 2
+
+        if np.ndim(ra) == 0:
+            return separations[0], indices[0]
+        return separations, indices
+
+    def __local(self, rows: np.ndarray) -> np.ndarray:
+        rows = rows[(rows >= self.start) & (rows < self.stop)]
+        return np.sort(rows - self.start)
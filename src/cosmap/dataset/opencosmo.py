@@ -6,52 +6,134 @@ import opencosmo as oc
 from astropy.coordinates import SkyCoord
 from dask.distributed.diagnostics.plugin import WorkerPlugin
 
+from cosmap.dataset.batch import RaggedColumns, as_center_array, as_radius_array
+from cosmap.dataset.box import PeriodicBoxDataset
+from cosmap.dataset.capabilities import DatasetCapability
+from cosmap.dataset.filters import OPERATORS
+from cosmap.dataset.geometry import bounding_cone, cone_members, to_degrees
+from cosmap.dataset.realizations import (
+    RealizationDataset,
+    close_dataset,
+    name_realizations,
+)
+
 
 class opencosmoPlugin(WorkerPlugin):
+    capabilities = DatasetCapability.BATCH_QUERIES | DatasetCapability.COLUMN_PUSHDOWN
+
     def __init__(
         self,
         name: Optional[str],
         path: Path,
         dataset_columns: Optional[list[str]],
+        row_filters: dict = {},
+        coordinate_columns: tuple = ("ra", "dec"),
+        position_columns: tuple = ("x", "y", "z"),
+        box_size: Optional[float] = None,
+        realizations: bool = False,
+        open_realizations: int = 4,
         **kwargs,
     ):
         self.__files = identify_opencosmo_files(path)
+        # Each file is a separate realization, rather than part of one dataset
+        self.__realizations = name_realizations(self.__files) if realizations else None
+        self.__open_realizations = open_realizations
         self.__columns = dataset_columns
+        self.__coordinate_columns = tuple(coordinate_columns)
+        self.__position_columns = tuple(position_columns)
+        self.__box_size = box_size
+        # The proxy only ever returns a catalog
+        self.__filters = row_filters.get("catalog", [])
+
+    @property
+    def realizations(self) -> Optional[list[str]]:
+        if self.__realizations is None:
+            return None
+        return list(self.__realizations)
 
     def setup(self, worker):
-        dataset = oc.open(self.__files)
+        if self.__realizations is not None:
+            worker.dataset = RealizationDataset(
+                self.__realizations, self.__open, self.__open_realizations
+            )
+            return
+        worker.dataset = self.__open(self.__files)
+
+    def __open(self, files):
+        dataset = oc.open(files)
+        if self.__filters:
+            # Filter before selecting, since filters may use columns that
+            # are not part of the final selection.
+            dataset = dataset.filter(
+                *[OPERATORS[f.op](oc.col(f.column), f.value) for f in self.__filters]
+            )
         if self.__columns is not None:
-            dataset = dataset.select(self.__columns)
-        worker.dataset = OpenCosmoProxy(dataset)
+            columns = list(self.__columns)
+            if self.__box_size is not None:
+                columns += [c for c in self.__position_columns if c not in columns]
+            dataset = dataset.select(columns)
+        if self.__box_size is not None:
+            # Snapshots are loaded whole, and indexed once per worker, so the file
+            # isn't needed after this
+            data = dataset.get_data()
+            close_dataset(dataset)
+            return PeriodicBoxDataset(data, self.__box_size, self.__position_columns)
+        return OpenCosmoProxy(dataset, self.__coordinate_columns)
 
     def teardown(self, worker):
         try:
-            del worker.dataset
+            dataset = worker.dataset
         except AttributeError:
             return
+        close_dataset(dataset)
+        del worker.dataset
 
 
 class OpenCosmoProxy:
-    def __init__(self, dataset):
+    def __init__(self, dataset, coordinate_columns: tuple = ("ra", "dec")):
         self.__dataset = dataset
+        self.__coordinate_columns = coordinate_columns
 
-    def get_data_from_samples(
-        self, coordinates: SkyCoord, dtypes, sample_type, sample_dimensions: u.Quantity
-    ):
-        assert sample_type == "cone"
-        min_ra = coordinates.ra.min()
-        max_ra = coordinates.ra.max()
-        min_dec = coordinates.dec.min()
-        max_dec = coordinates.dec.max()
-        # this is just for caching optimization. Does not have to be perfect
-        min_ra = min_ra - 2 * sample_dimensions
-        max_ra = max_ra - 2 * sample_dimensions
-        min_dec = min_dec - 2 * sample_dimensions
-        max_dec = max_dec + 2 * sample_dimensions
-
-        for coordinate in coordinates:
-            region = oc.make_cone(coordinate, sample_dimensions)
-            yield region, {"catalog": self.__dataset.bound(region).get_data()}
+    def close(self):
+        close_dataset(self.__dataset)
+
+    def query_many(
+        self,
+        centers,
+        radii,
+        dtypes: list,
+        columns: Optional[dict] = None,
+    ) -> dict:
+        """
+        Answer all the cones in a chunk with a single read. We bound the dataset to
+        a cone that covers the whole chunk, then sweep over the objects once to find
+        the members of each sample.
+        """
+        centers = as_center_array(centers)
+        radii = as_radius_array(radii, len(centers))
+        dataset = self.__dataset
+        if (cone := bounding_cone(centers, radii)) is not None:
+            (ra, dec), radius = cone
+            region = oc.make_cone(SkyCoord(ra, dec, unit="deg"), radius * u.deg)
+            dataset = dataset.bound(region)
+        ra_column, dec_column = self.__coordinate_columns
+        catalog_columns = (columns or {}).get("catalog")
+        if catalog_columns is not None:
+            # Only read what the analysis needs, plus what we need for the sweep
+            needed = set(catalog_columns) | {ra_column, dec_column}
+            dataset = dataset.select(sorted(needed))
+        catalog = dataset.get_data()
+
+        indices, offsets = cone_members(
+            to_degrees(catalog[ra_column]),
+            to_degrees(catalog[dec_column]),
+            centers,
+            radii,
+        )
+        catalog = catalog[indices]
+        if catalog_columns is not None:
+            catalog = catalog[catalog_columns]
+        return {"catalog": RaggedColumns(catalog, offsets)}
 
 
 def identify_opencosmo_files(path: Path):
@@ -0,0 +1,272 @@
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from dask.distributed.diagnostics.plugin import WorkerPlugin
+
+from cosmap.dataset.batch import RaggedColumns, as_center_array, as_radius_array
+from cosmap.dataset.capabilities import DatasetCapability
+from cosmap.dataset.geometry import bounding_cone, cone_members
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+"""
+A wrapper for catalogs stored as (partitioned) Parquet files, for example one
+directory per HEALPix pixel. Files are memory-mapped, so workers on the same node
+share the page cache rather than holding their own copy of the data.
+
+For each chunk, we only read the row groups whose RA/Dec statistics overlap the
+region covered by the chunk. Row groups that can't pass the row filters (based on
+their statistics) are skipped as well. Since the statistics are per row group,
+this prunes HEALPix partitions without needing to know the pixelization.
+
+Reading isn't free of copies. The row groups that are read are decompressed into
+Arrow buffers, and the rows in each cone are then gathered into one flat table for
+the chunk (cones can overlap, so rows may appear more than once). That gather is a
+single copy of the selected rows per chunk. After that, the per-sample catalogs are
+slices of the flat table and are not copied again.
+"""
+
+# Names of the pyarrow.compute functions for each filter operator
+PARQUET_FILTER_FUNCTIONS = {
+    "<": "less",
+    "<=": "less_equal",
+    ">": "greater",
+    ">=": "greater_equal",
+    "==": "equal",
+    "!=": "not_equal",
+}
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError(
+            "The parquet dataset wrapper requires pyarrow. "
+            "Install it with `pip install cosmap[parquet]`"
+        )
+
+
+class parquetPlugin(WorkerPlugin):
+    capabilities = (
+        DatasetCapability.BATCH_QUERIES
+        | DatasetCapability.COLUMN_PUSHDOWN
+        | DatasetCapability.SHARED_MEMORY
+        | DatasetCapability.THREAD_SAFE
+    )
+
+    def __init__(
+        self,
+        name: Optional[str],
+        path: Path,
+        dataset_columns: Optional[list[str]],
+        row_filters: dict = {},
+        coordinate_columns: tuple = ("ra", "dec"),
+        **kwargs,
+    ):
+        _require_pyarrow()
+        self.__files = identify_parquet_files(path)
+        self.__columns = dataset_columns
+        self.__coordinate_columns = tuple(coordinate_columns)
+        self.__filters = row_filters.get("catalog", [])
+
+    def setup(self, worker):
+        worker.dataset = ParquetDataset(
+            self.__files, self.__columns, self.__filters, self.__coordinate_columns
+        )
+
+    def teardown(self, worker):
+        try:
+            del worker.dataset
+        except AttributeError:
+            return
+
+
+class ParquetDataset:
+    """
+    Holds the (memory-mapped) file handles and the row group statistics needed to
+    decide which row groups to read for a given chunk.
+    """
+
+    def __init__(
+        self,
+        files: list[Path],
+        columns: Optional[list[str]],
+        row_filters: list,
+        coordinate_columns: tuple = ("ra", "dec"),
+    ):
+        self.__files = [pq.ParquetFile(f, memory_map=True) for f in files]
+        self.__columns = columns
+        self.__filters = row_filters
+        self.__coordinate_columns = coordinate_columns
+        self.__build_row_group_index()
+
+    def __build_row_group_index(self):
+        ra_column, dec_column = self.__coordinate_columns
+        filter_columns = {f.column for f in self.__filters}
+        groups = []
+        bounds = []
+        filter_stats = []
+        for file_index, file in enumerate(self.__files):
+            metadata = file.metadata
+            for group_index in range(metadata.num_row_groups):
+                stats = _row_group_statistics(metadata.row_group(group_index))
+                ra_stats = stats.get(ra_column, (0.0, 360.0))
+                dec_stats = stats.get(dec_column, (-90.0, 90.0))
+                groups.append((file_index, group_index))
+                bounds.append([*ra_stats, *dec_stats])
+                filter_stats.append({c: stats.get(c) for c in filter_columns})
+        self.__groups = groups
+        self.__bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+        self.__keep = np.array(
+            [self.__passes_filters(s) for s in filter_stats], dtype=bool
+        )
+
+    def __passes_filters(self, stats: dict) -> bool:
+        """
+        Check if any row in a row group could possibly pass the filters, based on
+        the min/max statistics.
+        """
+        for f in self.__filters:
+            if (s := stats.get(f.column)) is None:
+                continue
+            low, high = s
+            value = getattr(f.value, "value", f.value)
+            match f.op:
+                case "<" if low >= value:
+                    return False
+                case "<=" if low > value:
+                    return False
+                case ">" if high <= value:
+                    return False
+                case ">=" if high < value:
+                    return False
+                case "==" if value < low or value > high:
+                    return False
+        return True
+
+    def row_groups_for_region(self, center: tuple, radius: float) -> list:
+        """
+        Find the row groups whose bounding box overlaps a cone.
+        """
+        ra, dec = center
+        ra_min, ra_max, dec_min, dec_max = self.__bounds.T
+        mask = self.__keep & (dec_max >= dec - radius) & (dec_min <= dec + radius)
+        max_dec = min(abs(dec) + radius, 90.0)
+        if max_dec < 90.0:
+            half_width = radius / np.cos(np.radians(max_dec))
+            if half_width < 180.0:
+                mask &= _ra_overlaps(ra_min, ra_max, ra - half_width, ra + half_width)
+        return [self.__groups[i] for i in np.flatnonzero(mask)]
+
+    def read(self, row_groups: list, columns: Optional[list] = None):
+        ra_column, dec_column = self.__coordinate_columns
+        columns = columns if columns is not None else self.__columns
+        if columns is not None:
+            filter_columns = [f.column for f in self.__filters]
+            needed = set(columns) | {ra_column, dec_column} | set(filter_columns)
+            columns = sorted(needed)
+
+        by_file = {}
+        for file_index, group_index in row_groups:
+            by_file.setdefault(file_index, []).append(group_index)
+        tables = [
+            self.__files[file_index].read_row_groups(groups, columns=columns)
+            for file_index, groups in by_file.items()
+        ]
+        if not tables:
+            schema = self.__files[0].schema_arrow
+            if columns is not None:
+                schema = pa.schema([schema.field(c) for c in columns])
+            return schema.empty_table()
+        table = pa.concat_tables(tables)
+        if self.__filters:
+            mask = None
+            for f in self.__filters:
+                value = getattr(f.value, "value", f.value)
+                function = getattr(pc, PARQUET_FILTER_FUNCTIONS[f.op])
+                m = function(table.column(f.column), value)
+                mask = m if mask is None else pc.and_(mask, m)
+            table = table.filter(mask)
+        return table
+
+    def query_many(
+        self,
+        centers,
+        radii,
+        dtypes: list,
+        columns: Optional[dict] = None,
+    ) -> dict:
+        centers = as_center_array(centers)
+        radii = as_radius_array(radii, len(centers))
+        if (cone := bounding_cone(centers, radii)) is not None:
+            row_groups = self.row_groups_for_region(*cone)
+        else:
+            row_groups = [g for g, keep in zip(self.__groups, self.__keep) if keep]
+        catalog_columns = (columns or {}).get("catalog")
+        table = self.read(row_groups, catalog_columns)
+
+        ra_column, dec_column = self.__coordinate_columns
+        indices, offsets = cone_members(
+            _to_numpy(table.column(ra_column)),
+            _to_numpy(table.column(dec_column)),
+            centers,
+            radii,
+        )
+        # Gather the rows of every cone into one table. This copies the selected
+        # rows once, the per-sample catalogs are then slices of it.
+        table = table.take(pa.array(indices))
+        if catalog_columns is not None:
+            table = table.select(catalog_columns)
+        catalog = {name: _to_numpy(table.column(name)) for name in table.column_names}
+        return {"catalog": RaggedColumns(catalog, offsets)}
+
+
+def _row_group_statistics(row_group) -> dict:
+    stats = {}
+    for i in range(row_group.num_columns):
+        column = row_group.column(i)
+        s = column.statistics
+        if s is not None and s.has_min_max:
+            stats.update({column.path_in_schema: (s.min, s.max)})
+    return stats
+
+
+def _ra_overlaps(ra_min, ra_max, low, high):
+    """
+    Check which [ra_min, ra_max] intervals overlap [low, high], taking the
+    wrap at 360 degrees into account.
+    """
+    low, high = low % 360.0, high % 360.0
+    if low <= high:
+        return (ra_max >= low) & (ra_min <= high)
+    return (ra_max >= low) | (ra_min <= high)
+
+
+def _to_numpy(column) -> np.ndarray:
+    """
+    Get a NumPy array from an Arrow column. This doesn't copy primitive columns
+    without nulls that are stored in a single chunk.
+    """
+    column = column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+    try:
+        return column.to_numpy(zero_copy_only=True)
+    except pa.ArrowInvalid:
+        return column.to_numpy(zero_copy_only=False)
+
+
+def identify_parquet_files(path: Path):
+    path = Path(path)
+    if path.exists() and path.is_file() and path.suffix == ".parquet":
+        return [path]
+
+    elif path.exists() and path.is_dir():
+        files = sorted(path.rglob("*.parquet"))
+        if files:
+            return files
+
+    raise FileNotFoundError(f"Unable to identify parquet files at path {path}")
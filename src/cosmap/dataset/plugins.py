@@ -1,10 +1,19 @@
+from importlib.metadata import entry_points
 from pathlib import Path
 
+from astropy.coordinates import SkyCoord
 from dask.distributed.diagnostics.plugin import WorkerPlugin
 from heinlein import load_dataset
+from loguru import logger
 from pydantic import BaseModel
 
+from cosmap.dataset.batch import as_center_array
+from cosmap.dataset.cache import DiskTileCache, MemoryTileCache, cache_key
+from cosmap.dataset.capabilities import DatasetCapability, get_capabilities
+from cosmap.dataset.filters import apply_filters
 from cosmap.dataset.opencosmo import opencosmoPlugin
+from cosmap.dataset.parquet import parquetPlugin
+from cosmap.dataset.tiles import TiledDataset, TileScheme
 
 """
 At present, datasets are attached to Dask workers as plugins. Ideally, a dataset
@@ -14,36 +23,173 @@ dataset.
 
 This means we do have spin up one copy of the dataset for each worker. We hope to 
 improve this in the future.
+
+Wrappers other than the built-in ones can be provided by other packages through the
+"cosmap.datasets" entry point group. The entry point name is the value used for
+`dataset_wrapper`, and it should point to a WorkerPlugin class that takes the same
+arguments as the built-in wrappers. Wrappers advertise what they can do through a
+`capabilities` class attribute (see `cosmap.dataset.capabilities`).
 """
 
+ENTRY_POINT_GROUP = "cosmap.datasets"
+
 
 class heinleinPlugin(WorkerPlugin):
-    def __init__(self, dataset_name, *args, **kwargs):
+    capabilities = DatasetCapability.NONE
+
+    def __init__(self, dataset_name, *args, row_filters: dict = {}, **kwargs):
         self.dataset_name = dataset_name
+        self.row_filters = row_filters
 
     def setup(self, worker):
-        self.dataset = load_dataset(self.dataset_name)
+        self.dataset = HeinleinProxy(load_dataset(self.dataset_name), self.row_filters)
         worker.dataset = self.dataset
 
     def teardown(self, worker):
         del worker.dataset
 
 
-known_wrappers = {"heinlein": heinleinPlugin, "opencosmo": opencosmoPlugin}
+class HeinleinProxy:
+    """
+    Cosmap passes sample centers around as plain arrays, but heinlein expects a
+    SkyCoord. We build a single (vector) SkyCoord for the whole chunk here.
+
+    Heinlein also does its own region extraction, so we can't push row filters
+    below it. Instead, we apply them to everything it returns in a single
+    vectorized pass per data type, before the data reaches the pipeline.
+    """
+
+    def __init__(self, dataset, row_filters: dict = {}):
+        self.__dataset = dataset
+        self.__filters = row_filters
+
+    def get_data_from_samples(self, coordinates, *args, **kwargs):
+        if not isinstance(coordinates, SkyCoord):
+            centers = as_center_array(coordinates)
+            coordinates = SkyCoord(centers[:, 0], centers[:, 1], unit="deg")
+        samples = self.__dataset.get_data_from_samples(coordinates, *args, **kwargs)
+        if not self.__filters:
+            yield from samples
+            return
+        for region, sample in samples:
+            yield region, self.__filter(sample)
+
+    def cone_search(self, *args, **kwargs):
+        return self.__filter(self.__dataset.cone_search(*args, **kwargs))
+
+    def __filter(self, sample: dict):
+        return {
+            dtype: apply_filters(data, self.__filters.get(dtype, []))
+            for dtype, data in sample.items()
+        }
+
+    def __getattr__(self, name):
+        return getattr(self.__dataset, name)
+
+
+class cachedDatasetPlugin(WorkerPlugin):
+    """
+    Wraps another dataset plugin, and puts a tiled, cached layer in front of the
+    dataset it attaches to the worker.
+    """
+
+    def __init__(
+        self,
+        wrapper: WorkerPlugin,
+        cache_parameters: dict,
+        key: str,
+        coordinate_columns: tuple = ("ra", "dec"),
+    ):
+        self.wrapper = wrapper
+        self.cache_parameters = cache_parameters
+        self.key = key
+        self.coordinate_columns = coordinate_columns
+        self.capabilities = (
+            get_capabilities(wrapper)
+            | DatasetCapability.BATCH_QUERIES
+            | DatasetCapability.COLUMN_PUSHDOWN
+        )
+
+    def setup(self, worker):
+        self.wrapper.setup(worker)
+        caches = []
+        if (memory_max_bytes := self.cache_parameters["memory_max_bytes"]) > 0:
+            caches.append(MemoryTileCache(memory_max_bytes))
+        if (path := self.cache_parameters.get("path")) is not None:
+            caches.append(
+                DiskTileCache(path, self.key, self.cache_parameters["max_bytes"])
+            )
+        worker.dataset = TiledDataset(
+            worker.dataset,
+            TileScheme(self.cache_parameters["nside"]),
+            caches,
+            tiled_dtypes=self.cache_parameters["dtypes"],
+            coordinate_columns=self.coordinate_columns,
+            native_batch=DatasetCapability.BATCH_QUERIES
+            in get_capabilities(self.wrapper),
+        )
+
+    def teardown(self, worker):
+        self.wrapper.teardown(worker)
+
 
+known_wrappers = {
+    "heinlein": heinleinPlugin,
+    "opencosmo": opencosmoPlugin,
+    "parquet": parquetPlugin,
+}
 
-def get_dataset(dataset_parameters: BaseModel):
-    return _get_dataset(**dataset_parameters.dict())
+
+def get_known_wrappers() -> dict:
+    """
+    Get all available wrappers, including any that have been installed through
+    entry points. Entry points are not loaded until the wrapper is actually used.
+    """
+    wrappers = dict(known_wrappers)
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        if entry_point.name in wrappers:
+            logger.warning(
+                f"Dataset wrapper `{entry_point.name}` is already registered!"
+                " The new wrapper will overwrite the old one!"
+            )
+        wrappers.update({entry_point.name: entry_point})
+    return wrappers
+
+
+def get_dataset(dataset_parameters: BaseModel, row_filters: dict = {}):
+    """
+    Get the worker plugin for the dataset. Row filters should already be built
+    (see `cosmap.dataset.filters.build_filters`).
+    """
+    parameters = dataset_parameters.dict()
+    parameters.pop("filters", None)
+    cache_parameters = parameters.pop("cache", None)
+    wrapper = _get_dataset(**parameters, row_filters=row_filters)
+    if cache_parameters is None:
+        return wrapper
+    key = cache_key(
+        wrapper=parameters["dataset_wrapper"],
+        name=parameters["dataset_name"],
+        path=parameters["dataset_path"],
+        columns=parameters["dataset_columns"],
+        filters=row_filters,
+        nside=cache_parameters["nside"],
+    )
+    return cachedDatasetPlugin(
+        wrapper, cache_parameters, key, parameters["coordinate_columns"]
+    )
 
 
 def _get_dataset(
     dataset_wrapper: str, dataset_name: str, dataset_path: Path, *args, **kwargs
 ):
     """
-    Get a dataset from a given wrapper. In the future, we will
-    support custom wrappers.
+    Get a dataset from a given wrapper.
     """
-    if dataset_wrapper not in known_wrappers:
+    wrappers = get_known_wrappers()
+    if dataset_wrapper not in wrappers:
         raise ValueError(f"Unknown wrapper {dataset_wrapper}")
-    wrapper = known_wrappers[dataset_wrapper]
+    wrapper = wrappers[dataset_wrapper]
+    if not isinstance(wrapper, type):
+        wrapper = wrapper.load()
     return wrapper(dataset_name, dataset_path, **kwargs)
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import Callable
+
+from loguru import logger
+
+"""
+Ensembles of independent realizations of the same simulation. Each realization is
+its own file, and is treated as a separate dataset. Every sample is run in every
+realization, and the outputs are tagged with the name of the realization they came
+from.
+
+Work is sharded by realization, so a worker only ever opens the realizations its
+chunks actually need. Each is opened the first time a chunk asks for it. Only the
+most recently used few are kept open, so workers that see many realizations don't
+pile up open files.
+"""
+
+
+class RealizationDataset:
+    """
+    The realizations available to a worker, keyed by name. Indexing opens the
+    realization if it is not already open. Once more than max_open realizations
+    are open, the least recently used one is closed.
+    """
+
+    def __init__(self, paths: dict, open_realization: Callable, max_open: int = 4):
+        self.paths = paths
+        self.max_open = max_open
+        self.__open_realization = open_realization
+        self.__datasets = OrderedDict()
+        self.__lock = Lock()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, name: str):
+        with self.__lock:
+            if (dataset := self.__datasets.get(name)) is not None:
+                self.__datasets.move_to_end(name)
+                return dataset
+            if name not in self.paths:
+                raise KeyError(f"Unknown realization {name}")
+            logger.info(f"Opening realization {name}")
+            dataset = self.__open_realization(self.paths[name])
+            self.__datasets.update({name: dataset})
+            while len(self.__datasets) > self.max_open:
+                # Chunks are grouped by realization, so the least recently used
+                # one is no longer needed by this worker
+                closed_name, closed = self.__datasets.popitem(last=False)
+                logger.info(f"Closing realization {closed_name}")
+                close_dataset(closed)
+            return dataset
+
+    @property
+    def opened(self) -> list:
+        return list(self.__datasets)
+
+    def close(self):
+        with self.__lock:
+            while self.__datasets:
+                close_dataset(self.__datasets.popitem()[1])
+
+
+def name_realizations(files: list[Path]) -> dict:
+    """
+    Name each realization after its file.
+    """
+    paths = {}
+    for path in sorted(files):
+        if path.stem in paths:
+            raise ValueError(f"Found more than one realization named {path.stem}")
+        paths.update({path.stem: path})
+    return paths
+
+
+def get_realizations(wrapper):
+    """
+    Get the names of the realizations a wrapper plugin provides, or None if it
+    only provides a single dataset.
+    """
+    return getattr(wrapper, "realizations", None)
+
+
+def close_dataset(dataset):
+    """
+    Close a dataset, if it holds anything that needs closing.
+    """
+    if (close := getattr(dataset, "close", None)) is not None:
+        close()
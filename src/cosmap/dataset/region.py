@@ -0,0 +1,97 @@
+import astropy.units as u
+import numpy as np
+from astropy.coordinates import SkyCoord
+
+
+class SampleRegion:
+    """
+    The region covered by a single sample, as handed to the transformations. The
+    center and radius are stored as plain floats (in degrees), and astropy objects
+    are only built if a transformation actually asks for them.
+
+    For convenience, any attribute that isn't defined here is looked up on the
+    center coordinate, so the region can be used like a SkyCoord.
+    """
+
+    __slots__ = ("ra_deg", "dec_deg", "radius_deg", "_coordinate")
+
+    def __init__(self, ra: float, dec: float, radius: float):
+        self.ra_deg = float(ra)
+        self.dec_deg = float(dec)
+        self.radius_deg = float(radius)
+        self._coordinate = None
+
+    @property
+    def coordinate(self) -> SkyCoord:
+        if self._coordinate is None:
+            self._coordinate = SkyCoord(self.ra_deg, self.dec_deg, unit="deg")
+        return self._coordinate
+
+    @property
+    def radius(self) -> u.Quantity:
+        return self.radius_deg * u.deg
+
+    def separation(self, other):
+        return self.coordinate.separation(other)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.coordinate, name)
+
+    def __repr__(self):
+        return (
+            f"SampleRegion(ra={self.ra_deg:.6f}, dec={self.dec_deg:.6f},"
+            f" radius={self.radius_deg:.6f} deg)"
+        )
+
+
+class BoxRegion:
+    """
+    The region covered by a single sample in a periodic simulation box. Positions
+    are comoving Cartesian coordinates, in the same units as the dataset. The shape
+    is either "sphere" (size is the radius) or "cube" (size is the side length).
+    """
+
+    __slots__ = ("center", "shape", "size", "box_size")
+
+    def __init__(self, center, shape: str, size: float, box_size: float):
+        self.center = np.asarray(center, dtype=np.float64)
+        self.shape = shape
+        self.size = float(size)
+        self.box_size = float(box_size)
+
+    @property
+    def x(self) -> float:
+        return self.center[0]
+
+    @property
+    def y(self) -> float:
+        return self.center[1]
+
+    @property
+    def z(self) -> float:
+        return self.center[2]
+
+    def offsets(self, positions) -> np.ndarray:
+        """
+        Get the offsets of an (n, 3) array of positions from the center, taking the
+        periodic boundaries into account.
+        """
+        return periodic_offsets(positions, self.center, self.box_size)
+
+    def __repr__(self):
+        x, y, z = self.center
+        return (
+            f"BoxRegion(center=({x:.4f}, {y:.4f}, {z:.4f}), shape={self.shape},"
+            f" size={self.size:.4f})"
+        )
+
+
+def periodic_offsets(positions, center, box_size: float) -> np.ndarray:
+    """
+    Offsets from a center (or one center per position), wrapped so each component
+    is in [-box_size / 2, box_size / 2).
+    """
+    offsets = np.asarray(positions, dtype=np.float64) - center
+    return (offsets + box_size / 2) % box_size - box_size / 2
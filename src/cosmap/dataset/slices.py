@@ -0,0 +1,96 @@
+import numpy as np
+
+from cosmap.dataset.batch import RaggedColumns, slice_rows, take_rows
+from cosmap.dataset.filters import RowFilter
+
+"""
+Redshift slicing for lightcone data. Each sample is a cone split into shells by a
+set of redshift bin edges. The objects in every sample are sorted by redshift, so
+each shell is a contiguous range of rows and can be handed out as a view.
+
+Alongside each sliced data type, "<dtype>_slices" holds a list with one view per
+shell, where shell j contains the objects with bins[j] <= z < bins[j + 1]. The
+data type itself still holds the whole cone, sorted by redshift.
+"""
+
+
+class RaggedSlices:
+    """
+    The shells for every sample in a chunk. The shell boundaries for sample i are
+    bounds[i], as row offsets within the sample.
+    """
+
+    def __init__(self, ragged: RaggedColumns, bounds: np.ndarray):
+        self.ragged = ragged
+        self.bounds = bounds
+
+    def __len__(self):
+        return len(self.ragged)
+
+    def __getitem__(self, i: int):
+        return get_slices(self.ragged[i], self.bounds[i])
+
+
+def get_slices(data, bounds: np.ndarray) -> list:
+    return [slice_rows(data, low, high) for low, high in zip(bounds[:-1], bounds[1:])]
+
+
+def redshift_filters(bins, redshift_column: str) -> list:
+    """
+    Objects outside of the bins are never used, so they can be cut by the dataset
+    wrapper before they are read.
+    """
+    return [
+        RowFilter(redshift_column, ">=", float(bins[0])),
+        RowFilter(redshift_column, "<", float(bins[-1])),
+    ]
+
+
+def sort_chunk_by_redshift(
+    results: dict, bins: np.ndarray, dtypes: list, redshift_column: str
+) -> dict:
+    """
+    Sort the objects in every sample of a chunk by redshift, in a single pass over
+    the whole chunk.
+    """
+    results = dict(results)
+    for dtype in dtypes:
+        if (ragged := results.get(dtype)) is None:
+            continue
+        samples = np.repeat(np.arange(len(ragged)), ragged.counts)
+        redshift = np.asarray(ragged.columns[redshift_column], dtype=np.float64)
+        order = np.lexsort((redshift, samples))
+        # Objects below each edge, per sample
+        bounds = np.stack(
+            [
+                np.bincount(samples[redshift < edge], minlength=len(ragged))
+                for edge in bins
+            ],
+            axis=-1,
+        )
+        sorted_ragged = RaggedColumns(take_rows(ragged.columns, order), ragged.offsets)
+        results.update(
+            {
+                dtype: sorted_ragged,
+                f"{dtype}_slices": RaggedSlices(sorted_ragged, bounds),
+            }
+        )
+    return results
+
+
+def sort_sample_by_redshift(
+    sample: dict, bins: np.ndarray, dtypes: list, redshift_column: str
+) -> dict:
+    """
+    Sort the objects in a single sample by redshift.
+    """
+    sample = dict(sample)
+    for dtype in dtypes:
+        if (data := sample.get(dtype)) is None:
+            continue
+        redshift = np.asarray(data[redshift_column], dtype=np.float64)
+        order = np.argsort(redshift, kind="stable")
+        bounds = np.searchsorted(redshift[order], bins, side="left")
+        data = take_rows(data, order)
+        sample.update({dtype: data, f"{dtype}_slices": get_slices(data, bounds)})
+    return sample
@@ -0,0 +1,219 @@
+import hashlib
+from typing import Optional
+
+import astropy.units as u
+import numpy as np
+from astropy_healpix import HEALPix
+from loguru import logger
+
+from cosmap.dataset.batch import (
+    BatchQueryAdapter,
+    RaggedColumns,
+    as_center_array,
+    as_radius_array,
+    concatenate,
+    select_columns,
+    take_rows,
+)
+from cosmap.dataset.cache import MemoryTileCache
+from cosmap.dataset.geometry import cone_members, to_degrees, unit_vectors
+
+"""
+Tiling splits the sky into HEALPix pixels (nested ordering), and fetches data one
+tile at a time. Tiles are the unit of caching: a chunk of samples is answered by
+finding the tiles that cover it, taking those from the caches where possible, and
+only going to the underlying dataset for the tiles that are missing.
+"""
+
+
+class TileScheme:
+    def __init__(self, nside: int):
+        self.nside = nside
+        self.healpix = HEALPix(nside=nside, order="nested")
+        # Generous upper bound on the distance from a tile center to its edge
+        self.max_radius = 2 * self.healpix.pixel_resolution.to_value(u.deg)
+
+    def tile_of(self, ra, dec) -> np.ndarray:
+        """
+        Get the tile each position (RA/Dec in degrees) falls in.
+        """
+        return np.asarray(self.healpix.lonlat_to_healpix(ra * u.deg, dec * u.deg))
+
+    def tiles_for_cones(self, centers: np.ndarray, radii: np.ndarray) -> np.ndarray:
+        """
+        Get all tiles that overlap any of a set of cones.
+        """
+        tiles = [
+            self.healpix.cone_search_lonlat(
+                ra * u.deg, dec * u.deg, (radius + self.max_radius) * u.deg
+            )
+            for (ra, dec), radius in zip(centers, radii)
+        ]
+        return np.unique(np.concatenate(tiles))
+
+    def tile_cones(self, tiles: np.ndarray):
+        """
+        Get a cone that encloses each tile. Returns an (n, 2) array of centers and
+        the radii, both in degrees.
+        """
+        tiles = np.asarray(tiles)
+        lon, lat = self.healpix.healpix_to_lonlat(tiles)
+        centers = np.column_stack([lon.to_value(u.deg), lat.to_value(u.deg)])
+        b_lon, b_lat = self.healpix.boundaries_lonlat(tiles, step=4)
+        boundary = unit_vectors(b_lon.to_value(u.deg), b_lat.to_value(u.deg))
+        center_vectors = unit_vectors(centers[:, 0], centers[:, 1])
+        cos_sep = np.einsum("ijk,ik->ij", boundary, center_vectors)
+        radii = np.degrees(np.arccos(np.clip(cos_sep.min(axis=1), -1.0, 1.0)))
+        return centers, radii * 1.01
+
+
+class TiledDataset:
+    """
+    Sits in front of a dataset and answers batch queries tile by tile, consulting
+    a list of caches (fastest first) before going to the dataset itself. Data types
+    that are not tiled are passed straight through to the dataset.
+    """
+
+    def __init__(
+        self,
+        dataset,
+        scheme: TileScheme,
+        caches: list,
+        tiled_dtypes: list = ["catalog"],
+        coordinate_columns: tuple = ("ra", "dec"),
+        native_batch: bool = False,
+    ):
+        self.dataset = BatchQueryAdapter(dataset, native_batch=native_batch)
+        self.scheme = scheme
+        self.caches = caches
+        self.tiled_dtypes = set(tiled_dtypes)
+        self.coordinate_columns = coordinate_columns
+
+    def query_many(
+        self,
+        centers,
+        radii,
+        dtypes: list,
+        columns: Optional[dict] = None,
+    ) -> dict:
+        centers = as_center_array(centers)
+        radii = as_radius_array(radii, len(centers))
+        tiled = [d for d in dtypes if d in self.tiled_dtypes]
+        others = [d for d in dtypes if d not in self.tiled_dtypes]
+        results = {}
+        if others:
+            results.update(self.dataset.query_many(centers, radii, others, columns))
+        if not tiled:
+            return results
+
+        # We always need the coordinates to assign objects to tiles and samples
+        columns = columns or {}
+        fetch_columns = {
+            dtype: sorted(set(names) | set(self.coordinate_columns))
+            for dtype, names in columns.items()
+            if names is not None
+        }
+        tiles = self.scheme.tiles_for_cones(centers, radii)
+        tile_data = self.get_tiles(tiles, tiled, fetch_columns)
+        ra_column, dec_column = self.coordinate_columns
+        for dtype in tiled:
+            data = concatenate(tile_data[dtype])
+            indices, offsets = cone_members(
+                to_degrees(data[ra_column]),
+                to_degrees(data[dec_column]),
+                centers,
+                radii,
+            )
+            data = take_rows(data, indices)
+            if (names := columns.get(dtype)) is not None:
+                data = select_columns(data, names)
+            results.update({dtype: RaggedColumns(data, offsets)})
+        return results
+
+    def get_tiles(self, tiles: np.ndarray, dtypes: list, columns: Optional[dict]):
+        """
+        Get the data for each tile, from the caches if possible. Any tiles that are
+        missing are fetched from the dataset in a single batch query, and then
+        stored in every cache.
+        """
+        columns = columns or {}
+        found = {dtype: {} for dtype in dtypes}
+        missing = set()
+        for tile in tiles:
+            for dtype in dtypes:
+                key = tile_key(dtype, tile, columns.get(dtype))
+                data = self.__from_caches(key)
+                if data is None:
+                    missing.add(tile)
+                else:
+                    found[dtype][tile] = data
+
+        if missing:
+            missing = np.array(sorted(missing))
+            fetched = self.fetch_tiles(missing, dtypes, columns)
+            for dtype, parts in fetched.items():
+                for tile, data in zip(missing, parts):
+                    found[dtype][tile] = data
+                    key = tile_key(dtype, tile, columns.get(dtype))
+                    for cache in self.caches:
+                        cache.put(key, data)
+        return {dtype: [found[dtype][tile] for tile in tiles] for dtype in dtypes}
+
+    def fetch_tiles(self, tiles: np.ndarray, dtypes: list, columns: Optional[dict]):
+        """
+        Fetch tiles from the underlying dataset. We query a cone around each tile,
+        then keep only the objects that actually fall in it so that tiles never
+        share objects.
+        """
+        logger.debug(f"Fetching {len(tiles)} tiles from the dataset")
+        centers, radii = self.scheme.tile_cones(tiles)
+        results = self.dataset.query_many(centers, radii, dtypes, columns)
+        ra_column, dec_column = self.coordinate_columns
+        output = {}
+        for dtype, result in results.items():
+            parts = []
+            for tile, data in zip(tiles, result):
+                in_tile = self.scheme.tile_of(
+                    to_degrees(data[ra_column]), to_degrees(data[dec_column])
+                )
+                parts.append(take_rows(data, np.flatnonzero(in_tile == tile)))
+            output.update({dtype: parts})
+        return output
+
+    def __from_caches(self, key: str):
+        for i, cache in enumerate(self.caches):
+            if (data := cache.get(key)) is not None:
+                # Promote to the faster caches
+                for faster in self.caches[:i]:
+                    faster.put(key, data)
+                return data
+        return None
+
+    def cache_statistics(self) -> dict:
+        return {cache.name: cache.statistics() for cache in self.caches}
+
+    def cached_tiles(self) -> set:
+        """
+        The tiles held in memory by this worker. The disk cache is left out, since
+        it is shared with the other workers on the node.
+        """
+        return {
+            tile_of_key(key)
+            for cache in self.caches
+            if isinstance(cache, MemoryTileCache)
+            for key in cache.keys()
+        }
+
+
+def tile_key(dtype: str, tile: int, columns: Optional[list] = None) -> str:
+    """
+    Tiles fetched with only a subset of the columns are stored separately.
+    """
+    if columns is None:
+        return f"{dtype}-{int(tile)}"
+    column_hash = hashlib.sha1(",".join(sorted(columns)).encode()).hexdigest()[:8]
+    return f"{dtype}-{column_hash}-{int(tile)}"
+
+
+def tile_of_key(key: str) -> int:
+    return int(key.rsplit("-", 1)[1])
@@ -1,3 +1,3 @@
-from .output import get_output_handler
+from .output import fusedOutputHandler, get_output_handler, in_background
 
-__all__ = ["get_output_handler"]
+__all__ = ["fusedOutputHandler", "get_output_handler", "in_background"]
@@ -1,3 +1,6 @@
+import queue
+import threading
+import time
 from abc import ABC, abstractmethod
 from pathlib import Path
 from typing import List
@@ -8,13 +11,24 @@ from pydantic import BaseModel
 from . import parser, writer
 
 
-def get_output_handler(output_paramters: BaseModel):
+def get_output_handler(output_paramters: BaseModel, run_info: dict = {}):
+    """
+    Get the handler for an analysis' output. The run info (the expected number of
+    rows, the run metadata and the declared output schema, if there is one) is
+    passed on to the writer, along with the writer config. Writers that don't need
+    it can ignore it.
+    """
     writer_ = writer.get_writer(output_paramters.write_format)
+    writer_config = run_info | output_paramters.writer_config
     if output_paramters.output_formats == "dataframe":
         if output_paramters.output_paths is None:
-            return dataframeOutputHandler(output_paramters.base_output_path, writer_)
+            return dataframeOutputHandler(
+                output_paramters.base_output_path, writer_, writer_config
+            )
         else:
-            return multiDataframeOutputHandler(output_paramters.output_paths, writer_)
+            return multiDataframeOutputHandler(
+                output_paramters.output_paths, writer_, writer_config
+            )
 
 
 class outputHandler(ABC):
@@ -23,6 +37,19 @@ class outputHandler(ABC):
         if output is not None:
             self._writer.write_output(output, *args, **kwargs)
 
+    def add_metadata(self, metadata: dict):
+        """
+        Add to the run metadata, for example once the run has stopped. Writers that
+        can't store metadata ignore it.
+        """
+        self._writer.add_metadata(metadata)
+
+    def close(self):
+        """
+        Called once all output has been written.
+        """
+        self._writer.close()
+
     @abstractmethod
     def take_output(self, output, *args, **kwargs):
         pass
@@ -40,21 +67,31 @@ class dataframeOutputHandler(outputHandler):
         elif not path.parent.exists():
             path.parent.mkdir(parents=True, exist_ok=True)
         self._writer = writer(path=path, **writer_config)
-        self._parser = parser.dataFrameOutputParser()
+        self._parser = parser.dataFrameOutputParser(schema=writer_config.get("schema"))
 
     def take_output(self, output: dict, *args, **kwargs):
         self._parser.append(output)
 
     def take_outputs(self, outputs: List[dict], *args, **kwargs):
-        for output in outputs:
-            self.take_output(output, *args, **kwargs)
+        if outputs:
+            self._parser.append_batch(parser.rows_to_columns(outputs))
+
+    def take_columns(self, columns: dict, *args, **kwargs):
+        """
+        Take a batch of outputs that is already in columns (name -> array).
+        """
+        self._parser.append_batch(columns)
 
 
 class multiDataframeOutputHandler(outputHandler):
     def __init__(self, paths: dict, writer: type, writer_config: dict = {}):
+        # Declared schemas are given per output
+        schemas = writer_config.get("schema") or {}
         self._handlers = {
             k: dataframeOutputHandler(
-                path=v, writer=writer, writer_config=writer_config
+                path=v,
+                writer=writer,
+                writer_config=writer_config | {"schema": schemas.get(k)},
             )
             for k, v in paths.items()
         }
@@ -67,9 +104,172 @@ class multiDataframeOutputHandler(outputHandler):
             self._handlers[k].take_output(row)
 
     def take_outputs(self, outputs: List[dict], *args, **kwargs):
+        # Outputs may not have a row for every handler
+        for k, handler in self._handlers.items():
+            handler.take_outputs([output[k] for output in outputs if k in output])
+
+    def write_output(self, *args, **kwargs):
+        for handler in self._handlers.values():
+            handler.write_output(*args, **kwargs)
+
+    def add_metadata(self, metadata: dict):
+        for handler in self._handlers.values():
+            handler.add_metadata(metadata)
+
+    def close(self):
+        for handler in self._handlers.values():
+            handler.close()
+
+
+class fusedOutputHandler(outputHandler):
+    """
+    Routes the outputs of several analyses that were run together to each analysis'
+    own handler. Each output is expected to be a dictionary keyed by analysis name.
+    """
+
+    def __init__(self, handlers: dict):
+        self._handlers = handlers
+
+    def take_output(self, output: dict, *args, **kwargs):
+        for name, handler_output in output.items():
+            # Parameter sweeps produce several outputs per sample
+            if isinstance(handler_output, list):
+                self._handlers[name].take_outputs(handler_output)
+            else:
+                self._handlers[name].take_output(handler_output)
+
+    def take_outputs(self, outputs: List[dict], *args, **kwargs):
+        # Gather each analysis' outputs, so they are handed over as one batch
+        batches = {name: [] for name in self._handlers}
         for output in outputs:
-            self.take_output(output, *args, **kwargs)
+            for name, handler_output in output.items():
+                if isinstance(handler_output, list):
+                    batches[name].extend(handler_output)
+                else:
+                    batches[name].append(handler_output)
+        for name, batch in batches.items():
+            self._handlers[name].take_outputs(batch)
 
     def write_output(self, *args, **kwargs):
         for handler in self._handlers.values():
             handler.write_output(*args, **kwargs)
+
+    def add_metadata(self, metadata: dict):
+        for handler in self._handlers.values():
+            handler.add_metadata(metadata)
+
+    def close(self):
+        for handler in self._handlers.values():
+            handler.close()
+
+
+class backgroundOutputHandler(outputHandler):
+    """
+    Moves parsing and writing off the driver onto a background thread. Outputs are
+    handed over through a bounded queue, so the driver only blocks if the writer
+    falls far behind. The thread writes once enough rows have built up, or enough
+    time has passed since the last write, whichever comes first.
+
+    Closing the handler (which the analysis always does, including on errors and
+    Ctrl-C) waits for everything in the queue to be written. Metadata is handed to
+    the writers just before they are closed. If the thread fails, the error is
+    raised in the driver the next time it hands over outputs.
+    """
+
+    _stop = object()
+
+    def __init__(
+        self,
+        handler: outputHandler,
+        max_queue: int = 64,
+        batch_rows: int = 50000,
+        interval: float = 30.0,
+    ):
+        self._handler = handler
+        self._batch_rows = batch_rows
+        self._interval = interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._error = None
+        self._metadata = {}
+        self._thread = threading.Thread(
+            target=self.__run, name="cosmap-output-writer", daemon=True
+        )
+        self._thread.start()
+
+    def take_output(self, output, *args, **kwargs):
+        self.take_outputs([output])
+
+    def take_outputs(self, outputs: List[dict], *args, **kwargs):
+        self.__raise_error()
+        self._queue.put(outputs)
+
+    def write_output(self, *args, **kwargs):
+        # The writer thread decides when to write
+        self.__raise_error()
+
+    def add_metadata(self, metadata: dict):
+        # Read by the writer thread once it has been told to stop
+        self._metadata.update(metadata)
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(self._stop)
+            self._thread.join()
+        self.__raise_error()
+
+    def __raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def __run(self):
+        pending = 0
+        last_write = time.monotonic()
+        stopped = False
+        try:
+            while True:
+                timeout = max(0.0, last_write + self._interval - time.monotonic())
+                try:
+                    outputs = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    outputs = None
+                if outputs is self._stop:
+                    stopped = True
+                    break
+                if outputs is not None:
+                    self._handler.take_outputs(outputs)
+                    pending += len(outputs)
+                due = time.monotonic() - last_write >= self._interval
+                if pending and (pending >= self._batch_rows or due):
+                    self._handler.write_output()
+                    pending = 0
+                if not pending:
+                    last_write = time.monotonic()
+            self._handler.write_output()
+        except BaseException as e:
+            self._error = e
+            # Keep draining the queue so the driver never blocks on a dead writer
+            while not stopped:
+                stopped = self._queue.get() is self._stop
+        finally:
+            try:
+                if self._metadata:
+                    self._handler.add_metadata(self._metadata)
+                self._handler.close()
+            except BaseException as e:
+                self._error = self._error or e
+
+
+def in_background(handler: outputHandler, output_paramters: BaseModel):
+    """
+    Wrap an output handler so it writes on a background thread, if the output
+    parameters ask for it.
+    """
+    if not output_paramters.background_writes:
+        return handler
+    return backgroundOutputHandler(
+        handler,
+        max_queue=output_paramters.write_queue_size,
+        batch_rows=output_paramters.write_batch_rows,
+        interval=output_paramters.write_interval,
+    )
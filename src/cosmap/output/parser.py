@@ -3,6 +3,8 @@ from abc import ABC, abstractmethod
 import numpy as np
 import pandas as pd
 
+from .schema import outputSchema
+
 
 class cosmapParserException(Exception):
     pass
@@ -45,75 +47,152 @@ class cosmapOutputParser(ABC):
 
 class dataFrameOutputParser(cosmapOutputParser):
     """
-    This parser takes a dictionary of key-value pairs that correspond to a single row in
-    a DataFrame, and appends it to a DataFrame. In general, appending is a very
-    expensive operation, so this parser allocates memory in chunks, and only increases
-    the amount of memory when the chunk fills.
-
-    For large jobs with a large number of outputs, this parser can use a lot of memory.
-    To avoid this, this particular parser only stores the current chunk, and appends it
-    to the file when it writes. It does check to ensure columns are consistent between
-    chunks.
+    This parser collects outputs into columns, and turns them into a DataFrame when
+    it is asked for its output. Outputs can be given either as single rows (a
+    dictionary of column name to value) or as whole batches of columns with
+    `append_batch`, which is much cheaper for large numbers of outputs.
+
+    Data is kept as a list of chunks, one per batch, so appending never copies the
+    data that is already there. The chunks are only combined when the output is
+    written. Rows given one at a time are staged, and converted to a chunk
+    chunksize rows at a time.
+
+    Column dtypes are inferred from the data (so numpy scalars keep their type), and
+    are promoted if a later batch needs a wider type. Strings are stored as Python
+    objects, so they are never truncated. The columns and their dtypes are kept
+    when the parser is cleared, and every batch must have the same columns.
+
+    If the output has a declared schema, the columns are known up front, and
+    every batch is cast to the declared types instead (see output.schema). Values
+    of fixed-size array columns are kept together in one (n, *shape) array per
+    batch, and are only split into rows when the DataFrame is built.
     """
 
     output_format = pd.DataFrame
 
-    def __init__(self, chunksize=5000, *args, **kwargs):
-        self.tally = 0
-        self.size = 0
+    def __init__(self, chunksize=5000, schema: outputSchema = None, *args, **kwargs):
         self.chunksize = chunksize
-        self.initialized = False
-        self.series = {}
-
-    def initialize(self, columns: list, dtypes: list):
-        if dtypes is not None:
-            self.dtypes = {c: dtypes[i] for i, c in enumerate(columns)}
-            self.columns = set(columns)
-            self.series = {
-                c: np.empty(self.chunksize, dtype=self.dtypes[c]) for c in columns
-            }
-            self.initialized = True
-            self.size += self.chunksize
+        self.schema = schema
+        self.columns = None if schema is None else schema.names
+        self.dtypes = {} if schema is None else {c.name: c.dtype for c in schema}
+        self.tally = 0
+        self._chunks = []
+        self._rows = []
 
     def append(self, data: dict):
-        if not self.initialized:
-            columns = list(data.keys())
-            dtypes = [type(v) for v in data.values()]
-            self.initialize(columns, dtypes)
-        elif self.tally == self.size:
-            self.extend()
-        for column, value in data.items():
-            if column not in self.columns:
-                raise cosmapParserException(
-                    f"Parsed data contains column {column}, which is not in the list"
-                    "of columns!"
-                )
-            self.series[column][self.tally] = value
-        self.tally += 1
-
-    def extend(self):
-        self.size += self.chunksize
-        for c in self.series:
-            self.series[c] = np.append(
-                self.series[c], np.empty(self.chunksize, dtype=self.dtypes[c])
-            )
+        self._rows.append(data)
+        if len(self._rows) >= self.chunksize:
+            self.__flush_rows()
+
+    def append_batch(self, columns: dict):
+        """
+        Append a batch of outputs, given as a dictionary of column name to an array
+        (or list) of values. Arrays are kept as they are, without copying.
+        """
+        self.__flush_rows()
+        self.__add_chunk(columns)
 
     def get(self, *args, **kwargs):
-        if self.tally:
-            input_series = {c: self.series[c][: self.tally] for c in self.series}
-            result = pd.DataFrame.from_dict(input_series, orient="columns")
-            self.clear()
-            return result
-        # Now, we reset the parser but keep the orig
-        return None
+        self.__flush_rows()
+        if not self.tally:
+            return None
+        series = {}
+        for column in self.columns:
+            parts = [chunk[column] for chunk in self._chunks]
+            dtype = self.dtypes[column]
+            if len(parts) == 1 and parts[0].dtype == dtype:
+                values = parts[0]
+            else:
+                values = np.concatenate(parts).astype(dtype, copy=False)
+            if values.ndim > 1:
+                rows = np.empty(len(values), dtype=object)
+                rows[:] = list(values)
+                values = rows
+            series.update({column: values})
+        result = pd.DataFrame(series, copy=False)
+        self.clear()
+        return result
 
     def clear(self, *args, **kwargs):
         """
         Clears any output that has been parsed, but keeps the original configuration.
         """
         self.tally = 0
-        self.series = {
-            c: np.empty(self.chunksize, dtype=self.dtypes[c])
-            for c in self.series.keys()
-        }
-        self.size = self.chunksize
+        self._chunks = []
+        self._rows = []
+
+    def __flush_rows(self):
+        if self._rows:
+            rows, self._rows = self._rows, []
+            self.__add_chunk(rows_to_columns(rows, self.columns))
+
+    def __add_chunk(self, columns: dict):
+        if self.columns is None:
+            self.columns = list(columns)
+        elif set(columns) != set(self.columns):
+            raise cosmapParserException(
+                f"Parsed data has columns {sorted(columns)}, but expected"
+                f" {sorted(self.columns)}!"
+            )
+        if self.schema is None:
+            chunk = {name: as_column(columns[name]) for name in self.columns}
+        else:
+            chunk = {
+                name: self.schema[name].cast(columns[name]) for name in self.columns
+            }
+        lengths = {len(values) for values in chunk.values()}
+        if len(lengths) > 1:
+            raise cosmapParserException(
+                "Columns in a batch must all be the same length!"
+            )
+        if self.schema is None:
+            self.__update_dtypes(chunk)
+        self._chunks.append(chunk)
+        self.tally += lengths.pop()
+
+    def __update_dtypes(self, chunk: dict):
+        # Declared dtypes are fixed, but inferred ones may need to be widened
+        for name, values in chunk.items():
+            if (dtype := self.dtypes.get(name)) is None:
+                self.dtypes.update({name: values.dtype})
+            elif values.dtype != dtype:
+                self.dtypes.update({name: promote_types(dtype, values.dtype)})
+
+
+def rows_to_columns(rows: list, columns: list = None) -> dict:
+    """
+    Turn a list of rows (dictionaries of column name to value) into a dictionary of
+    columns.
+    """
+    columns = list(rows[0]) if columns is None else columns
+    for row in rows:
+        if row.keys() != set(columns):
+            raise cosmapParserException(
+                f"Parsed data has columns {sorted(row)}, but expected"
+                f" {sorted(columns)}!"
+            )
+    return {c: [row[c] for row in rows] for c in columns}
+
+
+def as_column(values) -> np.ndarray:
+    """
+    Get a 1D array for a column. Strings and anything that isn't a scalar (like
+    arrays) are stored as Python objects.
+    """
+    if isinstance(values, pd.Series):
+        values = values.to_numpy()
+    array = np.asarray(values)
+    if array.dtype.kind in "US":
+        return array.astype(object)
+    if array.ndim != 1:
+        column = np.empty(len(values), dtype=object)
+        column[:] = list(values)
+        return column
+    return array
+
+
+def promote_types(a: np.dtype, b: np.dtype) -> np.dtype:
+    try:
+        return np.promote_types(a, b)
+    except TypeError:
+        return np.dtype(object)
@@ -0,0 +1,180 @@
+import numpy as np
+
+"""
+Declared output schemas. By default the output columns and their types are found
+from the outputs themselves, which means strings and arrays end up as Python
+objects and nothing is known about the output until the first results come in.
+
+The output transformation can instead declare its columns in transformations.json
+with the "output-schema" key. Each column is given either as a dtype, or as a
+dictionary with the "dtype" and, optionally, the "shape" of each value (for
+fixed-size array columns) and its "unit". For example:
+
+    "output-schema": {
+        "n_galaxies": "int64",
+        "kappa": {"dtype": "float32", "unit": "deg"},
+        "profile": {"dtype": "float32", "shape": [20], "unit": "Msun / kpc2"}
+    }
+
+Dtypes are numpy dtypes, or "str" for strings. Analyses with several output files
+give one schema per output, keyed by the output name. Multi-aperture analyses
+declare the columns for a single aperture, and they are repeated for each
+aperture with the aperture label added to their names.
+
+The parser then casts every batch to the declared types, and rejects batches that
+don't fit them. Writers know the full layout of the output before anything is
+written.
+"""
+
+
+class cosmapSchemaException(Exception):
+    pass
+
+
+class outputColumn:
+    def __init__(self, name: str, dtype: str, shape: tuple = (), unit: str = None):
+        self.name = name
+        self.is_string = dtype in ("str", "string")
+        try:
+            self.dtype = np.dtype(object if self.is_string else dtype)
+        except TypeError:
+            raise cosmapSchemaException(f"Unknown dtype '{dtype}' for column {name}")
+        if not self.is_string and self.dtype.kind not in "biuf":
+            raise cosmapSchemaException(
+                f"Column {name} has dtype {dtype}, but output columns must be"
+                " numbers, booleans or strings"
+            )
+        self.shape = tuple(int(s) for s in shape)
+        if any(s < 1 for s in self.shape) or (self.shape and self.is_string):
+            raise cosmapSchemaException(f"Invalid shape {shape} for column {name}")
+        self.unit = unit
+
+    def cast(self, values) -> np.ndarray:
+        """
+        Cast a batch of values for this column to its declared type. The result
+        has shape (n, *shape). Values that can't be converted without losing their
+        kind (e.g. floats into an integer column) are rejected.
+        """
+        try:
+            array = np.asarray(values)
+        except ValueError:
+            raise cosmapSchemaException(
+                f"Values for column {self.name} have inconsistent shapes"
+            )
+        if self.is_string:
+            if array.dtype.kind not in "OUS" or array.ndim != 1:
+                raise cosmapSchemaException(f"Column {self.name} expects strings")
+            return array.astype(object, copy=False)
+        if array.ndim < 1 or array.shape[1:] != self.shape:
+            raise cosmapSchemaException(
+                f"Column {self.name} expects values with shape {self.shape}, got"
+                f" {array.shape[1:]}"
+            )
+        if not np.can_cast(array.dtype, self.dtype, casting="same_kind"):
+            raise cosmapSchemaException(
+                f"Column {self.name} expects {self.dtype}, got {array.dtype}"
+            )
+        return array.astype(self.dtype, copy=False)
+
+    def to_dict(self) -> dict:
+        output = {"dtype": "str" if self.is_string else self.dtype.name}
+        if self.shape:
+            output.update({"shape": list(self.shape)})
+        if self.unit is not None:
+            output.update({"unit": self.unit})
+        return output
+
+
+class outputSchema:
+    """
+    The declared columns of an output, in order.
+    """
+
+    def __init__(self, columns: list):
+        self.columns = {column.name: column for column in columns}
+
+    def __iter__(self):
+        return iter(self.columns.values())
+
+    def __contains__(self, name: str):
+        return name in self.columns
+
+    def __getitem__(self, name: str):
+        return self.columns[name]
+
+    @property
+    def names(self) -> list:
+        return list(self.columns)
+
+    @property
+    def has_arrays(self) -> bool:
+        return any(column.shape for column in self)
+
+    def with_columns(self, columns: dict):
+        """
+        Get a copy of the schema with extra columns (name -> dtype) added, unless
+        they are already declared. This is used for the columns cosmap adds itself,
+        like the realization name and the values of a parameter sweep.
+        """
+        extra = [
+            outputColumn(name, dtype)
+            for name, dtype in columns.items()
+            if name not in self.columns
+        ]
+        return outputSchema(list(self) + extra)
+
+    def for_apertures(self, labels: list):
+        """
+        Get the schema of the output of a multi-aperture analysis, where every
+        column is repeated for each aperture, with the aperture label added to its
+        name (e.g. "n_galaxies_45arcsec").
+        """
+        return outputSchema(
+            [
+                outputColumn(
+                    f"{column.name}_{label}",
+                    "str" if column.is_string else column.dtype.name,
+                    column.shape,
+                    column.unit,
+                )
+                for label in labels
+                for column in self
+            ]
+        )
+
+    def to_dict(self) -> dict:
+        return {column.name: column.to_dict() for column in self}
+
+
+def parse_schema(schema: dict) -> outputSchema:
+    columns = []
+    for name, spec in schema.items():
+        if isinstance(spec, str):
+            spec = {"dtype": spec}
+        elif not isinstance(spec, dict) or "dtype" not in spec:
+            raise cosmapSchemaException(
+                f"Column {name} in the output schema must be a dtype, or a"
+                " dictionary with a dtype"
+            )
+        unknown = set(spec) - {"dtype", "shape", "unit"}
+        if unknown:
+            raise cosmapSchemaException(
+                f"Unknown keys {sorted(unknown)} for column {name} in the output"
+                " schema"
+            )
+        columns.append(
+            outputColumn(name, spec["dtype"], spec.get("shape", ()), spec.get("unit"))
+        )
+    return outputSchema(columns)
+
+
+def column_dtype(name: str, values: list) -> str:
+    """
+    Get the schema dtype for a column cosmap fills in itself, from its values.
+    """
+    array = np.asarray(values)
+    if array.ndim != 1 or array.dtype.kind not in "biufUS":
+        raise cosmapSchemaException(
+            f"Values of {name} can't be stored in a column of a declared schema"
+        )
+    return "str" if array.dtype.kind in "US" else array.dtype.name
@@ -1,8 +1,22 @@
 from abc import ABC, abstractmethod
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
+from .schema import outputSchema
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
 
 class cosmapOutputException(Exception):
     pass
@@ -19,9 +33,25 @@ class cosmapOutputWriter(ABC):
     def write_output(self, output, *args, **kwargs):
         pass
 
+    def add_metadata(self, metadata: dict):
+        """
+        Add to the run metadata. Writers whose format can't hold metadata ignore it.
+        """
+        pass
+
+    def close(self):
+        """
+        Finish writing. Writers that keep a file open should close it here.
+        """
+        pass
+
 
 class dataframeCsvWriter(cosmapOutputWriter):
-    def __init__(self, path: Path, *args, **kwargs):
+    def __init__(self, path: Path, schema: outputSchema = None, *args, **kwargs):
+        if schema is not None and schema.has_arrays:
+            raise cosmapOutputException(
+                "CSV outputs can't hold array columns. Write them as parquet or hdf5"
+            )
         self._path = path
 
     def write_output(self, output: pd.DataFrame, *args, **kwargs):
@@ -35,7 +65,254 @@ class dataframeCsvWriter(cosmapOutputWriter):
         )
 
 
-known_writers = {"csv": dataframeCsvWriter}
+class dataframeParquetWriter(cosmapOutputWriter):
+    """
+    Writes DataFrames to a single Parquet file, through a writer that stays open
+    for the whole run. Each write is appended as one or more row groups. The schema
+    is fixed by the first write, and later writes are cast to it, so a column can't
+    silently change type partway through a run. The file is only complete once the
+    writer has been closed.
+
+    If the output has a declared schema, the Parquet schema comes from it instead.
+    Array columns are stored as fixed-size lists (nested, for more than one
+    dimension), and units are kept in the field metadata. The run metadata is
+    stored as key-value metadata in the file footer, when the writer is closed.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        compression: str = "zstd",
+        row_group_size: int = None,
+        schema: outputSchema = None,
+        metadata: dict = {},
+        *args,
+        **kwargs,
+    ):
+        if pa is None:
+            raise ImportError(
+                "The parquet output writer requires pyarrow. "
+                "Install it with `pip install cosmap[parquet]`"
+            )
+        self._path = path
+        self._compression = compression
+        self._row_group_size = row_group_size
+        self._output_schema = schema
+        self._schema = None if schema is None else arrow_schema(schema)
+        self._metadata = dict(metadata)
+        self._writer = None
+
+    def write_output(self, output: pd.DataFrame, *args, **kwargs):
+        if self._schema is None:
+            self._schema = pa.Schema.from_pandas(output, preserve_index=False)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(
+                self._path, self._schema, compression=self._compression
+            )
+        try:
+            if self._output_schema is None:
+                table = pa.Table.from_pandas(
+                    output, schema=self._schema, preserve_index=False
+                )
+            else:
+                table = pa.Table.from_arrays(
+                    [
+                        arrow_column(output[column.name], column)
+                        for column in self._output_schema
+                    ],
+                    schema=self._schema,
+                )
+        except (pa.ArrowInvalid, pa.ArrowTypeError, KeyError) as e:
+            raise cosmapOutputException(
+                f"Output does not match the schema of {self._path}: {e}"
+            )
+        self._writer.write_table(table, row_group_size=self._row_group_size)
+
+    def add_metadata(self, metadata: dict):
+        self._metadata.update(metadata)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.add_key_value_metadata(
+                {key: str(value) for key, value in self._metadata.items()}
+            )
+            self._writer.close()
+            self._writer = None
+
+
+class dataframeHdf5Writer(cosmapOutputWriter):
+    """
+    Writes DataFrames to an HDF5 file, with one chunked, compressed dataset per
+    column. The datasets are preallocated for the number of rows the run is
+    expected to produce, and each write goes straight into place. Datasets can
+    grow if a run produces more rows than expected, and are trimmed when the
+    writer is closed if it produces fewer (for example, when bad samples were
+    skipped).
+
+    The file is flushed after every write, and the number of rows written so far
+    is kept in its "n_rows" attribute, so the output can be read (with
+    locking=False) while the run is still going. Rows past that are unwritten (NaN
+    for float columns). The run metadata is stored as file attributes.
+
+    If the output has a declared schema, the file and its datasets are created as
+    soon as the writer is, with the declared types. Array columns get datasets of
+    shape (n_rows, *shape), and units are stored in a "unit" attribute.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        expected_rows: int = None,
+        metadata: dict = {},
+        compression: str = "gzip",
+        compression_opts: int = None,
+        chunk_rows: int = 65536,
+        schema: outputSchema = None,
+        *args,
+        **kwargs,
+    ):
+        if h5py is None:
+            raise ImportError(
+                "The hdf5 output writer requires h5py. "
+                "Install it with `pip install cosmap[hdf5]`"
+            )
+        self._path = path
+        self._expected_rows = expected_rows or 0
+        self._metadata = metadata
+        self._compression = compression
+        self._compression_opts = compression_opts
+        self._chunk_rows = chunk_rows
+        self._schema = schema
+        self._file = None
+        self._n_rows = 0
+        if schema is not None:
+            self.__create(
+                [
+                    (c.name, h5py.string_dtype() if c.is_string else c.dtype, c.shape)
+                    for c in schema
+                ],
+                self._expected_rows,
+            )
+            for column in schema:
+                if column.unit is not None:
+                    self._file[column.name].attrs["unit"] = column.unit
+
+    def write_output(self, output: pd.DataFrame, *args, **kwargs):
+        if self._file is None:
+            self.__create(
+                [
+                    (name, self.__column_values(output[name]).dtype, ())
+                    for name in output.columns
+                ],
+                max(self._expected_rows, len(output)),
+            )
+        if set(output.columns) != set(self._file.keys()):
+            raise cosmapOutputException(
+                f"Output columns {list(output.columns)} do not match the columns"
+                f" of {self._path}"
+            )
+        start, stop = self._n_rows, self._n_rows + len(output)
+        for name in output.columns:
+            dataset = self._file[name]
+            if stop > dataset.shape[0]:
+                # Grow geometrically, so repeated overruns stay cheap
+                dataset.resize(max(stop, 2 * dataset.shape[0]), axis=0)
+            dataset[start:stop] = self.__column_values(output[name])
+        self._n_rows = stop
+        self._file.attrs["n_rows"] = stop
+        self._file.flush()
+
+    def add_metadata(self, metadata: dict):
+        self._metadata = self._metadata | metadata
+        if self._file is not None:
+            for key, value in metadata.items():
+                self._file.attrs[key] = value
+
+    def close(self):
+        if self._file is None:
+            return
+        for dataset in self._file.values():
+            if dataset.shape[0] != self._n_rows:
+                dataset.resize(self._n_rows, axis=0)
+        self._file.attrs["complete"] = True
+        self._file.close()
+        self._file = None
+
+    def __create(self, columns: list, n_rows: int):
+        """
+        Create the file, with a dataset for each (name, dtype, shape) column.
+        """
+        # Without locking, other processes can read the file during the run
+        self._file = h5py.File(self._path, "w", locking=False)
+        for name, dtype, shape in columns:
+            fillvalue = np.nan if dtype.kind == "f" else None
+            self._file.create_dataset(
+                name,
+                shape=(n_rows, *shape),
+                maxshape=(None, *shape),
+                dtype=dtype,
+                chunks=(max(1, min(self._chunk_rows, n_rows)), *shape),
+                compression=self._compression,
+                compression_opts=self._compression_opts,
+                fillvalue=fillvalue,
+            )
+        for key, value in self._metadata.items():
+            self._file.attrs[key] = value
+        self._file.attrs["n_rows"] = 0
+        self._file.attrs["complete"] = False
+
+    def __column_values(self, column: pd.Series) -> np.ndarray:
+        if self._schema is not None:
+            schema_column = self._schema[column.name]
+            values = column_array(column, schema_column)
+            if schema_column.is_string:
+                values = values.astype(h5py.string_dtype())
+            return values
+        values = column.to_numpy()
+        if values.dtype.kind in "OUS":
+            # Strings are stored as variable-length UTF-8
+            values = values.astype(h5py.string_dtype())
+        return values
+
+
+def column_array(values: pd.Series, column) -> np.ndarray:
+    """
+    Get the values of a column with a declared schema as a single array, of shape
+    (n, *shape). The parser stores array columns as one array per row.
+    """
+    if not column.shape:
+        return values.to_numpy()
+    if not len(values):
+        return np.empty((0, *column.shape), dtype=column.dtype)
+    return np.stack(values.to_numpy()).astype(column.dtype, copy=False)
+
+
+def arrow_schema(schema: outputSchema):
+    fields = []
+    for column in schema:
+        type_ = pa.string() if column.is_string else pa.from_numpy_dtype(column.dtype)
+        for size in reversed(column.shape):
+            type_ = pa.list_(type_, size)
+        metadata = None if column.unit is None else {"unit": column.unit}
+        fields.append(pa.field(column.name, type_, metadata=metadata))
+    return pa.schema(fields)
+
+
+def arrow_column(values: pd.Series, column):
+    array = column_array(values, column)
+    if column.is_string:
+        return pa.array(array, type=pa.string())
+    output = pa.array(array.reshape(-1))
+    for size in reversed(column.shape):
+        output = pa.FixedSizeListArray.from_arrays(output, size)
+    return output
+
+
+known_writers = {
+    "csv": dataframeCsvWriter,
+    "parquet": dataframeParquetWriter,
+    "hdf5": dataframeHdf5Writer,
+}
 
 
 def get_writer(writer_type: str):
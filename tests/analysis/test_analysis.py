@@ -0,0 +1,139 @@
+from types import SimpleNamespace
+
+import astropy.units as u
+import pytest
+
+from cosmap.analysis.analysis import (
+    CosmapAnalysisException,
+    CosmapFusedAnalysis,
+    get_output_schema,
+    same_value,
+)
+from cosmap.config.analysis import CosmapConvergenceParameters
+
+
+def check(values: dict, block: str = "sampling_parameters"):
+    analysis = CosmapFusedAnalysis.__new__(CosmapFusedAnalysis)
+    analysis.check_shared_parameters(values, block)
+
+
+def test_matching_members_pass():
+    check(
+        {
+            "a": {"n_samples": 100, "sample_dimensions": [1, 2] * u.arcmin},
+            "b": {"n_samples": 100, "sample_dimensions": [1, 2] * u.arcmin},
+        }
+    )
+
+
+def test_different_n_samples_are_rejected():
+    with pytest.raises(CosmapAnalysisException, match="n_samples"):
+        check({"a": {"n_samples": 100}, "b": {"n_samples": 200}})
+
+
+def test_different_filters_are_rejected():
+    with pytest.raises(CosmapAnalysisException, match="dataset filters"):
+        check(
+            {
+                "a": {"catalog": ["RowFilter(redshift < 1.0)"]},
+                "b": {"catalog": ["RowFilter(redshift < 2.0)"]},
+            },
+            "dataset filters",
+        )
+
+
+def test_missing_values_are_rejected():
+    with pytest.raises(CosmapAnalysisException, match="catalog"):
+        check({"a": {}, "b": {"catalog": []}}, "dataset filters")
+
+
+def test_same_value_compares_quantities():
+    assert same_value(2 * u.arcmin, 2 * u.arcmin)
+    assert not same_value([1, 2] * u.arcmin, [1, 3] * u.arcmin)
+
+
+def schema_parameters(sample_dimensions, output_paths=None, sweep=None):
+    return SimpleNamespace(
+        analysis_parameters=SimpleNamespace(
+            transformations={
+                "Main": {
+                    "count": {
+                        "is-output": True,
+                        "output-schema": {"n_galaxies": "int64", "kappa": "float32"},
+                    }
+                }
+            }
+        ),
+        sampling_parameters=SimpleNamespace(sample_dimensions=sample_dimensions),
+        output_parameters=SimpleNamespace(output_paths=output_paths),
+        sweep=sweep or {},
+    )
+
+
+def test_output_schema_single_aperture():
+    schema = get_output_schema(schema_parameters(2 * u.arcmin), ["r0"])
+    assert schema.names == ["n_galaxies", "kappa", "realization"]
+
+
+def test_output_schema_is_repeated_for_each_aperture():
+    parameters = schema_parameters([2, 1] * u.arcmin, sweep={"count.cut": [1.0, 2.0]})
+    schema = get_output_schema(parameters, ["r0"])
+    assert schema.names == [
+        "n_galaxies_1arcmin",
+        "kappa_1arcmin",
+        "n_galaxies_2arcmin",
+        "kappa_2arcmin",
+        "realization",
+        "cut",
+    ]
+    assert schema["kappa_2arcmin"].dtype == "float32"
+
+
+class Future:
+    # A chunk that has finished, unless it has no result
+    def __init__(self, result):
+        self._result = result
+
+    def result(self):
+        return self._result
+
+    def done(self):
+        return self._result is not None
+
+
+class Recorder:
+    # Stands in for both the client and the output handler
+    def __init__(self, events):
+        self.events = events
+
+    def __getattr__(self, name):
+        return lambda *args: self.events.append((name, *args)) or {}
+
+
+def test_run_cancels_before_closing_and_records_why_it_stopped(monkeypatch):
+    monkeypatch.setattr(
+        "cosmap.analysis.analysis.as_completed",
+        lambda futures: (f for f in futures if f.done()),
+    )
+    events = []
+    analysis = CosmapFusedAnalysis.__new__(CosmapFusedAnalysis)
+    analysis.parameters = SimpleNamespace(
+        sampling_parameters=SimpleNamespace(n_samples=20),
+        convergence=CosmapConvergenceParameters(
+            columns=["kappa"], precision=0.5, min_samples=2
+        ),
+        sweep={},
+    )
+    analysis.realizations = None
+    analysis.client = analysis.output_handler = Recorder(events)
+    # The first chunk is enough to converge, the second never finishes
+    converging = [{"kappa": 1.0 + 0.01 * i} for i in range(10)]
+    analysis.tasks = [Future(converging), Future(None)]
+    analysis.run()
+
+    names = [event[0] for event in events]
+    assert names.index("cancel") < names.index("add_metadata") < names.index("close")
+    assert events[names.index("cancel")][1] == analysis.tasks[1:]
+    (_, metadata) = events[names.index("add_metadata")]
+    assert metadata == {"stop_reason": analysis.stop_reason, "n_completed_samples": 10}
+    assert analysis.stop_reason.startswith("Reached a relative precision")
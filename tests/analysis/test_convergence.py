@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+from loguru import logger
+from scipy.stats import norm
+
+from cosmap.analysis.convergence import ConvergenceMonitor, RunningMean, RunningQuantile
+from cosmap.config.analysis import CosmapConvergenceParameters
+
+
+def exact_error(values, quantile, confidence):
+    # Half the width of the order statistic confidence interval, from every value
+    values = np.sort(values)
+    n = len(values)
+    spread = norm.ppf(0.5 + confidence / 2) * np.sqrt(n * quantile * (1 - quantile))
+    low = int(np.floor(n * quantile - spread))
+    high = int(np.ceil(n * quantile + spread))
+    return (values[high] - values[low]) / 2
+
+
+def test_running_mean_matches_numpy():
+    rng = np.random.default_rng(1)
+    values = rng.normal(3, 2, 10000)
+    mean = RunningMean()
+    for batch in np.array_split(values, 17):
+        mean.update(batch)
+    assert mean.estimate == pytest.approx(values.mean())
+    assert mean.error == pytest.approx(values.std(ddof=1) / np.sqrt(len(values)))
+
+
+@pytest.mark.parametrize("quantile", [0.5, 0.16, 0.9])
+def test_running_quantile_matches_exact(quantile):
+    rng = np.random.default_rng(2)
+    values = rng.lognormal(0, 1, 20000)
+    statistic = RunningQuantile(quantile, 0.68, max_values=1000)
+    for batch in np.array_split(values, 40):
+        statistic.update(batch)
+    assert statistic.estimate == pytest.approx(np.quantile(values, quantile))
+    assert statistic.error == pytest.approx(exact_error(values, quantile, 0.68))
+
+
+def test_running_quantile_is_bounded():
+    rng = np.random.default_rng(3)
+    statistic = RunningQuantile(0.5, 0.68, max_values=1000)
+    for _ in range(100):
+        statistic.update(rng.normal(size=500))
+        assert statistic.stored <= 1000 + 500
+    assert statistic.n == 50000
+    assert np.isfinite(statistic.error)
+
+
+def test_running_quantile_needs_values():
+    statistic = RunningQuantile(0.5, 0.68)
+    assert np.isnan(statistic.estimate)
+    statistic.update(np.array([1.0]))
+    assert statistic.error == np.inf
+
+
+def test_monitor_converges():
+    parameters = CosmapConvergenceParameters(
+        columns=["kappa"], statistics=["mean", "median"], precision=0.05
+    )
+    monitor = ConvergenceMonitor(parameters)
+    rng = np.random.default_rng(4)
+    for _ in range(20):
+        outputs = [{"kappa": value} for value in rng.normal(1, 0.5, 100)]
+        monitor.update(outputs)
+        if monitor.converged:
+            break
+    assert monitor.converged
+    assert set(monitor.precision()) == {"kappa:mean", "kappa:median"}
+
+
+def test_monitor_warns_about_missing_columns():
+    messages = []
+    sink = logger.add(messages.append, level="WARNING")
+    try:
+        monitor = ConvergenceMonitor(
+            CosmapConvergenceParameters(columns=["kappa", "gamma"])
+        )
+        monitor.update([{"kappa": 1.0}])
+        monitor.update([{"kappa": 2.0}])
+    finally:
+        logger.remove(sink)
+    assert len(messages) == 1
+    assert "gamma" in messages[0] and "'kappa'" not in messages[0]
+    assert not monitor.converged
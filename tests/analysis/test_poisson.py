@@ -0,0 +1,71 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from cosmap.analysis.poisson import annulus_candidates, poisson_disk_samples
+from cosmap.dataset.geometry import unit_vectors
+from cosmap.dataset.neighbors import chord_length
+
+# A 2x2 degree patch at the equator
+PHI_RANGE = (np.radians(10.0), np.radians(12.0))
+COSTHETA_RANGE = (0.0, np.sin(np.radians(2.0)))
+SEPARATION = 3 / 60
+
+
+def get_samples(n_samples=None, seed=1):
+    return poisson_disk_samples(
+        PHI_RANGE,
+        COSTHETA_RANGE,
+        SEPARATION,
+        np.random.default_rng(seed),
+        n_samples=n_samples,
+    )
+
+
+def nearest_separation(samples, other=None) -> np.ndarray:
+    vectors = unit_vectors(samples[:, 0], samples[:, 1]).reshape(-1, 3)
+    tree = cKDTree(vectors)
+    if other is None:
+        distances, _ = tree.query(vectors, k=2)
+        return distances[:, 1]
+    distances, _ = tree.query(unit_vectors(other[:, 0], other[:, 1]).reshape(-1, 3))
+    return distances
+
+
+def test_samples_are_separated_and_in_region():
+    samples = get_samples()
+    assert np.all(nearest_separation(samples) >= chord_length(SEPARATION))
+    assert np.all((samples[:, 0] >= 10.0) & (samples[:, 0] <= 12.0))
+    assert np.all((samples[:, 1] >= 0.0) & (samples[:, 1] <= 2.0))
+
+
+def test_filling_leaves_no_gaps():
+    samples = get_samples()
+    rng = np.random.default_rng(2)
+    probes = np.column_stack([rng.uniform(10, 12, 1000), rng.uniform(0, 2, 1000)])
+    # Anywhere a new sample would fit is a gap. Bridson's algorithm can leave a
+    # few, but not many.
+    gaps = nearest_separation(samples, probes) >= chord_length(SEPARATION)
+    assert gaps.mean() < 0.01
+
+
+def test_stops_at_n_samples():
+    full = get_samples()
+    samples = get_samples(n_samples=200)
+    assert len(samples) == 200
+    assert np.all(nearest_separation(samples) >= chord_length(SEPARATION))
+    # The samples cover the whole region, not just a patch around the first one
+    assert samples[:, 0].max() - samples[:, 0].min() > 1.8
+    assert samples[:, 1].max() - samples[:, 1].min() > 1.8
+    # Asking for more samples than fit returns a full region
+    assert len(get_samples(n_samples=10 * len(full))) > 0.9 * len(full)
+
+
+def test_annulus_candidates():
+    rng = np.random.default_rng(3)
+    points = unit_vectors(np.array([0.0, 90.0, 200.0]), np.array([0.0, 45.0, -89.0]))
+    points = points.reshape(-1, 3)
+    candidates = annulus_candidates(points, 0.01, 50, rng)
+    assert candidates.shape == (3, 50, 3)
+    assert np.allclose(np.linalg.norm(candidates, axis=-1), 1.0)
+    angles = np.arccos(np.clip(np.sum(candidates * points[:, None], axis=-1), -1, 1))
+    assert np.all((angles >= 0.01 - 1e-9) & (angles <= 0.02 + 1e-9))
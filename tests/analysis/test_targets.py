@@ -0,0 +1,93 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from astropy.table import Table
+
+from cosmap.analysis.targets import draw_targets, select_targets
+from cosmap.config.analysis import CosmapTargetParameters
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    path = tmp_path / "halos.csv"
+    Table(
+        {
+            "ra": [10.0, 20.0, 30.0, 40.0, 50.0],
+            "dec": [-1.0, -2.0, -3.0, -4.0, -5.0],
+            "mass": [1e13, 5e14, 2e12, 1e15, 3e14],
+            "x": [1.0, 2.0, 3.0, 4.0, 5.0],
+        }
+    ).write(path, format="ascii.csv")
+    return path
+
+
+def parameters(path, **kwargs):
+    return CosmapTargetParameters(path=path, format="ascii.csv", **kwargs)
+
+
+def test_select_targets(catalog):
+    targets = select_targets(
+        parameters(catalog, filters=["mass >= Main.min_mass"], weight_column="mass"),
+        SimpleNamespace(min_mass=1e14),
+    )
+    assert targets["coordinates"].tolist() == [
+        [20.0, -2.0],
+        [40.0, -4.0],
+        [50.0, -5.0],
+    ]
+    assert targets["weights"].tolist() == [5e14, 1e15, 3e14]
+
+
+def test_select_cartesian_targets(catalog):
+    targets = select_targets(
+        parameters(catalog, coordinate_columns=["x", "x", "mass"]), None, True
+    )
+    assert targets["coordinates"].shape == (5, 3)
+    assert targets["weights"] is None
+    with pytest.raises(ValueError, match="coordinate columns"):
+        select_targets(parameters(catalog), None, True)
+
+
+def test_negative_weights_are_rejected(catalog):
+    with pytest.raises(ValueError, match="non-negative"):
+        select_targets(parameters(catalog, weight_column="dec"), None)
+
+
+def test_selection_is_cached(catalog, tmp_path):
+    target_parameters = parameters(
+        catalog, filters=["mass > 1e14"], cache_path=tmp_path / "cache"
+    )
+    targets = select_targets(target_parameters, None)
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+    cached = select_targets(target_parameters, None)
+    assert np.array_equal(cached["coordinates"], targets["coordinates"])
+    # A different selection doesn't reuse the cached one
+    other = select_targets(parameters(catalog, cache_path=tmp_path / "cache"), None)
+    assert len(other["coordinates"]) == 5
+    assert len(list((tmp_path / "cache").iterdir())) == 2
+
+
+def test_draw_targets_with_seed():
+    targets = {"coordinates": np.arange(200.0).reshape(100, 2), "weights": None}
+    first = draw_targets(targets, 10, np.random.default_rng(42))
+    second = draw_targets(targets, 10, np.random.default_rng(42))
+    assert np.array_equal(first, second)
+    assert len(np.unique(first[:, 0])) == 10
+    # Drawn targets stay in catalog order
+    assert np.all(np.diff(first[:, 0]) > 0)
+
+
+def test_draw_targets_follows_weights():
+    weights = np.zeros(100)
+    weights[[3, 50, 97]] = 1.0
+    targets = {"coordinates": np.arange(200.0).reshape(100, 2), "weights": weights}
+    drawn = draw_targets(targets, 3, np.random.default_rng(1))
+    assert drawn[:, 0].tolist() == [6.0, 100.0, 194.0]
+
+
+def test_more_samples_than_targets():
+    targets = {"coordinates": np.arange(10.0).reshape(5, 2), "weights": None}
+    drawn = draw_targets(targets, 8, np.random.default_rng(1))
+    assert np.array_equal(drawn, targets["coordinates"])
+    assert len(draw_targets(targets, 5, np.random.default_rng(1))) == 5
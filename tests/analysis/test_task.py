@@ -0,0 +1,199 @@
+from functools import partial
+from types import SimpleNamespace
+
+import astropy.units as u
+import numpy as np
+import pytest
+
+from cosmap.analysis import CosmapBadSampleError
+from cosmap.analysis.task import (
+    NestedOutputs,
+    aperture_pipeline,
+    assign_chunks_to_workers,
+    combine_aperture_outputs,
+    fused_pipeline,
+    get_apertures,
+    get_cached_tiles,
+    get_worker_layout,
+    pipeline,
+    sweep_pipeline,
+    tag_output,
+    tag_sweeps,
+)
+from cosmap.dataset.cache import MemoryTileCache
+from cosmap.dataset.capabilities import DatasetCapability
+from cosmap.dataset.region import SampleRegion
+from cosmap.dataset.tiles import TiledDataset, TileScheme, tile_key
+
+TRANSFORMATIONS = {
+    "count": {
+        "needed-data": ["catalog"],
+        "needed-parameters": ["Main.min_r"],
+        "is-output": True,
+    }
+}
+
+DEFINITIONS = SimpleNamespace(
+    count=lambda catalog, min_r, sample_region: {"n": len(catalog["ra"])}
+)
+
+
+def get_parameters(min_r: float) -> dict:
+    return {
+        "min_r": min_r,
+        "analysis_parameters": {"transformations": {"Main": TRANSFORMATIONS}},
+    }
+
+
+def get_sample():
+    # Four objects, sorted by distance, with two inside the inner aperture
+    catalog = {"ra": np.zeros(4), "dec": np.arange(4, dtype=np.float64)}
+    return {"catalog": catalog, "catalog_apertures": np.array([2, 4])}
+
+
+def run_apertures(pipeline_function):
+    radii, labels = get_apertures([1, 2] * u.arcmin)
+    output = aperture_pipeline(
+        data=get_sample(),
+        sample_region=SampleRegion(10.0, 10.0, radii[-1]),
+        pipeline_function=pipeline_function,
+        apertures=(radii, labels),
+        prefixed={"catalog": "catalog"},
+    )
+    return tag_sweeps(output)
+
+
+def test_aperture_outputs_are_suffixed():
+    pipeline_function = partial(
+        pipeline,
+        parameters=get_parameters(1.0),
+        transformations=TRANSFORMATIONS,
+        transformation_definitions=DEFINITIONS,
+        task_order=["count"],
+    )
+    assert run_apertures(pipeline_function) == {"n_1arcmin": 2, "n_2arcmin": 4}
+
+
+def test_sweep_tags_are_not_suffixed_by_apertures():
+    points = [{"Main.min_r": 1.0}, {"Main.min_r": 2.0}]
+    pipeline_function = partial(
+        sweep_pipeline,
+        parameters=get_parameters(1.0),
+        sweep_points=points,
+        point_parameters=[get_parameters(p["Main.min_r"]) for p in points],
+        swept_tasks={"count"},
+        transformations=TRANSFORMATIONS,
+        transformation_definitions=DEFINITIONS,
+        task_order=["count"],
+    )
+    assert run_apertures(pipeline_function) == [
+        {"n_1arcmin": 2, "n_2arcmin": 4, "min_r": 1.0},
+        {"n_1arcmin": 2, "n_2arcmin": 4, "min_r": 2.0},
+    ]
+
+
+def test_fused_sweeps_are_tagged_per_analysis():
+    points = [{"Main.min_r": 1.0}]
+    sweep = sweep_pipeline(
+        data=get_sample(),
+        sample_region=SampleRegion(10.0, 10.0, 0.1),
+        parameters=get_parameters(1.0),
+        sweep_points=points,
+        point_parameters=[get_parameters(1.0)],
+        swept_tasks={"count"},
+        transformations=TRANSFORMATIONS,
+        transformation_definitions=DEFINITIONS,
+        task_order=["count"],
+    )
+    tagged = tag_sweeps(NestedOutputs({"a": sweep, "b": {"n": 1}}))
+    assert isinstance(tagged, NestedOutputs)
+    assert tagged == {"a": [{"n": 4, "min_r": 1.0}], "b": {"n": 1}}
+
+
+def test_rows_of_arrays_are_not_nested():
+    # Every column holds a list or a dict, but this is still a single row
+    row = {"profile": [1.0, 2.0], "counts": {"stars": 3}}
+    assert tag_output(row, {"Main.min_r": 1.0}) == dict(row, min_r=1.0)
+    assert combine_aperture_outputs({"1arcmin": row, "2arcmin": row}) == {
+        "profile_1arcmin": [1.0, 2.0],
+        "counts_1arcmin": {"stars": 3},
+        "profile_2arcmin": [1.0, 2.0],
+        "counts_2arcmin": {"stars": 3},
+    }
+
+
+def test_nested_outputs_are_combined_per_output():
+    outputs = {
+        label: NestedOutputs({"halos": {"n": n}, "galaxies": {"n": 2 * n}})
+        for label, n in [("1arcmin", 1), ("2arcmin", 2)]
+    }
+    combined = combine_aperture_outputs(outputs)
+    assert isinstance(combined, NestedOutputs)
+    assert combined == {
+        "halos": {"n_1arcmin": 1, "n_2arcmin": 2},
+        "galaxies": {"n_1arcmin": 2, "n_2arcmin": 4},
+    }
+    tagged = tag_output(combined, {"realization": "r0"})
+    assert tagged["halos"]["realization"] == tagged["galaxies"]["realization"] == "r0"
+
+
+def reject(data, sample_region):
+    raise CosmapBadSampleError
+
+
+def test_fused_bad_samples_only_drop_their_analysis():
+    count = partial(
+        pipeline,
+        parameters=get_parameters(1.0),
+        transformations=TRANSFORMATIONS,
+        transformation_definitions=DEFINITIONS,
+        task_order=["count"],
+    )
+    region = SampleRegion(10.0, 10.0, 0.1)
+    output = fused_pipeline(get_sample(), region, {"a": count, "b": reject})
+    assert output == {"a": {"n": 4}}
+    with pytest.raises(CosmapBadSampleError):
+        fused_pipeline(get_sample(), region, {"a": reject, "b": reject})
+
+
+def test_chunks_sharing_tiles_share_a_worker():
+    chunk_tiles = [{1, 2}, {10}, {2, 3}, {11, 10}, {3, 4}, {12}]
+    workers = ["a", "b", "c"]
+    assert assign_chunks_to_workers(chunk_tiles, workers) == [
+        "a",
+        "b",
+        "a",
+        "b",
+        "c",
+        "c",
+    ]
+    # Tiles a worker already has in its cache count as well
+    assignments = assign_chunks_to_workers(chunk_tiles, workers, {"c": {10, 11}})
+    assert assignments[1] == assignments[3] == "c"
+    assert assignments[0] == assignments[2]
+
+
+def test_cached_tiles_are_found():
+    cache = MemoryTileCache(10**6)
+    for tile in [3, 7]:
+        cache.put(tile_key("catalog", tile, ["ra", "dec"]), {"ra": np.zeros(1)})
+    dataset = TiledDataset(None, TileScheme(8), [cache])
+    assert get_cached_tiles(SimpleNamespace(dataset=dataset)) == {3, 7}
+    assert get_cached_tiles(SimpleNamespace()) == set()
+
+
+@pytest.mark.parametrize(
+    "capabilities, layout",
+    [
+        (DatasetCapability.NONE, (7, 1)),
+        (DatasetCapability.THREAD_SAFE, (1, 7)),
+        (DatasetCapability.SHARED_MEMORY, (7, 1)),
+        (DatasetCapability.THREAD_SAFE | DatasetCapability.SHARED_MEMORY, (7, 1)),
+    ],
+)
+def test_worker_layout(capabilities, layout):
+    n_workers, threads_per_worker = layout
+    assert get_worker_layout(8, capabilities) == {
+        "n_workers": n_workers,
+        "threads_per_worker": threads_per_worker,
+    }
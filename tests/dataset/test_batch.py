@@ -0,0 +1,81 @@
+import astropy.units as u
+import numpy as np
+import pandas as pd
+import pytest
+from astropy.table import Table
+
+from cosmap.dataset.batch import BatchQueryAdapter, RaggedColumns, as_batch_dataset
+from cosmap.dataset.capabilities import DatasetCapability
+
+
+class ConeDataset:
+    # Returns one row per degree of radius, so every sample has a known size
+    def __init__(self):
+        self.queries = []
+
+    def cone_search(self, center, radius, dtypes):
+        self.queries.append((center.ra.deg, radius.to_value(u.deg)))
+        n = int(round(radius.to_value(u.deg)))
+        rows = {
+            "ra": np.full(n, center.ra.deg),
+            "index": np.arange(n),
+            "extra": np.zeros(n),
+        }
+        return {dtype: rows for dtype in dtypes}
+
+
+@pytest.mark.parametrize(
+    "make_table", [dict, Table, pd.DataFrame], ids=["dict", "table", "dataframe"]
+)
+def test_ragged_columns_from_parts(make_table):
+    parts = [
+        make_table({"x": np.arange(n, dtype=float) + 10 * i})
+        for i, n in enumerate([2, 0, 3])
+    ]
+    ragged = RaggedColumns.from_parts(parts)
+    assert len(ragged) == 3
+    assert list(ragged.offsets) == [0, 2, 2, 5]
+    assert list(ragged.counts) == [2, 0, 3]
+    for part, rows in zip(parts, ragged):
+        assert list(rows["x"]) == list(part["x"])
+
+
+def test_ragged_columns_slices_are_views():
+    ragged = RaggedColumns({"x": np.arange(5.0)}, [0, 2, 5])
+    assert np.shares_memory(ragged[1]["x"], ragged.columns["x"])
+
+
+def test_ragged_columns_select_columns():
+    parts = [{"x": np.arange(2), "y": np.arange(2)}]
+    ragged = RaggedColumns.from_parts(parts, columns=["x"])
+    assert list(ragged.columns) == ["x"]
+
+
+def test_adapter_falls_back_to_cone_searches():
+    dataset = ConeDataset()
+    adapter = BatchQueryAdapter(dataset)
+    centers = np.array([[10.0, 0.0], [20.0, 0.0], [30.0, 0.0]])
+    results = adapter.query_many(
+        centers, [2.0, 0.0, 3.0] * u.deg, ["catalog"], {"catalog": ["ra", "index"]}
+    )
+    catalog = results["catalog"]
+    assert list(catalog.offsets) == [0, 2, 2, 5]
+    assert set(catalog.columns) == {"ra", "index"}
+    assert list(catalog[2]["ra"]) == [30.0] * 3
+    assert dataset.queries == [(10.0, 2.0), (20.0, 0.0), (30.0, 3.0)]
+
+
+def test_adapter_only_supports_cones():
+    adapter = BatchQueryAdapter(ConeDataset())
+    with pytest.raises(NotImplementedError):
+        list(adapter.get_data_from_samples([[0, 0]], ["catalog"], "box", 1 * u.deg))
+
+
+def test_native_batch_queries_are_used():
+    class NativeDataset(ConeDataset):
+        def query_many(self, centers, radii, dtypes, columns):
+            return "native"
+
+    dataset = as_batch_dataset(NativeDataset(), DatasetCapability.BATCH_QUERIES)
+    assert dataset.query_many(np.zeros((1, 2)), 1.0, ["catalog"]) == "native"
+    assert not as_batch_dataset(NativeDataset()).native_batch
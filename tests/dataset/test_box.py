@@ -0,0 +1,83 @@
+import astropy.units as u
+import numpy as np
+import pytest
+
+from cosmap.dataset.box import PeriodicBoxDataset
+from cosmap.dataset.region import periodic_offsets
+
+BOX_SIZE = 100.0
+
+
+def make_box(positions, unit=u.Mpc):
+    positions = np.asarray(positions, dtype=np.float64)
+    data = {name: positions[:, i] * unit for i, name in enumerate("xyz")}
+    data.update({"id": np.arange(len(positions))})
+    return PeriodicBoxDataset(data, BOX_SIZE)
+
+
+@pytest.fixture
+def box():
+    rng = np.random.default_rng(6)
+    return make_box(rng.uniform(0, BOX_SIZE, (20000, 3)))
+
+
+def brute_force(box, center, size, shape):
+    offsets = periodic_offsets(box.positions, center, BOX_SIZE)
+    if shape == "sphere":
+        inside = np.linalg.norm(offsets, axis=1) <= size
+    else:
+        inside = np.all(np.abs(offsets) <= size / 2, axis=1)
+    return np.flatnonzero(inside)
+
+
+def test_spheres_wrap_around_the_edges():
+    box = make_box([[0.5, 50, 50], [98.5, 50, 50], [3.0, 50, 50], [99.5, 99.5, 0.5]])
+    result = box.query_many(
+        np.array([[99.0, 50.0, 50.0], [0.0, 0.0, 0.0]]), 2 * u.Mpc, ["catalog"]
+    )["catalog"]
+    assert list(result[0]["id"]) == [0, 1]
+    assert list(result[1]["id"]) == [3]
+
+
+def test_cubes_wrap_around_the_edges():
+    box = make_box([[99.8, 99.8, 99.8], [1.2, 0.5, 0.5], [98.0, 0.5, 0.5]])
+    result = box.query_many_cubes(np.array([[0.5, 0.5, 0.5]]), 2.0, ["catalog"])
+    assert list(result["catalog"][0]["id"]) == [0, 1]
+
+
+@pytest.mark.parametrize("shape", ["sphere", "cube"])
+def test_samples_match_brute_force(box, shape):
+    # Centers next to every face, edge and corner of the box, plus one inside
+    centers = np.array(
+        [[0.5, 50, 50], [50, 99.5, 50], [50, 50, 0.2], [99.9, 0.1, 50], [0, 0, 0]]
+        + [[100.0, 100.0, 100.0], [50, 50, 50]]
+    )
+    samples = list(box.get_data_from_samples(centers, ["catalog"], shape, 5 * u.Mpc))
+    for center, (region, data) in zip(centers, samples):
+        assert region.shape == shape and region.size == 5.0
+        expected = brute_force(box, center % BOX_SIZE, 5.0, shape)
+        assert len(expected) > 0
+        assert np.array_equal(data["catalog"]["id"], expected)
+
+
+def test_sizes_are_converted_to_box_units(box):
+    centers = np.array([[0.5, 0.5, 0.5], [60, 99, 2]])
+    in_mpc = box.query_many(centers, [3, 4] * u.Mpc, ["catalog"])["catalog"]
+    in_kpc = box.query_many(centers, [3000, 4000] * u.kpc, ["catalog"])["catalog"]
+    assert np.array_equal(in_mpc.offsets, in_kpc.offsets)
+    assert np.array_equal(in_mpc.columns["id"], in_kpc.columns["id"])
+    assert np.array_equal(in_mpc[1]["id"], brute_force(box, centers[1], 4.0, "sphere"))
+    with pytest.raises(u.UnitConversionError):
+        box.query_many(centers, 1 * u.deg, ["catalog"])
+
+
+def test_columns_are_selected(box):
+    result = box.query_many(
+        np.array([[1.0, 1.0, 1.0]]), 5.0, ["catalog"], {"catalog": ["id"]}
+    )
+    assert list(result["catalog"].columns) == ["id"]
+
+
+def test_unknown_shapes_are_rejected(box):
+    with pytest.raises(NotImplementedError):
+        list(box.get_data_from_samples([[1.0, 1.0, 1.0]], ["catalog"], "cone", 1.0))
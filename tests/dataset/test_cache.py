@@ -0,0 +1,132 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import astropy.units as u
+import numpy as np
+import pandas as pd
+import pytest
+from astropy.coordinates import SkyCoord
+from astropy.table import QTable, Table
+
+from cosmap.dataset.cache import DiskTileCache, MemoryTileCache, cache_key, data_nbytes
+
+
+def tile(n: int = 100, offset: float = 0.0):
+    return {"x": np.arange(n, dtype=np.float64) + offset, "id": np.arange(n)}
+
+
+def test_cache_key_depends_on_config():
+    key = cache_key(dataset="a", columns=["x"], nside=32)
+    assert key == cache_key(nside=32, columns=["x"], dataset="a")
+    assert key != cache_key(dataset="a", columns=["x"], nside=64)
+
+
+def test_disk_cache_hit_and_miss(tmp_path):
+    cache = DiskTileCache(tmp_path, "key", max_bytes=10**6)
+    assert cache.get("0") is None
+    cache.put("0", tile())
+    data = cache.get("0")
+    assert np.array_equal(data["x"], tile()["x"])
+    assert isinstance(data["x"], np.memmap)
+    assert cache.statistics() == {"hits": 1, "misses": 1}
+    # Tiles persist between caches with the same key
+    assert DiskTileCache(tmp_path, "key", max_bytes=10**6).get("0") is not None
+    assert DiskTileCache(tmp_path, "other", max_bytes=10**6).get("0") is None
+
+
+@pytest.mark.parametrize("disk", [True, False])
+def test_caches_count_across_threads(tmp_path, disk):
+    if disk:
+        cache = DiskTileCache(tmp_path, "key", max_bytes=10**6)
+    else:
+        cache = MemoryTileCache(max_bytes=10**6)
+    cache.put("0", tile())
+
+    def lookups(_):
+        for key in ["0", "1"] * 50:
+            cache.get(key)
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lookups, range(16)))
+    assert cache.statistics() == {"hits": 800, "misses": 800}
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskTileCache(tmp_path, "key", max_bytes=10**6)
+    cache.put("0", tile())
+    tile_size = sum(f.stat().st_size for f in (cache.root / "0").iterdir())
+    cache = DiskTileCache(tmp_path, "key", max_bytes=int(3.5 * tile_size))
+    for i in range(3):
+        cache.put(str(i), tile())
+        os.utime(cache.root / str(i), (i, i))
+    # Reading a tile marks it as recently used
+    cache.get("0")
+    cache.put("3", tile())
+    assert cache.get("1") is None
+    assert all(cache.get(key) is not None for key in ["0", "2", "3"])
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        Table({"x": [1.0, 2.0] * u.kpc, "name": np.array(["a", "b"])}),
+        QTable({"x": [1.0, 2.0] * u.kpc}),
+        QTable({"coord": SkyCoord([1.0, 2.0], [3.0, 4.0], unit="deg")}),
+        pd.DataFrame({"x": [1.0, 2.0], "id": [1, 2]}),
+    ],
+    ids=["table", "qtable", "skycoord", "dataframe"],
+)
+def test_disk_cache_round_trips_tables(tmp_path, data):
+    cache = DiskTileCache(tmp_path, "key", max_bytes=10**6)
+    cache.put("0", data)
+    result = cache.get("0")
+    assert type(result) is type(data)
+    for name in data.columns:
+        expected, values = data[name], result[name]
+        if isinstance(expected, SkyCoord):
+            assert np.allclose(values.ra.deg, expected.ra.deg)
+            assert np.allclose(values.dec.deg, expected.dec.deg)
+        else:
+            assert getattr(values, "unit", None) == getattr(expected, "unit", None)
+            assert np.array_equal(np.asarray(values), np.asarray(expected))
+
+
+def test_disk_cache_skips_uncacheable_data(tmp_path):
+    cache = DiskTileCache(tmp_path, "key", max_bytes=10**6)
+    cache.put("0", {"x": np.array([object(), object()])})
+    assert cache.get("0") is None
+    assert not list(cache.root.iterdir())
+
+
+def test_memory_cache_hit_and_miss():
+    cache = MemoryTileCache(max_bytes=10**6)
+    assert cache.get("0") is None
+    data = tile()
+    cache.put("0", data)
+    assert cache.get("0") is data
+    assert cache.statistics() == {"hits": 1, "misses": 1}
+
+
+def test_memory_cache_evicts_least_recently_used():
+    tile_size = data_nbytes(tile())
+    cache = MemoryTileCache(max_bytes=3 * tile_size)
+    for i in range(3):
+        cache.put(str(i), tile())
+    cache.get("0")
+    cache.put("3", tile())
+    assert cache.get("1") is None
+    assert all(cache.get(key) is not None for key in ["0", "2", "3"])
+
+
+def test_memory_cache_skips_oversized_tiles():
+    cache = MemoryTileCache(max_bytes=data_nbytes(tile()) - 1)
+    cache.put("0", tile())
+    assert cache.get("0") is None
+
+
+def test_data_nbytes():
+    assert data_nbytes(tile()) == 2 * 100 * 8
+    table = QTable({"coord": SkyCoord([1.0, 2.0], [3.0, 4.0], unit="deg")})
+    assert data_nbytes(table) == 2 * 24
+    with pytest.raises(TypeError):
+        data_nbytes([1, 2, 3])
@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from cosmap.dataset.filters import (
+    CosmapFilterException,
+    RowFilter,
+    apply_filters,
+    build_filters,
+    parse_expression,
+)
+
+DATA = {
+    "redshift": np.array([0.2, 0.8, 1.5, 2.5]),
+    "mag_i": np.array([22.0, 25.0, 23.5, 21.0]),
+}
+
+
+class Table(dict):
+    # Enough of a table for apply_filters: columns by name, rows by mask
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return super().__getitem__(key)
+        return Table({name: values[key] for name, values in self.items()})
+
+
+def parameters(**main):
+    return SimpleNamespace(analysis_parameters=SimpleNamespace(**main))
+
+
+@pytest.mark.parametrize(
+    "expression, groups",
+    [
+        ("redshift < 1.0", ("redshift", "<", "1.0")),
+        ("mag_i>=24", ("mag_i", ">=", "24")),
+        ("  flag-bad != 0 ", ("flag-bad", "!=", "0")),
+        ("redshift<Main.z_s", ("redshift", "<", "Main.z_s")),
+    ],
+)
+def test_parse_expression(expression, groups):
+    assert parse_expression(expression) == groups
+
+
+@pytest.mark.parametrize("expression", ["redshift", "redshift =< 1", "< 1", "a < b c"])
+def test_bad_expressions_are_rejected(expression):
+    with pytest.raises(CosmapFilterException, match="Could not parse"):
+        parse_expression(expression)
+
+
+def test_unknown_operator_is_rejected():
+    with pytest.raises(CosmapFilterException, match="operator"):
+        RowFilter("redshift", "=", 1.0)
+
+
+def test_build_filters_resolves_parameters():
+    filters = build_filters(
+        {"catalog": ["redshift < Main.z_s", "mag_i < 24"], "halos": "mass > 1e12"},
+        parameters(z_s=2.0),
+    )
+    assert [repr(f) for f in filters["catalog"]] == [
+        "RowFilter(redshift < 2.0)",
+        "RowFilter(mag_i < 24.0)",
+    ]
+    assert filters["halos"][0].value == 1e12
+
+
+def test_build_filters_resolves_top_level_parameters():
+    params = parameters()
+    params.z_max = 1.0
+    filters = build_filters({"catalog": "redshift < Main.z_max"}, params)
+    assert filters["catalog"][0].value == 1.0
+
+
+def test_missing_parameter_is_rejected():
+    with pytest.raises(CosmapFilterException, match="Main.z_s"):
+        build_filters({"catalog": "redshift < Main.z_s"}, parameters())
+
+
+def test_apply_filters():
+    config = {"catalog": ["redshift < 2", "mag_i < 24"]}
+    filters = build_filters(config, parameters())["catalog"]
+    filtered = apply_filters(Table(DATA), filters)
+    assert list(filtered["redshift"]) == [0.2, 1.5]
+    assert list(filtered["mag_i"]) == [22.0, 23.5]
+
+
+def test_no_filters_returns_the_data():
+    data = Table(DATA)
+    assert apply_filters(data, []) is data
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from cosmap.dataset.geometry import (
+    bounding_cone,
+    cone_members,
+    unit_vectors,
+    vectors_to_radec,
+)
+
+
+def brute_force_members(ra, dec, centers, radii):
+    vectors = unit_vectors(ra, dec)
+    return [
+        np.flatnonzero(vectors @ unit_vectors(*center) >= np.cos(np.radians(radius)))
+        for center, radius in zip(centers, radii)
+    ]
+
+
+@pytest.mark.parametrize("center_dec", [0.0, 60.0, 89.5, -89.5])
+def test_cone_members_match_brute_force(center_dec):
+    rng = np.random.default_rng(1)
+    n = 20000
+    ra = rng.uniform(0, 360, n)
+    dec = np.degrees(np.arcsin(rng.uniform(-1, 1, n)))
+    centers = np.column_stack(
+        [rng.uniform(0, 360, 50), np.clip(rng.normal(center_dec, 1, 50), -90, 90)]
+    )
+    # Include cones that cross RA = 0 and cones with no members
+    centers[0] = [0.5, center_dec]
+    radii = rng.uniform(0, 5, 50)
+    radii[1] = 1e-6
+
+    indices, offsets = cone_members(ra, dec, centers, radii)
+    assert len(offsets) == len(centers) + 1
+    expected = brute_force_members(ra, dec, centers, radii)
+    for i, members in enumerate(expected):
+        assert list(indices[offsets[i] : offsets[i + 1]]) == list(members)
+
+
+def test_cone_members_without_cones():
+    indices, offsets = cone_members([1.0], [1.0], np.zeros((0, 2)), np.zeros(0))
+    assert len(indices) == 0 and list(offsets) == [0]
+
+
+def test_vectors_round_trip():
+    ra = np.array([0.0, 90.0, 359.0, 180.0])
+    dec = np.array([0.0, 45.0, -30.0, 89.0])
+    assert np.allclose(vectors_to_radec(unit_vectors(ra, dec)), [ra, dec])
+
+
+def test_bounding_cone_encloses_cones():
+    centers = np.array([[10.0, 0.0], [12.0, 1.0], [11.0, -1.0]])
+    radii = np.array([0.5, 0.5, 1.0])
+    (ra, dec), radius = bounding_cone(centers, radii)
+    separations = np.degrees(
+        np.arccos(np.clip(unit_vectors(*centers.T) @ unit_vectors(ra, dec), -1, 1))
+    )
+    assert np.all(separations + radii <= radius + 1e-9)
+
+
+def test_bounding_cone_of_the_whole_sky():
+    centers = np.array([[0.0, 0.0], [180.0, 0.0]])
+    assert bounding_cone(centers, np.array([1.0, 1.0])) is None
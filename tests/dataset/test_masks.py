@@ -0,0 +1,157 @@
+from types import SimpleNamespace
+
+import astropy.units as u
+import numpy as np
+import pytest
+from astropy.coordinates import SkyCoord
+
+from cosmap.analysis.task import get_sample_generator
+from cosmap.dataset.batch import as_batch_dataset
+from cosmap.dataset.cache import MemoryTileCache
+from cosmap.dataset.capabilities import DatasetCapability
+from cosmap.dataset.geometry import unit_vectors
+from cosmap.dataset.masks import MaskRaster, evaluate_mask, get_mask_raster
+from cosmap.dataset.tiles import TiledDataset, TileScheme
+
+
+class CircleMask:
+    """
+    Masks everything within radius degrees of a center.
+    """
+
+    def __init__(self, ra: float, dec: float, radius: float):
+        self.center = unit_vectors(ra, dec)
+        self.radius = radius
+
+    def distance(self, ra, dec):
+        cos = unit_vectors(ra, dec) @ self.center
+        return np.degrees(np.arccos(np.clip(cos, -1.0, 1.0)))
+
+    def contains(self, ra, dec):
+        return self.distance(ra, dec) < self.radius
+
+
+class HeinleinMask(CircleMask):
+    # heinlein masks return the coordinates that are not masked
+    def mask(self, coordinates: SkyCoord):
+        return coordinates[~self.contains(coordinates.ra.deg, coordinates.dec.deg)]
+
+
+class MaskedDataset:
+    """
+    Only answers single cone searches. Every cone gets the catalog within it, and
+    the same masks.
+    """
+
+    def __init__(self, catalog: dict, masks: dict):
+        self.catalog = catalog
+        self.masks = masks
+
+    def cone_search(self, center, radius, dtypes):
+        distance = np.degrees(
+            np.arccos(
+                np.clip(
+                    unit_vectors(self.catalog["ra"], self.catalog["dec"])
+                    @ unit_vectors(center.ra.deg, center.dec.deg),
+                    -1.0,
+                    1.0,
+                )
+            )
+        )
+        inside = distance <= radius.to_value(u.deg)
+        data = {"catalog": {k: v[inside] for k, v in self.catalog.items()}}
+        data.update(self.masks)
+        return {dtype: data[dtype] for dtype in dtypes}
+
+
+@pytest.fixture
+def catalog():
+    rng = np.random.default_rng(1)
+    return {"ra": rng.uniform(9.5, 10.5, 5000), "dec": rng.uniform(-0.5, 0.5, 5000)}
+
+
+def samples(dataset, dtypes, rasters):
+    centers = np.array([[10.0, 0.0], [10.1, 0.05]])
+    return list(
+        get_sample_generator(
+            dataset,
+            centers,
+            dtypes,
+            "cone",
+            0.2 * u.deg,
+            ("ra", "dec"),
+            mask_rasters=rasters,
+        )
+    )
+
+
+def test_masks_on_the_batch_path(catalog):
+    mask = CircleMask(10.05, 0.0, 0.05)
+    dataset = TiledDataset(
+        MaskedDataset(catalog, {"mask": mask}),
+        TileScheme(64),
+        [MemoryTileCache(10**8)],
+    )
+    dataset = as_batch_dataset(dataset, DatasetCapability.BATCH_QUERIES)
+    worker = SimpleNamespace()
+    rasters = lambda dtype: get_mask_raster(worker, dtype)  # noqa: E731
+    for region, data in samples(dataset, ["catalog", "mask_raster"], rasters):
+        raster = data["mask_raster"]
+        assert raster.mask is mask
+        assert raster.center == (region.ra_deg, region.dec_deg)
+        masked = raster.is_masked(data["catalog"]["ra"], data["catalog"]["dec"])
+        assert 0 < np.count_nonzero(masked) < len(masked)
+
+
+def test_each_mask_gets_its_own_raster(catalog):
+    masks = {
+        "mask": CircleMask(10.05, 0.0, 0.05),
+        "stars": CircleMask(9.95, 0.0, 0.05),
+    }
+    dataset = as_batch_dataset(MaskedDataset(catalog, masks))
+    worker = SimpleNamespace()
+    assert get_mask_raster(worker, "mask") is not get_mask_raster(worker, "stars")
+    assert get_mask_raster(worker, "mask") is get_mask_raster(worker, "mask")
+    assert get_mask_raster(worker, "mask", "r1") is not get_mask_raster(worker, "mask")
+
+    rasters = lambda dtype: get_mask_raster(worker, dtype)  # noqa: E731
+    # Run twice, so the second pass reads the pixels cached by the first
+    for _ in range(2):
+        for _, data in samples(
+            dataset, ["catalog", "mask_raster", "stars_raster"], rasters
+        ):
+            ra, dec = data["catalog"]["ra"], data["catalog"]["dec"]
+            for dtype, mask in masks.items():
+                masked = data[f"{dtype}_raster"].is_masked(ra, dec)
+                far = np.abs(mask.distance(ra, dec) - mask.radius) > 0.01
+                assert np.array_equal(masked[far], mask.contains(ra, dec)[far])
+
+
+@pytest.mark.parametrize("mask_type", [CircleMask, HeinleinMask])
+def test_raster_agrees_with_the_exact_mask(catalog, mask_type):
+    mask = mask_type(10.0, 0.0, 0.05)
+    raster = MaskRaster(nside=2**14)
+    dataset = as_batch_dataset(MaskedDataset(catalog, {"mask": mask}))
+    _, data = samples(dataset, ["catalog", "mask_raster"], lambda _: raster)[0]
+    sample_raster = data["mask_raster"]
+    ra, dec = data["catalog"]["ra"], data["catalog"]["dec"]
+    masked = sample_raster.is_masked(ra, dec)
+    exact = evaluate_mask(mask, ra, dec)
+    # Positions are tested at their pixel's center, so they can only disagree
+    # within a pixel of the mask's edge
+    disagree = masked != exact
+    edge = np.abs(mask.distance(ra, dec) - mask.radius) < raster.pixel_size
+    assert not np.any(disagree & ~edge)
+    assert sample_raster.is_masked(10.0, 0.0) and not sample_raster.is_masked(10.1, 0.0)
+    # The masked fraction of the sample is the area of the mask over its area
+    expected = (1 - np.cos(np.radians(0.05))) / (1 - np.cos(np.radians(0.2)))
+    assert sample_raster.masked_fraction() == pytest.approx(expected, rel=0.05)
+
+
+def test_uniform_tiles_collapse():
+    raster = MaskRaster(nside=2**8, tile_nside=2**6)
+    pixels = np.arange(raster.pixels_per_tile)
+    raster.store(pixels, np.zeros(len(pixels), dtype=bool))
+    assert raster.nbytes == 0
+    known, masked = raster.lookup(pixels)
+    assert known.all() and not masked.any()
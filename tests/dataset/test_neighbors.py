@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from cosmap.dataset.batch import RaggedColumns
+from cosmap.dataset.derived import derive_chunk, derive_sample, split_dtypes
+from cosmap.dataset.geometry import unit_vectors
+from cosmap.dataset.neighbors import NeighborIndex, chord_length, chord_to_degrees
+from cosmap.dataset.region import SampleRegion
+
+
+def angular_distance(ra, dec, ra0, dec0):
+    cos = unit_vectors(ra, dec) @ unit_vectors(ra0, dec0)
+    return np.degrees(np.arccos(np.clip(cos, -1.0, 1.0)))
+
+
+def random_catalog(rng, n, ra0=150.0, dec0=2.0, size=0.5):
+    return {
+        "ra": rng.uniform(ra0 - size, ra0 + size, n),
+        "dec": rng.uniform(dec0 - size, dec0 + size, n),
+    }
+
+
+@pytest.mark.parametrize("degrees", [0.0, 1e-4, 1.0, 45.0, 179.0])
+def test_chord_length_round_trip(degrees):
+    chord = chord_length(degrees)
+    assert chord == pytest.approx(
+        np.linalg.norm(unit_vectors(0.0, 0.0) - unit_vectors(degrees, 0.0))
+    )
+    assert chord_to_degrees(chord) == pytest.approx(degrees, abs=1e-9)
+
+
+def test_query_radius_matches_brute_force():
+    rng = np.random.default_rng(1)
+    catalog = random_catalog(rng, 2000)
+    neighbors = NeighborIndex(catalog["ra"], catalog["dec"], [0, 2000])[0]
+    points = random_catalog(rng, 20)
+    found = neighbors.query_radius(points["ra"], points["dec"], 0.05)
+    for ra, dec, rows in zip(points["ra"], points["dec"], found):
+        distances = angular_distance(catalog["ra"], catalog["dec"], ra, dec)
+        assert list(rows) == list(np.flatnonzero(distances <= 0.05))
+    single = neighbors.query_radius(points["ra"][0], points["dec"][0], 0.05)
+    assert list(single) == list(found[0])
+
+
+def test_query_knn_matches_brute_force():
+    rng = np.random.default_rng(2)
+    catalog = random_catalog(rng, 500)
+    neighbors = NeighborIndex(catalog["ra"], catalog["dec"], [0, 500])[0]
+    separations, rows = neighbors.query_knn(150.0, 2.0, k=5)
+    distances = angular_distance(catalog["ra"], catalog["dec"], 150.0, 2.0)
+    assert list(rows) == list(np.argsort(distances)[:5])
+    assert np.allclose(separations, np.sort(distances)[:5])
+
+
+def test_views_only_return_their_own_rows():
+    # Two samples, where the second one holds the objects closest to the query
+    ra = np.array([10.0, 10.5, 10.001, 10.002])
+    dec = np.zeros(4)
+    index = NeighborIndex(ra, dec, [0, 2, 4])
+    first, second = index[0], index[1]
+    assert list(first.query_radius(10.0, 0.0, 0.01)) == [0]
+    assert list(second.query_radius(10.0, 0.0, 0.01)) == [0, 1]
+    separations, rows = first.query_knn(10.0, 0.0, k=2)
+    assert list(rows) == [0, 1]
+    assert separations == pytest.approx([0.0, 0.5])
+
+
+def test_query_knn_with_too_few_objects():
+    index = NeighborIndex([10.0, 11.0], [0.0, 0.0], [0, 1, 2])
+    separations, rows = index[0].query_knn([10.0, 10.0], [0.0, 0.0], k=3)
+    assert rows.tolist() == [[0, -1, -1]] * 2
+    assert np.all(np.isinf(separations[:, 1:]))
+    empty = NeighborIndex(np.empty(0), np.empty(0), [0, 0])[0]
+    assert list(empty.query_radius(10.0, 0.0, 1.0)) == []
+
+
+def test_index_dtype():
+    base, derived = split_dtypes(["catalog", "catalog_index"])
+    assert base == ["catalog"]
+    assert derived == {"catalog_index": ("catalog", "index")}
+
+    rng = np.random.default_rng(3)
+    catalog = random_catalog(rng, 300)
+    ragged = RaggedColumns(catalog, [0, 100, 300])
+    centers = np.array([[150.0, 2.0], [150.1, 2.1]])
+    chunk = derive_chunk({"catalog": ragged}, centers, derived, ("ra", "dec"))
+    sample = derive_sample(
+        {"catalog": ragged[1]},
+        SampleRegion(150.1, 2.1, 1.0),
+        derived,
+        ("ra", "dec"),
+    )
+    # The shared index and the per-sample one find the same rows
+    for neighbors in (chunk["catalog_index"][1], sample["catalog_index"]):
+        rows = neighbors.query_radius(150.1, 2.1, 0.1)
+        distances = angular_distance(ragged[1]["ra"], ragged[1]["dec"], 150.1, 2.1)
+        assert list(rows) == list(np.flatnonzero(distances <= 0.1))
@@ -0,0 +1,121 @@
+from types import SimpleNamespace
+
+import astropy.units as u
+import numpy as np
+import pytest
+
+from cosmap.dataset.filters import RowFilter
+from cosmap.dataset.geometry import unit_vectors
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from cosmap.dataset.parquet import ParquetDataset, parquetPlugin  # noqa: E402
+
+ROW_GROUP_SIZE = 100
+
+
+class RecordingDataset(ParquetDataset):
+    # Remembers which row groups and columns were read
+    def read(self, row_groups, columns=None):
+        table = super().read(row_groups, columns)
+        self.reads.append((list(row_groups), table.column_names))
+        return table
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    rng = np.random.default_rng(5)
+    ra = np.sort(rng.uniform(0.0, 40.0, 4000))
+    return {
+        "id": np.arange(len(ra)),
+        "ra": ra,
+        "dec": rng.uniform(-10.0, 10.0, len(ra)),
+        # Increases with RA, so every row group covers a narrow redshift range
+        "redshift": ra / 20 + rng.uniform(0.0, 0.01, len(ra)),
+        "mag": rng.uniform(20.0, 25.0, len(ra)),
+    }
+
+
+@pytest.fixture(scope="module")
+def path(catalog, tmp_path_factory):
+    # One directory per partition, like a HEALPix partitioned catalog
+    root = tmp_path_factory.mktemp("catalog")
+    table = pa.table(catalog)
+    half = int(np.searchsorted(catalog["ra"], 20.0))
+    for i, part in enumerate([table.slice(0, half), table.slice(half)]):
+        directory = root / f"partition={i}"
+        directory.mkdir()
+        pq.write_table(part, directory / "part.parquet", row_group_size=ROW_GROUP_SIZE)
+    return root
+
+
+def make_dataset(path, filters=[], columns=None):
+    worker = SimpleNamespace()
+    parquetPlugin(None, path, columns, {"catalog": filters}).setup(worker)
+    dataset = worker.dataset
+    dataset.__class__ = RecordingDataset
+    dataset.reads = []
+    return dataset
+
+
+def members(catalog, center, radius):
+    vectors = unit_vectors(catalog["ra"], catalog["dec"])
+    cos = vectors @ unit_vectors(*center)
+    return catalog["id"][np.degrees(np.arccos(np.clip(cos, -1.0, 1.0))) <= radius]
+
+
+def test_row_groups_are_pruned_by_region(path, catalog):
+    dataset = make_dataset(path)
+    groups = dataset.row_groups_for_region((5.0, 0.0), 1.0)
+    assert 0 < len(groups) < 4000 // ROW_GROUP_SIZE
+    # Every group overlaps the cone in RA, and the cone loses none of its rows
+    ids = dataset.read(groups)["id"].to_numpy()
+    ra = catalog["ra"][ids]
+    assert ra.min() < 6.1 and ra.max() > 3.9
+    assert set(members(catalog, (5.0, 0.0), 1.0)) <= set(ids)
+    assert dataset.row_groups_for_region((120.0, 0.0), 1.0) == []
+
+
+def test_row_groups_are_pruned_by_filters(path, catalog):
+    dataset = make_dataset(path, [RowFilter("redshift", "<", 1.0)])
+    # Cones on opposite sides of the sky have no bounding cone
+    centers = np.array([[10.0, 0.0], [190.0, 0.0]])
+    result = dataset.query_many(centers, 5 * u.deg, ["catalog"])
+    (row_groups, _), *_ = dataset.reads
+    # The second partition starts at RA 20, so all of its rows have redshift >= 1
+    assert row_groups and all(file_index == 0 for file_index, _ in row_groups)
+    assert np.all(result["catalog"].columns["redshift"] < 1.0)
+    expected = members(catalog, (10.0, 0.0), 5.0)
+    expected = expected[catalog["redshift"][expected] < 1.0]
+    assert np.array_equal(result["catalog"][0]["id"], expected)
+    assert len(result["catalog"][1]["id"]) == 0
+
+
+def test_columns_are_projected(path):
+    dataset = make_dataset(path, [RowFilter("redshift", "<", 1.5)], columns=["id"])
+    result = dataset.query_many(
+        np.array([[10.0, 0.0]]), 2 * u.deg, ["catalog"], {"catalog": ["mag"]}
+    )
+    # The coordinates and filter columns are read, but only "mag" is returned
+    _, read_columns = dataset.reads[0]
+    assert sorted(read_columns) == ["dec", "mag", "ra", "redshift"]
+    assert list(result["catalog"].columns) == ["mag"]
+
+    result = dataset.query_many(np.array([[10.0, 0.0]]), 2 * u.deg, ["catalog"])
+    assert list(result["catalog"].columns) == ["dec", "id", "ra", "redshift"]
+
+
+def test_query_many_matches_single_cones(path, catalog):
+    dataset = make_dataset(path)
+    centers = np.array([[5.0, 0.0], [5.5, 0.5], [19.5, -3.0], [39.0, 9.0], [100.0, 0]])
+    radii = np.array([1.0, 0.5, 2.0, 1.5, 1.0]) * u.deg
+    result = dataset.query_many(centers, radii, ["catalog"])["catalog"]
+    # The overlapping cones share rows, so each gets its own copy of them
+    assert len(result) == len(centers)
+    assert result.offsets[0] == 0 and result.offsets[-1] == sum(result.counts)
+    for i, (center, radius) in enumerate(zip(centers, radii.value)):
+        expected = members(catalog, center, radius)
+        assert len(expected) > 0 or i == 4
+        assert np.array_equal(np.sort(result[i]["id"]), expected)
+        assert np.allclose(result[i]["ra"], catalog["ra"][result[i]["id"]])
@@ -0,0 +1,74 @@
+from importlib.metadata import EntryPoint
+
+import pytest
+from dask.distributed.diagnostics.plugin import WorkerPlugin
+
+from cosmap.dataset import plugins
+from cosmap.dataset.capabilities import DatasetCapability, get_capabilities
+from cosmap.dataset.parquet import parquetPlugin
+from cosmap.dataset.plugins import (
+    ENTRY_POINT_GROUP,
+    _get_dataset,
+    cachedDatasetPlugin,
+    get_known_wrappers,
+    heinleinPlugin,
+)
+
+
+class customPlugin(WorkerPlugin):
+    capabilities = DatasetCapability.BATCH_QUERIES | DatasetCapability.THREAD_SAFE
+
+    def __init__(self, name, path, **kwargs):
+        self.name = name
+        self.path = path
+        self.kwargs = kwargs
+
+
+@pytest.fixture
+def entry_points(monkeypatch):
+    found = {}
+
+    def fake_entry_points(group):
+        assert group == ENTRY_POINT_GROUP
+        return [
+            EntryPoint(name, f"{__name__}:{value}", group)
+            for name, value in found.items()
+        ]
+
+    monkeypatch.setattr(plugins, "entry_points", fake_entry_points)
+    return found
+
+
+def test_entry_points_are_discovered_lazily(entry_points):
+    entry_points.update({"custom": "customPlugin"})
+    wrappers = get_known_wrappers()
+    assert isinstance(wrappers["custom"], EntryPoint)
+    assert wrappers["parquet"] is parquetPlugin
+    wrapper = _get_dataset("custom", "name", "path", row_filters={})
+    assert isinstance(wrapper, customPlugin)
+    assert (wrapper.name, wrapper.path) == ("name", "path")
+    assert wrapper.kwargs == {"row_filters": {}}
+
+
+def test_entry_points_can_replace_built_in_wrappers(entry_points):
+    entry_points.update({"heinlein": "customPlugin"})
+    assert isinstance(get_known_wrappers()["heinlein"], EntryPoint)
+
+
+def test_unknown_wrappers_are_rejected(entry_points):
+    with pytest.raises(ValueError, match="Unknown wrapper"):
+        _get_dataset("missing", None, None)
+
+
+def test_capabilities():
+    assert get_capabilities(heinleinPlugin) == DatasetCapability.NONE
+    assert get_capabilities(object()) == DatasetCapability.NONE
+    assert DatasetCapability.THREAD_SAFE in get_capabilities(parquetPlugin)
+    # The cache layer answers batch queries and selects columns for any wrapper,
+    # and keeps what the wrapper itself can do
+    cached = cachedDatasetPlugin(customPlugin(None, None), {}, "key")
+    assert get_capabilities(cached) == (
+        DatasetCapability.BATCH_QUERIES
+        | DatasetCapability.COLUMN_PUSHDOWN
+        | DatasetCapability.THREAD_SAFE
+    )
@@ -0,0 +1,61 @@
+from pathlib import Path
+
+import pytest
+
+from cosmap.dataset.realizations import RealizationDataset, name_realizations
+
+
+class FakeRealization:
+    def __init__(self, path: Path):
+        self.path = path
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def get_realizations(n: int, max_open: int):
+    opened = []
+
+    def open_realization(path):
+        opened.append(FakeRealization(path))
+        return opened[-1]
+
+    paths = name_realizations([Path(f"/data/r{i}.hdf5") for i in range(n)])
+    return RealizationDataset(paths, open_realization, max_open), opened
+
+
+def test_realizations_are_named_after_files():
+    paths = name_realizations([Path("/a/r1.hdf5"), Path("/a/r0.hdf5")])
+    assert list(paths) == ["r0", "r1"]
+    with pytest.raises(ValueError):
+        name_realizations([Path("/a/r0.hdf5"), Path("/b/r0.hdf5")])
+
+
+def test_realizations_are_opened_once():
+    dataset, opened = get_realizations(3, max_open=2)
+    assert dataset["r0"] is dataset["r0"]
+    assert len(opened) == 1
+    with pytest.raises(KeyError):
+        dataset["r9"]
+
+
+def test_least_recently_used_realization_is_closed():
+    dataset, opened = get_realizations(3, max_open=2)
+    r0, r1 = dataset["r0"], dataset["r1"]
+    dataset["r0"]
+    dataset["r2"]
+    assert r1.closed and not r0.closed
+    assert dataset.opened == ["r0", "r2"]
+    # Reopening a closed realization opens a new copy
+    assert dataset["r1"] is not r1
+    assert r0.closed
+
+
+def test_close_closes_every_open_realization():
+    dataset, opened = get_realizations(3, max_open=3)
+    for name in ["r0", "r1", "r2"]:
+        dataset[name]
+    dataset.close()
+    assert all(r.closed for r in opened)
+    assert dataset.opened == []
@@ -0,0 +1,62 @@
+import astropy.units as u
+import numpy as np
+import pytest
+from astropy.coordinates import SkyCoord
+
+from cosmap.dataset.batch import BatchQueryAdapter, as_center_array, as_radius_array
+from cosmap.dataset.region import SampleRegion
+
+
+def test_region_stores_floats():
+    region = SampleRegion(np.float32(10.5), np.int64(-20), np.float64(0.1))
+    assert (region.ra_deg, region.dec_deg, region.radius_deg) == (10.5, -20.0, 0.1)
+    # Plain Python floats, not numpy scalars
+    for value in (region.ra_deg, region.dec_deg, region.radius_deg):
+        assert isinstance(value, float) and not isinstance(value, np.generic)
+    assert region.radius == 0.1 * u.deg
+
+
+def test_coordinate_is_built_lazily():
+    region = SampleRegion(10.0, 20.0, 1.0)
+    assert region._coordinate is None
+    coordinate = region.coordinate
+    assert isinstance(coordinate, SkyCoord)
+    assert region.coordinate is coordinate
+    assert coordinate.ra.deg == pytest.approx(10.0)
+
+
+def test_region_acts_like_a_skycoord():
+    region = SampleRegion(10.0, 20.0, 1.0)
+    assert region.dec.deg == pytest.approx(20.0)
+    assert region.frame.name == "icrs"
+    separation = region.separation(SkyCoord(10.0, 21.0, unit="deg"))
+    assert separation.deg == pytest.approx(1.0)
+    with pytest.raises(AttributeError):
+        region._missing
+
+
+def test_center_arrays():
+    coordinates = SkyCoord([1.0, 2.0], [3.0, 4.0], unit="deg")
+    assert np.allclose(as_center_array(coordinates), [[1.0, 3.0], [2.0, 4.0]])
+    centers = as_center_array([1, 3])
+    assert centers.dtype == np.float64 and centers.shape == (1, 2)
+    assert np.array_equal(as_radius_array(1 * u.arcmin, 2), [1 / 60, 1 / 60])
+    assert np.array_equal(as_radius_array([0.1, 0.2], 2), [0.1, 0.2])
+
+
+def test_adapter_hands_out_float_regions():
+    class ConeDataset:
+        def cone_search(self, center, radius, dtypes):
+            return {dtype: {"ra": np.array([center.ra.deg])} for dtype in dtypes}
+
+    adapter = BatchQueryAdapter(ConeDataset())
+    centers = np.array([[10.0, 0.0], [20.0, 5.0]])
+    samples = list(
+        adapter.get_data_from_samples(centers, ["catalog"], "cone", 2 * u.arcmin)
+    )
+    region, data = samples[1]
+    assert isinstance(region, SampleRegion)
+    assert (region.ra_deg, region.dec_deg) == (20.0, 5.0)
+    assert region.radius_deg == pytest.approx(2 / 60)
+    assert region._coordinate is None
+    assert list(data["catalog"]["ra"]) == [20.0]
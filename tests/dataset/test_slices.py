@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+from cosmap.dataset.batch import RaggedColumns
+from cosmap.dataset.filters import apply_filters
+from cosmap.dataset.slices import (
+    redshift_filters,
+    sort_chunk_by_redshift,
+    sort_sample_by_redshift,
+)
+
+BINS = np.array([0.5, 1.0, 2.0])
+
+
+def shell_redshifts(slices) -> list:
+    return [list(shell["z"]) for shell in slices]
+
+
+def test_bin_edges():
+    # Objects on an edge belong to the shell above it
+    sample = {"catalog": {"z": np.array([2.0, 1.0, 0.7, 0.5, 1.5]), "id": np.arange(5)}}
+    sliced = sort_sample_by_redshift(sample, BINS, ["catalog"], "z")
+    assert list(sliced["catalog"]["z"]) == [0.5, 0.7, 1.0, 1.5, 2.0]
+    assert list(sliced["catalog"]["id"]) == [3, 2, 1, 4, 0]
+    assert shell_redshifts(sliced["catalog_slices"]) == [[0.5, 0.7], [1.0, 1.5]]
+
+
+def test_chunk_matches_samples():
+    rng = np.random.default_rng(1)
+    counts = [5, 0, 12, 7]
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    z = rng.choice([0.2, 0.5, 0.8, 1.0, 1.3, 2.0, 2.5], offsets[-1])
+    columns = {"z": z, "id": np.arange(len(z))}
+    ragged = RaggedColumns(columns, offsets)
+
+    chunk = sort_chunk_by_redshift({"catalog": ragged}, BINS, ["catalog"], "z")
+    assert len(chunk["catalog_slices"]) == len(counts)
+    for i in range(len(counts)):
+        sample = sort_sample_by_redshift({"catalog": ragged[i]}, BINS, ["catalog"], "z")
+        assert list(chunk["catalog"][i]["id"]) == list(sample["catalog"]["id"])
+        assert shell_redshifts(chunk["catalog_slices"][i]) == shell_redshifts(
+            sample["catalog_slices"]
+        )
+        for j, shell in enumerate(chunk["catalog_slices"][i]):
+            assert np.all((shell["z"] >= BINS[j]) & (shell["z"] < BINS[j + 1]))
+
+
+def test_shells_are_views():
+    ragged = RaggedColumns({"z": np.array([1.5, 0.6])}, [0, 2])
+    chunk = sort_chunk_by_redshift({"catalog": ragged}, BINS, ["catalog"], "z")
+    shell = chunk["catalog_slices"][0][1]
+    assert np.shares_memory(shell["z"], chunk["catalog"].columns["z"])
+
+
+def test_other_dtypes_are_untouched():
+    sample = {"catalog": pd.DataFrame({"z": [1.5, 0.6]}), "halos": {"z": [3.0]}}
+    sliced = sort_sample_by_redshift(sample, BINS, ["catalog", "galaxies"], "z")
+    assert sliced["halos"] is sample["halos"]
+    assert "galaxies_slices" not in sliced
+    assert list(sliced["catalog"]["z"]) == [0.6, 1.5]
+
+
+def test_redshift_filters():
+    data = pd.DataFrame({"z": [0.4, 0.5, 1.9, 2.0]})
+    filtered = apply_filters(data, redshift_filters(BINS, "z"))
+    assert list(filtered["z"]) == [0.5, 1.9]
@@ -0,0 +1,179 @@
+import time
+
+import h5py
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from cosmap.config.analysis import CosmapOutputParameters
+from cosmap.output import get_output_handler, in_background
+from cosmap.output.output import backgroundOutputHandler
+from cosmap.output.schema import parse_schema
+from cosmap.output.writer import cosmapOutputException
+
+EXTENSIONS = {"csv": "csv", "parquet": "parquet", "hdf5": "h5"}
+
+
+def read_output(path, write_format) -> pd.DataFrame:
+    if write_format == "csv":
+        return pd.read_csv(path)
+    elif write_format == "parquet":
+        return pq.read_table(path).to_pandas()
+    with h5py.File(path, "r") as f:
+        assert f.attrs["complete"]
+        return pd.DataFrame(
+            {
+                name: (
+                    dataset.asstr()[:]
+                    if h5py.check_string_dtype(dataset.dtype)
+                    else dataset[:]
+                )
+                for name, dataset in f.items()
+            }
+        )
+
+
+def make_handler(tmp_path, write_format, run_info={}, **parameters):
+    path = tmp_path / f"output.{EXTENSIONS[write_format]}"
+    output_parameters = CosmapOutputParameters(
+        base_output_path=path, write_format=write_format, **parameters
+    )
+    handler = get_output_handler(output_parameters, run_info)
+    return in_background(handler, output_parameters), path
+
+
+def rows(start: int, stop: int) -> list:
+    return [
+        {"n": i, "kappa": i / 10, "realization": f"r{i % 2}"}
+        for i in range(start, stop)
+    ]
+
+
+@pytest.mark.parametrize("write_format", ["csv", "parquet", "hdf5"])
+def test_writers_in_background(tmp_path, write_format):
+    handler, path = make_handler(
+        tmp_path, write_format, {"expected_rows": 10}, write_batch_rows=4
+    )
+    assert isinstance(handler, backgroundOutputHandler)
+    for start in range(0, 12, 3):
+        handler.take_outputs(rows(start, start + 3))
+    handler.take_output(rows(12, 13)[0])
+    handler.close()
+    output = read_output(path, write_format)
+    assert list(output["n"]) == list(range(13))
+    assert np.allclose(output["kappa"], np.arange(13) / 10)
+    assert list(output["realization"]) == [f"r{i % 2}" for i in range(13)]
+
+
+@pytest.mark.parametrize("write_format", ["parquet", "hdf5"])
+def test_writers_with_schema(tmp_path, write_format):
+    schema = parse_schema(
+        {
+            "n": "int32",
+            "kappa": {"dtype": "float32", "unit": "deg"},
+            "profile": {"dtype": "float64", "shape": [3]},
+            "realization": "str",
+        }
+    )
+    handler, path = make_handler(tmp_path, write_format, {"schema": schema})
+    handler.take_outputs(
+        [dict(row, profile=np.full(3, row["n"])) for row in rows(0, 5)]
+    )
+    handler.close()
+    if write_format == "parquet":
+        table = pq.read_table(path)
+        assert table.schema.field("n").type == "int32"
+        assert table.schema.field("kappa").metadata == {b"unit": b"deg"}
+        profiles = np.array(table["profile"].to_pylist())
+    else:
+        with h5py.File(path, "r") as f:
+            assert f["n"].dtype == np.int32
+            assert f["kappa"].attrs["unit"] == "deg"
+            profiles = f["profile"][:]
+    assert profiles.shape == (5, 3)
+    assert np.array_equal(profiles[:, 0], np.arange(5))
+
+
+def test_outputs_can_skip_paths(tmp_path):
+    paths = {"halos": tmp_path / "halos.csv", "galaxies": tmp_path / "galaxies.csv"}
+    handler, _ = make_handler(tmp_path, "csv", output_paths=paths)
+    outputs = [{"halos": row} for row in rows(0, 3)]
+    outputs.append({"halos": rows(3, 4)[0], "galaxies": rows(0, 1)[0]})
+    handler.take_outputs(outputs)
+    handler.close()
+    assert list(read_output(paths["halos"], "csv")["n"]) == [0, 1, 2, 3]
+    assert list(read_output(paths["galaxies"], "csv")["n"]) == [0]
+
+
+@pytest.mark.parametrize("write_format", ["parquet", "hdf5"])
+def test_metadata_added_at_the_end_is_written(tmp_path, write_format):
+    run_info = {"metadata": {"n_samples": 10}}
+    handler, path = make_handler(tmp_path, write_format, run_info)
+    handler.take_outputs(rows(0, 3))
+    handler.add_metadata({"stop_reason": "Converged", "n_completed_samples": 3})
+    handler.close()
+    if write_format == "parquet":
+        metadata = pq.read_metadata(path).metadata
+        assert metadata[b"stop_reason"] == b"Converged"
+        assert metadata[b"n_completed_samples"] == b"3"
+        assert metadata[b"n_samples"] == b"10"
+    else:
+        with h5py.File(path, "r") as f:
+            assert f.attrs["stop_reason"] == "Converged"
+            assert f.attrs["n_completed_samples"] == 3
+            assert f.attrs["n_samples"] == 10
+
+
+def test_csv_rejects_array_schema(tmp_path):
+    schema = parse_schema({"profile": {"dtype": "float64", "shape": [3]}})
+    with pytest.raises(cosmapOutputException, match="array columns"):
+        make_handler(tmp_path, "csv", {"schema": schema})
+
+
+def test_writes_on_interval(tmp_path):
+    handler, path = make_handler(tmp_path, "csv", write_interval=0.05)
+    handler.take_outputs(rows(0, 3))
+    # The rows are written without being pushed out by more rows, or by closing
+    deadline = time.monotonic() + 5
+    while not path.exists() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert path.exists()
+    handler.close()
+    assert len(read_output(path, "csv")) == 3
+
+
+def test_schema_errors_reach_the_driver(tmp_path):
+    handler, _ = make_handler(tmp_path, "parquet", write_batch_rows=2)
+    # The first batch fixes the schema, which the second one doesn't fit
+    handler.take_outputs(rows(0, 2))
+    handler.take_outputs([{"n": "not a number", "kappa": 0.0, "realization": "r"}])
+    with pytest.raises(cosmapOutputException, match="schema"):
+        handler.close()
+
+
+class FailingHandler:
+    def take_outputs(self, outputs):
+        pass
+
+    def write_output(self):
+        raise RuntimeError("disk full")
+
+    def close(self):
+        pass
+
+
+def test_errors_on_the_writer_thread_reach_the_driver():
+    handler = backgroundOutputHandler(FailingHandler(), batch_rows=1)
+    handler.take_outputs(rows(0, 1))
+    with pytest.raises(RuntimeError, match="disk full"):
+        handler.close()
+
+
+def test_background_writes_can_be_turned_off(tmp_path):
+    handler, path = make_handler(tmp_path, "csv", background_writes=False)
+    assert not isinstance(handler, backgroundOutputHandler)
+    handler.take_outputs(rows(0, 2))
+    handler.write_output()
+    handler.close()
+    assert len(read_output(path, "csv")) == 2
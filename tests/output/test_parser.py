@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cosmap.output.parser import cosmapParserException, dataFrameOutputParser
+
+
+def test_append_batch_keeps_arrays():
+    parser = dataFrameOutputParser()
+    kappa = np.arange(3, dtype=np.float32)
+    parser.append_batch({"kappa": kappa, "n": [1, 2, 3]})
+    assert parser._chunks[0]["kappa"] is kappa
+    assert parser.tally == 3
+    result = parser.get()
+    assert list(result.columns) == ["kappa", "n"]
+    assert result["kappa"].dtype == np.float32
+    assert list(result["n"]) == [1, 2, 3]
+    # Getting the output clears it
+    assert parser.tally == 0 and parser.get() is None
+
+
+def test_rows_and_batches_are_combined_in_order():
+    parser = dataFrameOutputParser(chunksize=2)
+    for i in range(3):
+        parser.append({"n": i, "name": f"row{i}"})
+    parser.append_batch({"n": np.array([3, 4]), "name": np.array(["a", "b"])})
+    parser.append({"n": 5, "name": "last"})
+    result = parser.get()
+    assert list(result["n"]) == [0, 1, 2, 3, 4, 5]
+    assert list(result["name"]) == ["row0", "row1", "row2", "a", "b", "last"]
+    assert result["name"].dtype == object
+
+
+def test_dtypes_are_promoted():
+    parser = dataFrameOutputParser()
+    parser.append_batch({"x": np.array([1, 2], dtype=np.int32)})
+    parser.append_batch({"x": np.array([0.5])})
+    parser.append_batch({"x": np.array(["a"])})
+    result = parser.get()
+    assert result["x"].dtype == object
+    assert list(result["x"]) == [1, 2, 0.5, "a"]
+
+
+def test_array_values_are_kept_per_row():
+    parser = dataFrameOutputParser()
+    parser.append_batch({"profile": np.zeros((2, 3))})
+    result = parser.get()
+    assert result["profile"].dtype == object
+    assert result["profile"][0].shape == (3,)
+
+
+def test_series_are_accepted():
+    parser = dataFrameOutputParser()
+    parser.append_batch({"x": pd.Series([1.0, 2.0])})
+    assert list(parser.get()["x"]) == [1.0, 2.0]
+
+
+def test_mismatched_columns_are_rejected():
+    parser = dataFrameOutputParser()
+    parser.append_batch({"x": [1.0], "y": [2.0]})
+    with pytest.raises(cosmapParserException, match="expected"):
+        parser.append_batch({"x": [1.0]})
+    # The columns are kept when the parser is cleared
+    parser.clear()
+    with pytest.raises(cosmapParserException, match="expected"):
+        parser.append_batch({"x": [1.0], "z": [2.0]})
+
+
+def test_columns_must_have_the_same_length():
+    parser = dataFrameOutputParser()
+    with pytest.raises(cosmapParserException, match="same length"):
+        parser.append_batch({"x": [1.0, 2.0], "y": [1.0]})
@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+
+from cosmap.output.parser import dataFrameOutputParser
+from cosmap.output.schema import (
+    column_dtype,
+    cosmapSchemaException,
+    outputColumn,
+    parse_schema,
+)
+
+SCHEMA = {
+    "n_galaxies": "int64",
+    "kappa": {"dtype": "float32", "unit": "deg"},
+    "profile": {"dtype": "float32", "shape": [3]},
+    "name": "str",
+}
+
+
+def test_parse_schema():
+    schema = parse_schema(SCHEMA)
+    assert schema.names == ["n_galaxies", "kappa", "profile", "name"]
+    assert schema["kappa"].unit == "deg"
+    assert schema.has_arrays
+    assert schema.to_dict()["profile"] == {"dtype": "float32", "shape": [3]}
+    assert parse_schema(schema.to_dict()).to_dict() == schema.to_dict()
+
+
+@pytest.mark.parametrize(
+    "spec, message",
+    [
+        ({"x": "nonsense"}, "Unknown dtype"),
+        ({"x": "complex128"}, "numbers, booleans or strings"),
+        ({"x": {"dtype": "float64", "shape": [0]}}, "Invalid shape"),
+        ({"x": {"dtype": "str", "shape": [2]}}, "Invalid shape"),
+        ({"x": {"shape": [2]}}, "must be a dtype"),
+        ({"x": {"dtype": "float64", "units": "deg"}}, "Unknown keys"),
+    ],
+)
+def test_bad_schemas_are_rejected(spec, message):
+    with pytest.raises(cosmapSchemaException, match=message):
+        parse_schema(spec)
+
+
+def test_values_are_cast():
+    schema = parse_schema(SCHEMA)
+    assert schema["n_galaxies"].cast([1, 2]).dtype == np.int64
+    assert schema["kappa"].cast(np.array([1, 2])).dtype == np.float32
+    assert schema["profile"].cast(np.zeros((2, 3))).shape == (2, 3)
+    assert schema["name"].cast(["a", "b"]).dtype == object
+
+
+@pytest.mark.parametrize(
+    "name, values, message",
+    [
+        ("n_galaxies", [1.5, 2.0], "expects int64"),
+        ("profile", np.zeros((2, 4)), "shape"),
+        ("profile", [np.zeros(3), np.zeros(2)], "inconsistent shapes"),
+        ("name", [1, 2], "expects strings"),
+    ],
+)
+def test_bad_values_are_rejected(name, values, message):
+    with pytest.raises(cosmapSchemaException, match=message):
+        parse_schema(SCHEMA)[name].cast(values)
+
+
+def test_with_columns_keeps_declared_columns():
+    schema = parse_schema({"n": "int64", "realization": "int64"})
+    schema = schema.with_columns({"realization": "str", "cut": "float64"})
+    assert schema.names == ["n", "realization", "cut"]
+    assert not schema["realization"].is_string
+
+
+def test_for_apertures():
+    schema = parse_schema(SCHEMA).for_apertures(["1arcmin", "2arcmin"])
+    assert schema.names[:4] == [
+        "n_galaxies_1arcmin",
+        "kappa_1arcmin",
+        "profile_1arcmin",
+        "name_1arcmin",
+    ]
+    assert schema["profile_2arcmin"].shape == (3,)
+    assert schema["kappa_2arcmin"].unit == "deg"
+    assert schema["name_2arcmin"].is_string
+
+
+def test_column_dtype():
+    assert column_dtype("cut", [1.0, 2.0]) == "float64"
+    assert column_dtype("label", ["a", "b"]) == "str"
+    with pytest.raises(cosmapSchemaException):
+        column_dtype("cut", [[1.0], [2.0]])
+
+
+def test_parser_casts_to_the_schema():
+    parser = dataFrameOutputParser(schema=parse_schema(SCHEMA))
+    parser.append_batch(
+        {
+            "n_galaxies": np.array([1, 2], dtype=np.int32),
+            "kappa": [0.1, 0.2],
+            "profile": np.ones((2, 3)),
+            "name": ["a", "b"],
+        }
+    )
+    parser.append({"n_galaxies": 3, "kappa": 0.3, "profile": np.zeros(3), "name": "c"})
+    result = parser.get()
+    assert list(result.columns) == ["n_galaxies", "kappa", "profile", "name"]
+    assert result["n_galaxies"].dtype == np.int64
+    assert result["kappa"].dtype == np.float32
+    assert result["profile"][2].dtype == np.float32
+
+
+def test_parser_rejects_batches_that_dont_fit():
+    parser = dataFrameOutputParser(schema=parse_schema({"n": "int64"}))
+    with pytest.raises(cosmapSchemaException):
+        parser.append_batch({"n": [0.5]})
+    assert parser.get() is None
+
+
+def test_strings_column_type():
+    column = outputColumn("name", "string")
+    assert column.is_string and column.to_dict() == {"dtype": "str"}